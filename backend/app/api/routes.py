@@ -1,21 +1,63 @@
 """API路由"""
 import os
 import json
+import re
+import hashlib
 import time
-from typing import List, Optional
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import StreamingResponse
+import asyncio
+import shutil
+import tempfile
+from functools import lru_cache
+from typing import List, Optional, Union
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Header, Query, Depends, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile as FormFile
 import io
 
 from ..models import (
     OCRConfig,
+    OCRRouterConfig,
     LLMConfig,
+    LLMRouterConfig,
     AppConfig,
     RecognitionResult,
     BatchRecognitionResult,
+    ArchiveMemberResult,
+    ArchiveRecognitionResult,
+    StoredResult,
+    StoredResultPage,
+    VoucherData,
+    VoucherList,
+    VoucherValidation,
+    BatchInfo,
+    BatchInfoPage,
+    ExportRequest,
+    WorkbookAppendRequest,
+    WorkbookAppendResult,
+    WorkbookInfo,
     SubjectInfo,
 )
-from ..services import OCRService, LLMService, ExcelService
+from ..services import OCRService, OCRRouter, OCRRouterMember, LLMService, LLMRouter, RouterMember, ExcelService, PDFService, ArchiveService, ResultsStore, ExportCache, WorkbookService, ThumbnailService, UploadStore, IdempotencyStore, UsageStore, TextNormalizer
+from ..services.thumbnail_service import ThumbnailError
+from ..services.upload_store import safe_ext
+from ..services.usage_store import KINDS as USAGE_KINDS
+from ..services.archive_service import ArchiveError, ArchiveLimitError
+from ..services.pdf_service import PdfPage, is_pdf
+from ..services.llm_service import LLMAnswer, VoucherParseError, cascade_stats, parse_stats
+from ..services.ocr_service import ocr_cascade_stats
+from ..services.prompt_budget import model_family, prompt_stats
+from ..services.dedup_service import DedupIndex, exact_hash, fingerprint
+from ..services.export_cache import content_key
+from ..services.excel_service import load_columns
+from ..services.workbook_service import WorkbookError, append_vouchers
+from ..services.validation_service import validate_vouchers
+from ..config import get_settings
+from ..utils.circuit_breaker import CircuitBreaker, breaker_registry
+from ..utils.rate_limiter import AsyncRateLimiter
+from ..utils.admission import AdmissionController, AdmissionRejected, RequestTooLarge
+from ..utils.scheduler import BATCH, INTERACTIVE, LANES, PriorityScheduler, reserved_slots, set_lane
+from ..utils.json_response import RawJSONResponse, dump_json, dump_result, join_results
 from ..data import get_subjects_list, ACCOUNTING_SUBJECTS
 from ..utils.logger import get_logger, get_ocr_logger, get_llm_logger
 
@@ -26,9 +68,102 @@ llm_logger = get_llm_logger()
 router = APIRouter()
 
 # 全局服务实例（使用global关键字以便在main.py中修改）
-ocr_service: Optional[OCRService] = None
-llm_service: Optional[LLMService] = None
-excel_service = ExcelService()
+ocr_service: Optional[Union[OCRService, OCRRouter]] = None
+llm_service: Optional[Union[LLMService, LLMRouter]] = None
+excel_service = ExcelService(
+    columns=load_columns(get_settings().excel_columns_file) if get_settings().excel_columns_file else None
+)
+
+# 跨批次图片去重索引（记录最近识别成功的图片）
+dedup_index = DedupIndex(
+    max_entries=get_settings().dedup_history_size,
+    phash_threshold=get_settings().dedup_phash_threshold,
+)
+
+# OCR/大模型调用调度：单张识别（交互）优先于批量和后台任务，同一通道内各租户轮流
+ocr_scheduler = PriorityScheduler(
+    get_settings().ocr_concurrency,
+    weights=get_settings().scheduler_weights,
+    reserved=reserved_slots(get_settings().ocr_concurrency, get_settings().interactive_reserved_share),
+)
+llm_scheduler = PriorityScheduler(
+    get_settings().llm_concurrency,
+    weights=get_settings().scheduler_weights,
+    reserved=reserved_slots(get_settings().llm_concurrency, get_settings().interactive_reserved_share),
+)
+
+# PDF多页并行识别（OCR调用频率受 ocr_qps 限制）
+pdf_service = PDFService(
+    dpi=get_settings().pdf_dpi,
+    concurrency=get_settings().pdf_ocr_concurrency,
+    rate_limiter=AsyncRateLimiter(get_settings().ocr_qps, burst=max(1, int(get_settings().ocr_qps))),
+    scheduler=ocr_scheduler,
+)
+
+# 识别结果库
+results_store: Optional[ResultsStore] = (
+    ResultsStore(get_settings().results_db_path) if get_settings().results_store_enabled else None
+)
+
+# 导出文件缓存（相同内容的导出直接返回已生成的文件）
+export_cache: Optional[ExportCache] = (
+    ExportCache(get_settings().export_cache_dir, max_size=get_settings().export_cache_max_size)
+    if get_settings().export_cache_enabled else None
+)
+
+# 服务端保存的工作簿（追加导出），同一工作簿的追加串行执行
+workbook_service = WorkbookService(get_settings().workbook_dir)
+workbook_locks: dict[str, asyncio.Lock] = {}
+
+# 识别请求准入控制（处理中的文件数、缓冲的请求体字节数）
+admission = AdmissionController(
+    max_files=get_settings().admission_max_files,
+    max_bytes=get_settings().admission_max_bytes,
+    max_queue=get_settings().admission_queue_size,
+    max_wait=get_settings().admission_max_wait,
+)
+
+# 识别请求的幂等记录（Idempotency-Key）
+idempotency_store: Optional[IdempotencyStore] = (
+    IdempotencyStore(
+        get_settings().idempotency_db_path,
+        ttl=get_settings().idempotency_ttl,
+        pending_timeout=get_settings().idempotency_pending_timeout,
+    )
+    if get_settings().idempotency_enabled else None
+)
+
+# 调用大模型前的OCR文本规范化
+text_normalizer: Optional[TextNormalizer] = (
+    TextNormalizer(get_settings().ocr_boilerplate_patterns) if get_settings().ocr_normalize_enabled else None
+)
+
+# 用量记账：大模型token和OCR计费调用按天、提供商/模型汇总，按每日预算限额
+usage_store: Optional[UsageStore] = (
+    UsageStore(
+        get_settings().usage_db_path,
+        llm_budgets=get_settings().llm_daily_token_budgets,
+        ocr_budgets=get_settings().ocr_daily_call_budgets,
+        soft_ratio=get_settings().usage_soft_limit_ratio,
+        llm_prices=get_settings().llm_token_prices,
+        ocr_prices=get_settings().ocr_call_prices,
+    )
+    if get_settings().usage_enabled else None
+)
+
+# 上传文件存储（按内容哈希命名，后台按引用和保留期清理）
+upload_store = UploadStore(
+    get_settings().upload_dir,
+    retention_days=get_settings().upload_retention_days,
+    orphan_grace=get_settings().upload_orphan_grace,
+)
+
+# 上传图片的缩略图/预览图（按需生成并缓存）
+thumbnail_service = ThumbnailService(
+    get_settings().upload_dir,
+    get_settings().thumbnail_dir,
+    max_workers=get_settings().thumbnail_workers,
+)
 
 # 当前配置存储
 current_config: dict = {
@@ -37,7 +172,7 @@ current_config: dict = {
 }
 
 
-def get_ocr_service() -> OCRService:
+def get_ocr_service() -> Union[OCRService, OCRRouter]:
     """获取OCR服务实例"""
     global ocr_service
     if ocr_service is None:
@@ -45,7 +180,7 @@ def get_ocr_service() -> OCRService:
     return ocr_service
 
 
-def get_llm_service() -> LLMService:
+def get_llm_service() -> Union[LLMService, LLMRouter]:
     """获取LLM服务实例"""
     global llm_service
     if llm_service is None:
@@ -53,12 +188,27 @@ def get_llm_service() -> LLMService:
     return llm_service
 
 
+def referenced_uploads() -> Optional[set[str]]:
+    """被识别结果引用的上传文件名；未启用结果库时引用情况未知，返回None"""
+    if results_store is None:
+        return None
+    return results_store.referenced_files()
+
+
+def set_ocr_service(service: Union[OCRService, OCRRouter]):
+    """替换OCR服务实例（停止旧路由的后台健康探测）"""
+    global ocr_service
+    if isinstance(ocr_service, OCRRouter):
+        ocr_service.stop_probing()
+    ocr_service = service
+
+
 # ============ 配置相关API ============
 
 @router.post("/config/ocr", summary="配置OCR服务")
 async def configure_ocr(config: OCRConfig):
     """配置OCR服务（只接收key，其他使用默认值）"""
-    global ocr_service, current_config
+    global current_config
     from ..config import get_settings
     
     settings = get_settings()
@@ -68,18 +218,22 @@ async def configure_ocr(config: OCRConfig):
         provider = config.provider if (config.provider and config.provider.strip()) else settings.ocr_provider
         endpoint = config.endpoint if (config.endpoint and config.endpoint.strip()) else settings.ocr_endpoint
         
-        ocr_service = OCRService(
+        service = OCRService(
             provider=provider,
             api_key=config.api_key,
             secret_key=config.secret_key,
             endpoint=endpoint,
+            usage=usage_store,
+            cascade=config.cascade,
         )
+        set_ocr_service(service)
         
         current_config["ocr"] = {
             "provider": provider,
             "api_key": config.api_key,
             "secret_key": config.secret_key,
             "endpoint": endpoint,
+            "cascade": service.cascade is not None,
         }
         
         logger.info(f"OCR服务配置成功 - Provider: {provider}")
@@ -91,6 +245,70 @@ async def configure_ocr(config: OCRConfig):
         raise HTTPException(status_code=500, detail=f"OCR配置失败: {str(e)}")
 
 
+@router.post("/config/ocr/router", summary="配置多提供商OCR路由")
+async def configure_ocr_router(config: OCRRouterConfig):
+    """配置多个OCR提供商，按顺序/成本/延迟故障切换，并带熔断和健康探测"""
+    global current_config
+    from ..config import get_settings
+    
+    settings = get_settings()
+    
+    try:
+        members = []
+        member_configs = []
+        for member_config in config.providers:
+            provider = member_config.provider.strip() if member_config.provider else settings.ocr_provider
+            endpoint = member_config.endpoint if (member_config.endpoint and member_config.endpoint.strip()) else None
+            if endpoint is None and provider == settings.ocr_provider:
+                endpoint = settings.ocr_endpoint
+            
+            members.append(OCRRouterMember(
+                OCRService(
+                    provider=provider,
+                    api_key=member_config.api_key,
+                    secret_key=member_config.secret_key,
+                    endpoint=endpoint,
+                    usage=usage_store,
+                    cascade=member_config.cascade,
+                ),
+                breaker=breaker_registry.get(
+                    f"ocr-router:{provider}",
+                    failure_threshold=settings.ocr_router_failure_threshold,
+                    recovery_timeout=settings.ocr_router_recovery_timeout,
+                ),
+                cost=member_config.cost,
+            ))
+            member_configs.append({
+                "provider": provider,
+                "api_key": member_config.api_key,
+                "secret_key": member_config.secret_key,
+                "endpoint": endpoint,
+                "cost": member_config.cost,
+                "cascade": members[-1].service.cascade is not None,
+            })
+        
+        router_service = OCRRouter(members, mode=config.mode)
+        set_ocr_service(router_service)
+        router_service.start_probing(settings.ocr_probe_interval)
+        
+        current_config["ocr"] = {
+            "provider": "router",
+            "mode": config.mode,
+            "providers": member_configs,
+        }
+        
+        providers = [member.name for member in members]
+        logger.info(f"OCR路由配置成功 - 提供商: {providers}, 模式: {config.mode}")
+        ocr_logger.info(f"OCR路由配置更新 - 提供商: {providers}, 模式: {config.mode}")
+        
+        return {"message": "OCR路由配置成功", "providers": providers, "mode": config.mode}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"OCR路由配置失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"OCR路由配置失败: {str(e)}")
+
+
 @router.post("/config/llm", summary="配置大模型服务")
 async def configure_llm(config: LLMConfig):
     """配置大模型服务（只接收key，其他使用默认值）"""
@@ -110,6 +328,8 @@ async def configure_llm(config: LLMConfig):
             api_key=config.api_key,
             model=model,
             endpoint=endpoint,
+            usage=usage_store,
+            cascade=config.cascade,
         )
         
         current_config["llm"] = {
@@ -117,6 +337,7 @@ async def configure_llm(config: LLMConfig):
             "api_key": config.api_key,
             "model": model,
             "endpoint": endpoint,
+            "tiers": llm_service.tiers,
         }
         
         logger.info(f"大模型服务配置成功 - Provider: {provider}, Model: {llm_service.model}")
@@ -136,6 +357,69 @@ async def configure_llm(config: LLMConfig):
         raise HTTPException(status_code=500, detail=f"大模型配置失败: {str(e)}")
 
 
+@router.post("/config/llm/router", summary="配置多提供商大模型路由")
+async def configure_llm_router(config: LLMRouterConfig):
+    """配置多个大模型提供商，按权重和健康度路由，并支持对冲请求和故障切换"""
+    global llm_service, current_config
+    from ..config import get_settings, LLM_ENDPOINTS, DEFAULT_MODELS
+    
+    settings = get_settings()
+    
+    try:
+        members = []
+        member_configs = []
+        for member_config in config.providers:
+            provider = member_config.provider.strip() if member_config.provider else settings.llm_provider
+            model = member_config.model if (member_config.model and member_config.model.strip()) else DEFAULT_MODELS.get(provider)
+            endpoint = member_config.endpoint if (member_config.endpoint and member_config.endpoint.strip()) else LLM_ENDPOINTS.get(provider)
+            
+            members.append(RouterMember(
+                LLMService(
+                    provider=provider,
+                    api_key=member_config.api_key,
+                    model=model,
+                    endpoint=endpoint,
+                    usage=usage_store,
+                    cascade=member_config.cascade,
+                ),
+                weight=member_config.weight,
+                window=settings.llm_health_window,
+            ))
+            member_configs.append({
+                "provider": provider,
+                "api_key": member_config.api_key,
+                "model": model,
+                "endpoint": endpoint,
+                "weight": member_config.weight,
+                "tiers": members[-1].service.tiers,
+            })
+        
+        hedge_enabled = settings.llm_hedge_enabled if config.hedge_enabled is None else config.hedge_enabled
+        llm_service = LLMRouter(
+            members,
+            hedge_enabled=hedge_enabled,
+            hedge_delay=settings.llm_hedge_delay,
+        )
+        
+        current_config["llm"] = {
+            "provider": "router",
+            "hedge_enabled": hedge_enabled,
+            "providers": member_configs,
+        }
+        
+        logger.info(f"大模型路由配置成功 - 提供商: {llm_service.model}, 对冲: {hedge_enabled}")
+        llm_logger.info(f"LLM路由配置更新 - 提供商: {llm_service.model}, 对冲: {hedge_enabled}")
+        
+        return {
+            "message": "大模型路由配置成功",
+            "providers": [member.name for member in members],
+            "hedge_enabled": hedge_enabled,
+        }
+    except Exception as e:
+        logger.error(f"大模型路由配置失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"大模型路由配置失败: {str(e)}")
+
+
 @router.get("/config", summary="获取当前配置")
 async def get_config():
     """获取当前配置（隐藏敏感信息）"""
@@ -147,12 +431,26 @@ async def get_config():
             ocr_conf["api_key"] = ocr_conf["api_key"][:8] + "****"
         if ocr_conf.get("secret_key"):
             ocr_conf["secret_key"] = ocr_conf["secret_key"][:8] + "****"
+        if ocr_conf.get("providers"):
+            ocr_conf["providers"] = [
+                {
+                    **member,
+                    "api_key": member["api_key"][:8] + "****",
+                    "secret_key": member["secret_key"][:8] + "****" if member.get("secret_key") else None,
+                }
+                for member in ocr_conf["providers"]
+            ]
         result["ocr"] = ocr_conf
     
     if current_config["llm"]:
         llm_conf = current_config["llm"].copy()
         if llm_conf.get("api_key"):
             llm_conf["api_key"] = llm_conf["api_key"][:8] + "****"
+        if llm_conf.get("providers"):
+            llm_conf["providers"] = [
+                {**member, "api_key": member["api_key"][:8] + "****"}
+                for member in llm_conf["providers"]
+            ]
         result["llm"] = llm_conf
     
     return result
@@ -160,83 +458,408 @@ async def get_config():
 
 # ============ 识别相关API ============
 
-@router.post("/recognize/single", response_model=RecognitionResult, summary="识别单张凭证")
-async def recognize_single(file: UploadFile = File(...)):
+def _validations(vouchers: List[Union[VoucherData, dict, None]]) -> List[VoucherValidation]:
+    """整批校验凭证数据"""
+    return [
+        VoucherValidation(
+            valid=check.valid,
+            issues=check.issues,
+            codes=check.codes,
+            debit_total=check.debit_total,
+            credit_total=check.credit_total,
+        )
+        for check in validate_vouchers(vouchers).checks()
+    ]
+
+
+def _validate_results(results: List[RecognitionResult]) -> int:
+    """
+    整批校验识别成功的结果，回填 validation
+    
+    Returns:
+        未通过校验的结果数
+    """
+    recognized = [result for result in results if result.success and result.voucher_data]
+    if not recognized:
+        return 0
+    for result, validation in zip(recognized, _validations([result.voucher_data for result in recognized])):
+        result.validation = validation
+    invalid_count = sum(1 for result in recognized if not result.validation.valid)
+    if invalid_count:
+        logger.warning(f"凭证校验 - 共 {len(recognized)} 张, 未通过: {invalid_count}")
+    return invalid_count
+
+
+async def _store_results(
+    source: str,
+    results: List[RecognitionResult],
+    ocr,
+    llm,
+    filename: Optional[str] = None,
+) -> Optional[str]:
+    """
+    校验识别结果并保存到结果库，回填 validation 和 result_id
+    
+    保存失败只记录日志，不影响识别结果返回。
+    
+    Returns:
+        批次ID，未启用结果库或保存失败时为None
+    """
+    _validate_results(results)
+    if results_store is None or not results:
+        return None
+    try:
+        batch_id, ids = await asyncio.to_thread(
+            results_store.save_batch,
+            source,
+            # 凭证对象原样传给结果库序列化，不先转换为dict
+            [
+                {**result.model_dump(exclude={"voucher_data", "validation"}), "voucher_data": result.voucher_data}
+                for result in results
+            ],
+            filename=filename,
+            ocr_provider=getattr(ocr, "provider_name", None),
+            # 结果中没有实际模型（识别失败等）时：单一服务记录其配置，路由无法确定是哪个提供商，不记录
+            llm_provider=None if isinstance(llm, LLMRouter) else getattr(llm, "provider", None),
+            llm_model=None if isinstance(llm, LLMRouter) else getattr(llm, "model", None),
+        )
+    except Exception as e:
+        logger.error(f"保存识别结果失败 - 来源: {source}, 错误: {str(e)}", exc_info=True)
+        return None
+    for result, result_id in zip(results, ids):
+        result.result_id = result_id
+    return batch_id
+
+
+RESULT_FIELDS_DESCRIPTION = "只返回识别结果的指定字段（逗号分隔，如 filename,success,voucher_data,error），默认全部字段"
+
+# 可选择的识别结果字段（含 thumbnail_url 等计算字段）
+RESULT_FIELDS = frozenset(RecognitionResult.model_fields) | frozenset(
+    RecognitionResult.__pydantic_decorators__.computed_fields
+)
+
+
+def _result_fields(fields: Optional[str]) -> Optional[set]:
+    """解析 fields 参数（逗号分隔的识别结果字段名）"""
+    names = {name.strip() for name in (fields or "").split(",") if name.strip()}
+    if not names:
+        return None
+    unknown = names - RESULT_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知的结果字段: {', '.join(sorted(unknown))}")
+    return names
+
+
+def _admit_uploads(check_file_size: bool = True):
+    """
+    识别接口的准入依赖：按上传文件数申请处理容量，请求结束后归还
+
+    Args:
+        check_file_size: 是否检查单个文件不超过 max_file_size（压缩包按请求体上限控制）
+    """
+    async def dependency(request: Request):
+        # 表单在进入依赖之前已解析，这里取到的是同一份
+        form = await request.form()
+        uploads = [value for _, value in form.multi_items() if isinstance(value, FormFile)]
+        if check_file_size:
+            limit = get_settings().max_file_size
+            for upload in uploads:
+                if upload.size is not None and upload.size > limit:
+                    raise HTTPException(
+                        status_code=413, detail=f"文件 {upload.filename} 超过大小上限 {limit} bytes"
+                    )
+        try:
+            await admission.acquire(files=len(uploads))
+        except RequestTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except AdmissionRejected as e:
+            logger.warning(f"识别请求被拒绝 - {request.url.path}, 文件数: {len(uploads)}, {admission.snapshot()}")
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        try:
+            yield
+        finally:
+            admission.release(files=len(uploads))
+    return dependency
+
+
+def _priority_lane(lane: str):
+    """
+    识别接口的调度依赖：设置本次请求的OCR/大模型调度通道和租户
+
+    租户取 X-Tenant-ID 请求头，没有时按客户端IP；
+    客户端可以用 X-Priority 把请求降到更低的通道（如后台重新识别），不能提升。
+    """
+    async def dependency(
+        request: Request,
+        x_tenant_id: Optional[str] = Header(None),
+        x_priority: Optional[str] = Header(None),
+    ):
+        requested = (x_priority or "").strip().lower()
+        effective = requested if requested in LANES and LANES.index(requested) > LANES.index(lane) else lane
+        tenant = x_tenant_id or (request.client.host if request.client else "unknown")
+        set_lane(effective, tenant)
+    return dependency
+
+
+async def _ocr_recognize(ocr, image_data: bytes) -> str:
+    """按当前请求的优先级占用OCR容量后识别"""
+    async with ocr_scheduler.slot():
+        return await ocr.recognize(image_data)
+
+
+async def _llm_recognize(llm, ocr_text: str) -> LLMAnswer:
+    """规范化OCR文本，按当前请求的优先级占用大模型容量后提取凭证（结果中保留原始OCR文本）"""
+    if text_normalizer is not None:
+        normalized = text_normalizer.normalize(ocr_text, model_family(llm.provider, llm.model))
+        if normalized.chars_saved:
+            llm_logger.info(
+                f"OCR文本规范化 - 字符: {normalized.chars_before} -> {normalized.chars_after}, "
+                f"估算tokens: {normalized.tokens_before} -> {normalized.tokens_after}"
+            )
+        ocr_text = normalized.text or ocr_text
+    async with llm_scheduler.slot():
+        return await llm.recognize(ocr_text)
+
+
+async def _is_pdf_upload(file: UploadFile) -> bool:
+    """根据文件头判断上传文件是否为PDF（不改变读取位置）"""
+    head = await file.read(8)
+    await file.seek(0)
+    return is_pdf(head)
+
+
+def _save_pdf_page(page: PdfPage) -> str:
+    """保存PDF页面图片到uploads目录，返回文件名"""
+    return upload_store.save(page.image_data, page.image_ext)
+
+
+async def _recognize_pdf(ocr, llm, filename: str, fileobj, group_mode: str = "auto") -> List[RecognitionResult]:
+    """
+    识别多页PDF
+    
+    PDF先流式写入临时文件，逐页提取图片并行OCR，再按凭证分组，每组调用一次大模型。
+    
+    Args:
+        filename: 原始文件名
+        fileobj: PDF文件对象（从当前位置读取）
+    """
+    start_time = time.time()
+    tmp_path = None
+    file_hash = None
+    
+    def copy_to(tmp) -> str:
+        digest = hashlib.sha256()
+        while chunk := fileobj.read(1024 * 1024):
+            digest.update(chunk)
+            tmp.write(chunk)
+        return digest.hexdigest()
+    
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp_path = tmp.name
+            file_hash = await asyncio.to_thread(copy_to, tmp)
+        
+        pages = await pdf_service.ocr_pages(tmp_path, ocr, save_page=_save_pdf_page)
+        groups = pdf_service.group_pages(pages, group_mode)
+        ocr_time = time.time() - start_time
+        ocr_logger.info(
+            f"PDF OCR完成 - 文件: {filename}, 页数: {len(pages)}, 凭证数: {len(groups)}, "
+            f"耗时: {ocr_time:.2f}s"
+        )
+    except Exception as e:
+        logger.error(f"PDF识别失败 - 文件: {filename}, 错误: {str(e)}", exc_info=True)
+        return [RecognitionResult(success=False, filename=filename, file_hash=file_hash, error=f"PDF处理失败: {str(e)}")]
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+    
+    if not pages:
+        return [RecognitionResult(success=False, filename=filename, file_hash=file_hash, error="PDF没有页面")]
+    
+    results = []
+    for group in groups:
+        page_numbers = group.page_numbers
+        page_label = f"第{page_numbers[0]}页" if len(page_numbers) == 1 else f"第{page_numbers[0]}-{page_numbers[-1]}页"
+        first_page = group.pages[0]
+        base = {
+            "filename": f"{filename}#{page_label}" if len(groups) > 1 else filename,
+            "image_url": f"/uploads/{first_page.saved_name}" if first_page.saved_name else None,
+            "pages": page_numbers,
+            # 各页图片都记录下来，上传文件清理时按引用保留
+            "page_image_urls": [f"/uploads/{page.saved_name}" if page.saved_name else None for page in group.pages],
+            "file_hash": file_hash,
+            # 各页并行识别，OCR耗时按整份PDF计
+            "ocr_time": round(ocr_time, 3),
+        }
+        
+        errors = [f"第{page.number}页: {page.error}" for page in group.pages if page.error]
+        if len(errors) == len(group.pages):
+            results.append(RecognitionResult(success=False, error="OCR识别失败: " + "; ".join(errors), **base))
+            continue
+        
+        ocr_text = group.ocr_text
+        if not ocr_text.strip():
+            results.append(RecognitionResult(success=False, error="OCR未识别到任何文字", **base))
+            continue
+        
+        llm_start = time.time()
+        try:
+            answer = await _llm_recognize(llm, ocr_text)
+            voucher_data = answer.voucher
+            llm_time = round(time.time() - llm_start, 3)
+            llm_logger.info(f"PDF LLM完成 - 文件: {base['filename']}, 耗时: {llm_time:.2f}s")
+        except VoucherParseError as e:
+            results.append(RecognitionResult(
+                success=False, ocr_text=ocr_text, error=str(e), llm_time=round(time.time() - llm_start, 3), **base
+            ))
+            continue
+        except Exception as e:
+            logger.error(f"PDF LLM识别失败 - 文件: {base['filename']}, 错误: {str(e)}", exc_info=True)
+            results.append(RecognitionResult(success=False, ocr_text=ocr_text, error=str(e), **base))
+            continue
+        
+        results.append(RecognitionResult(
+            success=True, ocr_text=ocr_text, voucher_data=voucher_data, llm_time=llm_time,
+            llm_provider=answer.provider, llm_model=answer.model, **base
+        ))
+    
+    return results
+
+
+@router.post(
+    "/recognize/single", response_model=RecognitionResult, summary="识别单张凭证",
+    dependencies=[Depends(_admit_uploads()), Depends(_priority_lane(INTERACTIVE))],
+)
+async def recognize_single(
+    file: UploadFile = File(...),
+    include_ocr_text: bool = Form(True, description="响应中是否包含OCR文本（不展示原文的客户端可关闭以减少传输）"),
+    fields: Optional[str] = Form(None, description=RESULT_FIELDS_DESCRIPTION),
+):
     """
     识别单张凭证图片
     
     1. 调用OCR识别图片文字
     2. 调用大模型提取结构化数据
+    
+    上传PDF时，所有页面合并为一张凭证识别。
     """
+    selected = _result_fields(fields)
+    result = await _recognize_single(file)
+    return RawJSONResponse(dump_result(result, include_ocr_text, selected))
+
+
+async def _recognize_single(file: UploadFile) -> RecognitionResult:
+    """识别单张凭证（含PDF），返回识别结果"""
     start_time = time.time()
     ocr = get_ocr_service()
     llm = get_llm_service()
     
+    if await _is_pdf_upload(file):
+        logger.info(f"开始识别PDF凭证 - 文件名: {file.filename}, 大小: {file.size} bytes")
+        results = await _recognize_pdf(ocr, llm, file.filename, file.file, group_mode="document")
+        await _store_results("single", results, ocr, llm)
+        return results[0]
+    
     logger.info(f"开始识别单张凭证 - 文件名: {file.filename}, 大小: {file.size} bytes")
+    saved_filename = None
     
     try:
         # 读取文件
         image_data = await file.read()
         
-        # 保存文件到uploads目录（用于后续显示缩略图）
         from ..config import get_settings
         settings = get_settings()
-        import uuid
-        # 生成唯一文件名，避免重名
-        file_ext = os.path.splitext(file.filename or '')[-1] or '.jpg'
-        saved_filename = f"{uuid.uuid4().hex}{file_ext}"
-        saved_path = os.path.join(settings.upload_dir, saved_filename)
-        with open(saved_path, 'wb') as f:
-            f.write(image_data)
+        
+        # 与之前识别过的图片内容相同时直接复用结果；只是相似时仍正常识别，标记为疑似重复
+        fp = None
+        similar = None
+        if settings.dedup_enabled:
+            fp = await asyncio.to_thread(fingerprint, image_data)
+            file_hash = fp.exact
+            match = dedup_index.find(fp)
+            if match:
+                original_filename, original = match
+                logger.info(f"重复图片，复用 {original_filename} 的识别结果 - {file.filename}")
+                result = _duplicate_result(original, file.filename, original_filename, file_hash)
+                await _store_results("single", [result], ocr, llm)
+                return result
+            similar = _find_similar(fp, file.filename)
+        else:
+            file_hash = await asyncio.to_thread(exact_hash, image_data)
+        
+        # 保存文件到uploads目录（用于后续显示缩略图），内容相同的文件只存一份
+        saved_filename = upload_store.save(image_data, safe_ext(file.filename), file_hash)
         logger.debug(f"文件已保存: {saved_filename}")
         
         # OCR识别
         ocr_start = time.time()
         ocr_logger.info(f"开始OCR识别 - 文件: {file.filename}, 大小: {len(image_data)} bytes")
-        ocr_text = await ocr.recognize(image_data)
+        ocr_text = await _ocr_recognize(ocr, image_data)
         ocr_time = time.time() - ocr_start
         ocr_logger.info(f"OCR识别完成 - 文件: {file.filename}, 耗时: {ocr_time:.2f}s, 识别文字长度: {len(ocr_text)}")
         
         if not ocr_text.strip():
             logger.warning(f"OCR未识别到文字 - 文件: {file.filename}")
-            return RecognitionResult(
+            result = RecognitionResult(
                 success=False,
                 filename=file.filename,
                 image_url=f"/uploads/{saved_filename}",
                 error="OCR未识别到任何文字",
+                file_hash=file_hash,
+                possible_duplicate_of=similar,
+                ocr_time=round(ocr_time, 3),
             )
+            await _store_results("single", [result], ocr, llm)
+            return result
         
         # 大模型提取结构化数据
         llm_start = time.time()
         llm_logger.info(f"开始LLM识别 - 文件: {file.filename}, OCR文本长度: {len(ocr_text)}")
-        voucher_data = await llm.recognize_voucher(ocr_text)
-        llm_time = time.time() - llm_start
-        llm_logger.info(f"LLM识别完成 - 文件: {file.filename}, 耗时: {llm_time:.2f}s")
-        
-        if "error" in voucher_data:
-            logger.error(f"LLM识别失败 - 文件: {file.filename}, 错误: {voucher_data['error']}")
-            return RecognitionResult(
+        try:
+            answer = await _llm_recognize(llm, ocr_text)
+            voucher_data = answer.voucher
+        except VoucherParseError as e:
+            logger.error(f"LLM识别失败 - 文件: {file.filename}, 错误: {str(e)}")
+            result = RecognitionResult(
                 success=False,
                 filename=file.filename,
                 image_url=f"/uploads/{saved_filename}",
                 ocr_text=ocr_text,
-                error=voucher_data["error"],
+                error=str(e),
+                file_hash=file_hash,
+                possible_duplicate_of=similar,
+                ocr_time=round(ocr_time, 3),
+                llm_time=round(time.time() - llm_start, 3),
             )
+            await _store_results("single", [result], ocr, llm)
+            return result
+        llm_time = time.time() - llm_start
+        llm_logger.info(f"LLM识别完成 - 文件: {file.filename}, 耗时: {llm_time:.2f}s")
         
         total_time = time.time() - start_time
-        entries_count = len(voucher_data.get("entries", []))
+        entries_count = len(voucher_data.entries)
         logger.info(
             f"凭证识别成功 - 文件: {file.filename}, 分录数: {entries_count}, "
             f"总耗时: {total_time:.2f}s (OCR: {ocr_time:.2f}s, LLM: {llm_time:.2f}s)"
         )
         
-        return RecognitionResult(
+        result = RecognitionResult(
             success=True,
             filename=file.filename,
             image_url=f"/uploads/{saved_filename}",
             ocr_text=ocr_text,
             voucher_data=voucher_data,
+            file_hash=file_hash,
+            possible_duplicate_of=similar,
+            ocr_time=round(ocr_time, 3),
+            llm_time=round(llm_time, 3),
+            llm_provider=answer.provider,
+            llm_model=answer.model,
         )
+        await _store_results("single", [result], ocr, llm)
+        if fp is not None:
+            dedup_index.add(fp, file.filename, result)
+        return result
         
     except Exception as e:
         total_time = time.time() - start_time
@@ -245,206 +868,838 @@ async def recognize_single(file: UploadFile = File(...)):
             exc_info=True
         )
         # 尝试保存文件（如果还没有保存）
-        saved_filename = None
-        try:
-            from ..config import get_settings
-            settings = get_settings()
-            import uuid
-            file_ext = os.path.splitext(file.filename or '')[-1] or '.jpg'
-            saved_filename = f"{uuid.uuid4().hex}{file_ext}"
-            saved_path = os.path.join(settings.upload_dir, saved_filename)
-            # 重新读取文件（因为之前已经read过了）
-            await file.seek(0)
-            image_data = await file.read()
-            with open(saved_path, 'wb') as f:
-                f.write(image_data)
-        except Exception:
-            pass
+        if saved_filename is None:
+            try:
+                # 重新读取文件（因为之前可能已经read过了）
+                await file.seek(0)
+                saved_filename = upload_store.save(await file.read(), safe_ext(file.filename))
+            except Exception:
+                pass
         
-        return RecognitionResult(
+        result = RecognitionResult(
             success=False,
             filename=file.filename,
             image_url=f"/uploads/{saved_filename}" if saved_filename else None,
             error=str(e),
         )
+        await _store_results("single", [result], ocr, llm)
+        return result
+
+
+async def _recognize_batch_file(
+    ocr,
+    llm,
+    filename: str,
+    image_data: bytes,
+    idx: int,
+    total: int,
+    file_hash: Optional[str] = None,
+) -> RecognitionResult:
+    """识别批量上传中的单个文件（file_hash 为已计算的内容哈希）"""
+    file_start = time.time()
+    logger.info(f"处理文件 [{idx}/{total}] - {filename}")
+    
+    try:
+        # 保存文件到uploads目录（用于后续显示缩略图），内容相同的文件只存一份
+        saved_filename = upload_store.save(image_data, safe_ext(filename), file_hash)
+        logger.debug(f"文件已保存: {saved_filename}")
+        
+        # OCR识别
+        ocr_start = time.time()
+        ocr_logger.info(f"[批量 {idx}/{total}] OCR识别 - 文件: {filename}")
+        try:
+            ocr_text = await _ocr_recognize(ocr, image_data)
+        except Exception as ocr_error:
+            # OCR识别失败，记录详细错误信息
+            error_msg = str(ocr_error)
+            logger.error(f"[批量 {idx}/{total}] OCR识别异常 - {filename}, 错误: {error_msg}", exc_info=True)
+            # 文件在OCR之前已保存，失败时也可以查看
+            return RecognitionResult(
+                success=False,
+                filename=filename,
+                image_url=f"/uploads/{saved_filename}",
+                error=f"OCR识别失败: {error_msg}",
+            )
+        
+        ocr_time = time.time() - ocr_start
+        ocr_logger.info(f"[批量 {idx}/{total}] OCR完成 - 文件: {filename}, 耗时: {ocr_time:.2f}s, 文字长度: {len(ocr_text)}")
+        
+        if not ocr_text.strip():
+            logger.warning(f"[批量 {idx}/{total}] OCR未识别到文字 - {filename}")
+            return RecognitionResult(
+                success=False,
+                filename=filename,
+                image_url=f"/uploads/{saved_filename}",
+                error="OCR未识别到任何文字",
+                ocr_time=round(ocr_time, 3),
+            )
+        
+        # 大模型提取结构化数据
+        llm_start = time.time()
+        llm_logger.info(f"[批量 {idx}/{total}] LLM识别 - 文件: {filename}")
+        try:
+            answer = await _llm_recognize(llm, ocr_text)
+            voucher_data = answer.voucher
+        except VoucherParseError as e:
+            logger.error(f"[批量 {idx}/{total}] LLM识别失败 - {filename}, 错误: {str(e)}")
+            return RecognitionResult(
+                success=False,
+                filename=filename,
+                image_url=f"/uploads/{saved_filename}",
+                ocr_text=ocr_text,
+                error=str(e),
+                ocr_time=round(ocr_time, 3),
+                llm_time=round(time.time() - llm_start, 3),
+            )
+        llm_time = time.time() - llm_start
+        llm_logger.info(f"[批量 {idx}/{total}] LLM完成 - 文件: {filename}, 耗时: {llm_time:.2f}s")
+        
+        entries_count = len(voucher_data.entries)
+        file_time = time.time() - file_start
+        logger.info(
+            f"[批量 {idx}/{total}] 识别成功 - {filename}, "
+            f"分录数: {entries_count}, 耗时: {file_time:.2f}s"
+        )
+        return RecognitionResult(
+            success=True,
+            filename=filename,
+            image_url=f"/uploads/{saved_filename}",
+            ocr_text=ocr_text,
+            voucher_data=voucher_data,
+            ocr_time=round(ocr_time, 3),
+            llm_time=round(llm_time, 3),
+            llm_provider=answer.provider,
+            llm_model=answer.model,
+        )
+            
+    except Exception as e:
+        file_time = time.time() - file_start
+        logger.error(
+            f"[批量 {idx}/{total}] 识别失败 - {filename}, 错误: {str(e)}, 耗时: {file_time:.2f}s",
+            exc_info=True
+        )
+        return RecognitionResult(
+            success=False,
+            filename=filename,
+            error=str(e),
+        )
+
+
+def _duplicate_result(
+    original: RecognitionResult,
+    filename: str,
+    original_filename: str,
+    file_hash: str,
+) -> RecognitionResult:
+    """复用已识别图片的结果，并标记为重复（未重新调用OCR和大模型，不计耗时）"""
+    return original.model_copy(update={
+        "filename": filename,
+        "duplicate_of": original_filename,
+        "possible_duplicate_of": None,
+        "file_hash": file_hash,
+        "ocr_time": None,
+        "llm_time": None,
+        "result_id": None,
+    })
+
+
+def _find_similar(fp, filename: str, batch_index: Optional[DedupIndex] = None) -> Optional[str]:
+    """查找相似的已识别图片（疑似重复），返回其文件名"""
+    similar = (batch_index.find_similar(fp) if batch_index is not None else None) or dedup_index.find_similar(fp)
+    if similar is None:
+        return None
+    similar_filename, distance = similar
+    logger.warning(f"疑似重复图片 - {filename} 与 {similar_filename} 相似（汉明距离 {distance}），仍单独识别")
+    return similar_filename
+
+
+async def _recognize_image(
+    ocr,
+    llm,
+    filename: str,
+    image_data: bytes,
+    idx: int,
+    total: int,
+    batch_index: Optional[DedupIndex],
+) -> RecognitionResult:
+    """
+    识别批量上传/压缩包中的一张图片（带去重）
+    
+    内容完全相同的图片复用结果；只是相似的图片仍正常识别，通过 possible_duplicate_of 提示人工核对。
+    
+    Args:
+        batch_index: 同批次去重索引，为None时不去重
+    """
+    fp = None
+    similar = None
+    if batch_index is not None:
+        fp = await asyncio.to_thread(fingerprint, image_data)
+        file_hash = fp.exact
+        match = batch_index.find(fp) or dedup_index.find(fp)
+        if match:
+            original_filename, original = match
+            logger.info(f"[批量 {idx}/{total}] 重复图片，复用 {original_filename} 的识别结果 - {filename}")
+            return _duplicate_result(original, filename, original_filename, file_hash)
+        similar = _find_similar(fp, filename, batch_index)
+    else:
+        file_hash = await asyncio.to_thread(exact_hash, image_data)
+    
+    result = await _recognize_batch_file(ocr, llm, filename, image_data, idx, total, file_hash)
+    result.file_hash = file_hash
+    result.possible_duplicate_of = similar
+    
+    if fp is not None:
+        batch_index.add(fp, filename, result)
+        # 跨批次只复用成功的结果，失败的图片下次上传时重新识别
+        if result.success:
+            dedup_index.add(fp, filename, result)
+    return result
 
 
-@router.post("/recognize/batch", response_model=BatchRecognitionResult, summary="批量识别凭证")
-async def recognize_batch(files: List[UploadFile] = File(...)):
+@router.post(
+    "/recognize/batch", response_model=BatchRecognitionResult, summary="批量识别凭证",
+    dependencies=[Depends(_admit_uploads()), Depends(_priority_lane(BATCH))],
+)
+async def recognize_batch(
+    files: List[UploadFile] = File(...),
+    dedup: bool = Form(True, description="是否跳过重复图片（同批次及之前批次）"),
+    pdf_group: str = Form("auto", description="PDF分页分组方式: auto(自动识别续页), page(每页一张), document(整份一张)"),
+    include_ocr_text: bool = Form(True, description="响应中是否包含OCR文本（不展示原文的客户端可关闭以减少传输）"),
+    fields: Optional[str] = Form(None, description=RESULT_FIELDS_DESCRIPTION),
+):
     """
     批量识别凭证图片
+    
+    重复图片（内容完全相同）只识别一次，其余副本复用结果并通过 duplicate_of 标记，
+    导出Excel时应跳过，避免重复记账。与之前的图片相似（重新拍摄，或同一模板的不同票据）的
+    仍正常识别和导出，通过 possible_duplicate_of 提示人工核对。
+    
+    支持多页PDF：逐页并行OCR后按凭证分组，每张凭证一条识别结果（total 为结果条数）。
     """
+    from ..config import get_settings
+    
     start_time = time.time()
     ocr = get_ocr_service()
     llm = get_llm_service()
+    dedup = dedup and get_settings().dedup_enabled
     
-    logger.info(f"开始批量识别 - 文件数量: {len(files)}")
+    logger.info(f"开始批量识别 - 文件数量: {len(files)}, 去重: {dedup}")
     
     results = []
     success_count = 0
     failed_count = 0
+    duplicate_count = 0
+    # 同批次去重索引（失败结果也复用，避免同一张图重复调用）
+    batch_index = DedupIndex(max_entries=len(files), phash_threshold=dedup_index.phash_threshold)
+    
+    if pdf_group not in PDFService.GROUP_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的PDF分组方式: {pdf_group}")
+    selected = _result_fields(fields)
     
     for idx, file in enumerate(files, 1):
-            file_start = time.time()
-            logger.info(f"处理文件 [{idx}/{len(files)}] - {file.filename}")
+        try:
+            if await _is_pdf_upload(file):
+                logger.info(f"[批量 {idx}/{len(files)}] PDF文件 - {file.filename}")
+                pdf_results = await _recognize_pdf(ocr, llm, file.filename, file.file, group_mode=pdf_group)
+                results.extend(pdf_results)
+                success_count += sum(1 for result in pdf_results if result.success)
+                failed_count += sum(1 for result in pdf_results if not result.success)
+                continue
+            image_data = await file.read()
+        except Exception as e:
+            logger.error(f"[批量 {idx}/{len(files)}] 读取文件失败 - {file.filename}, 错误: {str(e)}", exc_info=True)
+            results.append(RecognitionResult(success=False, filename=file.filename, error=str(e)))
+            failed_count += 1
+            continue
+        
+        result = await _recognize_image(
+            ocr, llm, file.filename, image_data, idx, len(files),
+            batch_index if dedup else None,
+        )
+        results.append(result)
+        if result.duplicate_of:
+            duplicate_count += 1
+        if result.success:
+            success_count += 1
+        else:
+            failed_count += 1
+    
+    total_time = time.time() - start_time
+    logger.info(
+        f"批量识别完成 - 文件数: {len(files)}, 结果数: {len(results)}, 成功: {success_count}, 失败: {failed_count}, "
+        f"重复: {duplicate_count}, 总耗时: {total_time:.2f}s, 平均: {total_time/len(files):.2f}s/文件"
+    )
+    
+    batch_id = await _store_results("batch", results, ocr, llm)
+    
+    # 每条结果单独序列化一次后拼接，不再整体按 response_model 重新编码
+    batch = BatchRecognitionResult(
+        batch_id=batch_id,
+        total=len(results),
+        success_count=success_count,
+        failed_count=failed_count,
+        duplicate_count=duplicate_count,
+        invalid_count=sum(1 for result in results if result.validation and not result.validation.valid),
+        results=[],
+    )
+    return RawJSONResponse(join_results(batch, [dump_result(result, include_ocr_text, selected) for result in results]))
+
+
+@router.post(
+    "/recognize/archive", response_model=ArchiveRecognitionResult, summary="压缩包批量识别",
+    dependencies=[Depends(_admit_uploads(check_file_size=False)), Depends(_priority_lane(BATCH))],
+)
+async def recognize_archive(
+    file: UploadFile = File(..., description="ZIP 或 TAR（含 .tar.gz/.tgz）压缩包"),
+    dedup: bool = Form(True, description="是否跳过重复图片（同批次及之前批次）"),
+    pdf_group: str = Form("auto", description="PDF分页分组方式: auto, page, document"),
+    include_ocr_text: bool = Form(True, description="响应中是否包含OCR文本"),
+    fields: Optional[str] = Form(None, description=RESULT_FIELDS_DESCRIPTION),
+):
+    """
+    上传压缩包批量识别凭证
+    
+    压缩包成员边解压边识别：后台线程按顺序解压（最多预先解压 archive_prefetch 个），
+    当前文件识别完成即处理下一个，无需先整体解压。
+    单个文件超限、压缩比异常、类型不支持的成员会被跳过并在 members 中说明原因；
+    超出文件数或解压总大小上限时停止解压，已识别的结果照常返回。
+    """
+    settings = get_settings()
+    start_time = time.time()
+    ocr = get_ocr_service()
+    llm = get_llm_service()
+    dedup = dedup and settings.dedup_enabled
+    
+    if pdf_group not in PDFService.GROUP_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的PDF分组方式: {pdf_group}")
+    selected = _result_fields(fields)
+    
+    archive_service = ArchiveService(
+        max_members=settings.archive_max_members,
+        max_member_size=settings.archive_max_member_size,
+        max_total_size=settings.archive_max_total_size,
+        max_ratio=settings.archive_max_ratio,
+    )
+    
+    logger.info(f"开始压缩包识别 - 文件名: {file.filename}, 大小: {file.size} bytes")
+    
+    # 解压在线程中进行，通过有界队列交给识别流程，实现边解压边识别
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.archive_prefetch))
+    members_iter = archive_service.iter_members(file.file)
+    
+    async def extract():
+        # 生成器在解压出错或全部产出后自行结束；被取消时线程中正在解压的成员完成后即停止
+        try:
+            while True:
+                member = await asyncio.to_thread(next, members_iter, None)
+                if member is None:
+                    break
+                await queue.put(member)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(None)
+    
+    extractor = asyncio.create_task(extract())
+    
+    results: List[RecognitionResult] = []
+    members: List[ArchiveMemberResult] = []
+    batch_index = DedupIndex(max_entries=settings.archive_max_members, phash_threshold=dedup_index.phash_threshold)
+    archive_error = None
+    
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, ArchiveError):
+                archive_error = str(item)
+                if not isinstance(item, ArchiveLimitError):
+                    raise HTTPException(status_code=400, detail=archive_error)
+                logger.warning(f"压缩包识别中止 - {file.filename}: {archive_error}")
+                continue
+            if isinstance(item, Exception):
+                raise item
             
-            try:
-                # 读取文件
-                image_data = await file.read()
-                
-                # 保存文件到uploads目录（用于后续显示缩略图）
-                from ..config import get_settings
-                settings = get_settings()
-                import uuid
-                # 生成唯一文件名，避免重名
-                file_ext = os.path.splitext(file.filename or '')[-1] or '.jpg'
-                saved_filename = f"{uuid.uuid4().hex}{file_ext}"
-                saved_path = os.path.join(settings.upload_dir, saved_filename)
-                with open(saved_path, 'wb') as f:
-                    f.write(image_data)
-                logger.debug(f"文件已保存: {saved_filename}")
-                
-                # OCR识别
-                ocr_start = time.time()
-                ocr_logger.info(f"[批量 {idx}/{len(files)}] OCR识别 - 文件: {file.filename}")
-                try:
-                    ocr_text = await ocr.recognize(image_data)
-                except Exception as ocr_error:
-                    # OCR识别失败，记录详细错误信息
-                    error_msg = str(ocr_error)
-                    logger.error(f"[批量 {idx}/{len(files)}] OCR识别异常 - {file.filename}, 错误: {error_msg}", exc_info=True)
-                    # 即使失败也保存文件，方便查看
-                    saved_filename = None
-                    try:
-                        from ..config import get_settings
-                        settings = get_settings()
-                        import uuid
-                        file_ext = os.path.splitext(file.filename or '')[-1] or '.jpg'
-                        saved_filename = f"{uuid.uuid4().hex}{file_ext}"
-                        saved_path = os.path.join(settings.upload_dir, saved_filename)
-                        with open(saved_path, 'wb') as f:
-                            f.write(image_data)
-                    except Exception as save_error:
-                        logger.warning(f"保存文件失败: {save_error}")
-                    
-                    results.append(RecognitionResult(
-                        success=False,
-                        filename=file.filename,
-                        image_url=f"/uploads/{saved_filename}" if saved_filename else None,
-                        error=f"OCR识别失败: {error_msg}",
-                    ))
-                    failed_count += 1
-                    continue
-                
-                ocr_time = time.time() - ocr_start
-                ocr_logger.info(f"[批量 {idx}/{len(files)}] OCR完成 - 文件: {file.filename}, 耗时: {ocr_time:.2f}s, 文字长度: {len(ocr_text)}")
-                
-                if not ocr_text.strip():
-                    logger.warning(f"[批量 {idx}/{len(files)}] OCR未识别到文字 - {file.filename}")
-                    results.append(RecognitionResult(
-                        success=False,
-                        filename=file.filename,
-                        image_url=f"/uploads/{saved_filename}",
-                        error="OCR未识别到任何文字",
-                    ))
-                    failed_count += 1
-                    continue
-                
-                # 大模型提取结构化数据
-                llm_start = time.time()
-                llm_logger.info(f"[批量 {idx}/{len(files)}] LLM识别 - 文件: {file.filename}")
-                voucher_data = await llm.recognize_voucher(ocr_text)
-                llm_time = time.time() - llm_start
-                llm_logger.info(f"[批量 {idx}/{len(files)}] LLM完成 - 文件: {file.filename}, 耗时: {llm_time:.2f}s")
-                
-                if "error" in voucher_data:
-                    logger.error(f"[批量 {idx}/{len(files)}] LLM识别失败 - {file.filename}, 错误: {voucher_data['error']}")
-                    results.append(RecognitionResult(
-                        success=False,
-                        filename=file.filename,
-                        image_url=f"/uploads/{saved_filename}",
-                        ocr_text=ocr_text,
-                        error=voucher_data["error"],
-                    ))
-                    failed_count += 1
-                else:
-                    entries_count = len(voucher_data.get("entries", []))
-                    file_time = time.time() - file_start
-                    logger.info(
-                        f"[批量 {idx}/{len(files)}] 识别成功 - {file.filename}, "
-                        f"分录数: {entries_count}, 耗时: {file_time:.2f}s"
-                    )
-                    results.append(RecognitionResult(
-                        success=True,
-                        filename=file.filename,
-                        image_url=f"/uploads/{saved_filename}",
-                        ocr_text=ocr_text,
-                        voucher_data=voucher_data,
-                    ))
-                    success_count += 1
-                    
-            except Exception as e:
-                file_time = time.time() - file_start
-                logger.error(
-                    f"[批量 {idx}/{len(files)}] 识别失败 - {file.filename}, 错误: {str(e)}, 耗时: {file_time:.2f}s",
-                    exc_info=True
-                )
-                results.append(RecognitionResult(
-                    success=False,
-                    filename=file.filename,
-                    error=str(e),
+            member = item
+            idx = len(members) + 1
+            if member.skipped_reason:
+                logger.info(f"[压缩包 {idx}] 跳过 {member.name}: {member.skipped_reason}")
+                members.append(ArchiveMemberResult(
+                    name=member.name, size=member.size, status="skipped", reason=member.skipped_reason,
                 ))
-                failed_count += 1
+                continue
+            
+            if is_pdf(member.data[:8]):
+                member_results = await _recognize_pdf(ocr, llm, member.name, io.BytesIO(member.data), group_mode=pdf_group)
+            else:
+                member_results = [await _recognize_image(
+                    ocr, llm, member.name, member.data, idx, settings.archive_max_members,
+                    batch_index if dedup else None,
+                )]
+            
+            members.append(ArchiveMemberResult(
+                name=member.name,
+                size=member.size,
+                status="processed",
+                result_indexes=list(range(len(results), len(results) + len(member_results))),
+            ))
+            results.extend(member_results)
+    finally:
+        extractor.cancel()
     
+    success_count = sum(1 for result in results if result.success)
+    duplicate_count = sum(1 for result in results if result.duplicate_of)
     total_time = time.time() - start_time
     logger.info(
-        f"批量识别完成 - 总数: {len(files)}, 成功: {success_count}, 失败: {failed_count}, "
-        f"总耗时: {total_time:.2f}s, 平均: {total_time/len(files):.2f}s/文件"
+        f"压缩包识别完成 - {file.filename}, 成员数: {len(members)}, 结果数: {len(results)}, "
+        f"成功: {success_count}, 重复: {duplicate_count}, 总耗时: {total_time:.2f}s"
     )
     
-    return BatchRecognitionResult(
-        total=len(files),
+    batch_id = await _store_results("archive", results, ocr, llm, filename=file.filename)
+    
+    archive = ArchiveRecognitionResult(
+        batch_id=batch_id,
+        total=len(results),
         success_count=success_count,
-        failed_count=failed_count,
-        results=results,
+        failed_count=len(results) - success_count,
+        duplicate_count=duplicate_count,
+        invalid_count=sum(1 for result in results if result.validation and not result.validation.valid),
+        results=[],
+        members=members,
+        error=archive_error,
+    )
+    return RawJSONResponse(join_results(archive, [dump_result(result, include_ocr_text, selected) for result in results]))
+
+
+# ============ 识别结果查询API ============
+
+def _get_results_store() -> ResultsStore:
+    """获取结果库"""
+    if results_store is None:
+        raise HTTPException(status_code=400, detail="识别结果存储未启用")
+    return results_store
+
+
+@router.get("/results", response_model=StoredResultPage, summary="查询识别结果")
+async def list_results(
+    batch_id: Optional[str] = Query(None, description="批次ID"),
+    date_from: Optional[str] = Query(None, description="凭证日期起（含），YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="凭证日期止（含），YYYY-MM-DD"),
+    voucher_no: Optional[str] = Query(None, description="凭证号"),
+    partner: Optional[str] = Query(None, description="往来单位名称（前缀匹配）"),
+    success: Optional[bool] = Query(None, description="只看成功/失败的结果"),
+    include_duplicates: bool = Query(True, description="是否包含重复图片"),
+    include_ocr_text: bool = Query(False, description="是否返回OCR文本"),
+    page: int = Query(1, ge=1, description="页码"),
+    page_size: int = Query(50, ge=1, le=500, description="每页条数"),
+):
+    """按凭证日期、批次、凭证号、往来单位分页查询历史识别结果，无需重新识别"""
+    store = _get_results_store()
+    total, rows = await asyncio.to_thread(
+        store.query_results,
+        batch_id=batch_id,
+        date_from=date_from,
+        date_to=date_to,
+        voucher_no=voucher_no,
+        partner=partner,
+        success=success,
+        include_duplicates=include_duplicates,
+        offset=(page - 1) * page_size,
+        limit=page_size,
+        include_ocr_text=include_ocr_text,
+        # 指定批次时按识别顺序返回，否则最新的在前
+        newest_first=not batch_id,
+    )
+    items = [StoredResult(result_id=row.pop("id"), **row) for row in rows]
+    _validate_results(items)
+    return RawJSONResponse(dump_json(StoredResultPage(
+        total=total,
+        page=page,
+        page_size=page_size,
+        items=items,
+    )))
+
+
+@router.get("/results/{result_id}", response_model=StoredResult, summary="获取识别结果")
+async def get_result(result_id: int):
+    """获取单条识别结果（含OCR文本）"""
+    row = await asyncio.to_thread(_get_results_store().get_result, result_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"识别结果不存在: {result_id}")
+    result = StoredResult(result_id=row.pop("id"), **row)
+    _validate_results([result])
+    return result
+
+
+@router.get("/batches", response_model=BatchInfoPage, summary="查询识别批次")
+async def list_batches(
+    page: int = Query(1, ge=1, description="页码"),
+    page_size: int = Query(50, ge=1, le=500, description="每页条数"),
+):
+    """分页列出识别批次，最新的在前"""
+    total, rows = await asyncio.to_thread(
+        _get_results_store().list_batches, offset=(page - 1) * page_size, limit=page_size
     )
+    return BatchInfoPage(total=total, page=page, page_size=page_size, items=[BatchInfo(**row) for row in rows])
+
+
+@router.get("/batches/{batch_id}", response_model=BatchInfo, summary="获取识别批次")
+async def get_batch(batch_id: str):
+    """获取批次信息，批次内的结果通过 /results?batch_id= 查询"""
+    row = await asyncio.to_thread(_get_results_store().get_batch, batch_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"批次不存在: {batch_id}")
+    return BatchInfo(**row)
+
+
+@router.delete("/batches/{batch_id}", summary="删除识别批次")
+async def delete_batch(batch_id: str):
+    """删除批次及其全部识别结果"""
+    deleted = await asyncio.to_thread(_get_results_store().delete_batch, batch_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"批次不存在: {batch_id}")
+    logger.info(f"已删除识别批次: {batch_id}")
+    return {"success": True}
 
 
 # ============ Excel导出API ============
 
+EXPORT_COLUMNS_DESCRIPTION = "只导出指定列（字段名或表头，逗号分隔，按给定顺序），默认全部列"
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+async def _excel_response(
+    vouchers: List[VoucherData],
+    filename: str = "vouchers.xlsx",
+    service: Optional[ExcelService] = None,
+):
+    """
+    生成Excel下载响应
+    
+    启用导出缓存时按凭证内容哈希缓存文件，相同内容再次导出直接返回缓存文件。
+    """
+    service = service or excel_service
+    if export_cache is None:
+        excel_data = await asyncio.to_thread(service.generate_excel, vouchers)
+        return StreamingResponse(
+            io.BytesIO(excel_data),
+            media_type=XLSX_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+    
+    # 列定义不同时生成的文件不同，缓存键同时包含列定义
+    key = f"{service.template_etag[:16]}-{await asyncio.to_thread(content_key, vouchers)}"
+    path, hit = await asyncio.to_thread(
+        export_cache.get_or_create, key, lambda: service.generate_excel(vouchers)
+    )
+    logger.info(f"导出Excel - 凭证数: {len(vouchers)}, 缓存{'命中' if hit else '未命中'}: {key[:12]}")
+    return FileResponse(
+        path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=filename,
+        headers={"X-Export-Cache": "hit" if hit else "miss"},
+    )
+
+
+@lru_cache(maxsize=32)
+def _excel_service_with(columns: tuple[str, ...]) -> ExcelService:
+    """只含指定列（字段名或表头，按给定顺序）的Excel服务"""
+    by_name = {}
+    for column in excel_service.columns:
+        by_name[column.field] = column
+        by_name[column.header] = column
+    unknown = [name for name in columns if name not in by_name]
+    if unknown:
+        raise ValueError(f"未知的导出列: {', '.join(unknown)}")
+    return ExcelService(columns=tuple(by_name[name] for name in columns), sheet_title=excel_service.sheet_title)
+
+
+def _export_service(columns: Optional[str]) -> ExcelService:
+    """按 columns 参数（逗号分隔）选择导出列，未指定时导出全部列"""
+    names = tuple(name.strip() for name in (columns or "").split(",") if name.strip())
+    if not names:
+        return excel_service
+    try:
+        return _excel_service_with(names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/export/excel", summary="导出Excel")
-async def export_excel(vouchers: List[dict]):
+async def export_excel(
+    vouchers: VoucherList,
+    columns: Optional[str] = Query(None, description=EXPORT_COLUMNS_DESCRIPTION),
+):
     """
     将识别结果导出为Excel
     
     Args:
         vouchers: 凭证数据列表
     """
-    excel_data = excel_service.generate_excel(vouchers)
+    return await _excel_response(vouchers, service=_export_service(columns))
+
+
+async def _select_stored_vouchers(request: ExportRequest) -> List[VoucherData]:
+    """
+    按结果ID、批次或筛选条件从结果库选择识别成功的凭证（跳过重复图片）
     
-    return StreamingResponse(
-        io.BytesIO(excel_data),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": "attachment; filename=vouchers.xlsx"
-        }
+    给定 result_ids 时按其顺序返回，否则按识别顺序返回。
+    """
+    store = _get_results_store()
+    if not any([
+        request.result_ids, request.batch_ids, request.date_from, request.date_to,
+        request.voucher_no, request.partner,
+    ]):
+        raise HTTPException(status_code=400, detail="请指定要导出的结果ID、批次或筛选条件")
+    
+    _, rows = await asyncio.to_thread(
+        store.query_results,
+        result_ids=request.result_ids,
+        batch_ids=request.batch_ids,
+        date_from=request.date_from,
+        date_to=request.date_to,
+        voucher_no=request.voucher_no,
+        partner=request.partner,
+        success=True,
+        include_duplicates=False,
+        limit=None,
+        newest_first=False,
+    )
+    if request.result_ids:
+        order = {result_id: index for index, result_id in enumerate(request.result_ids)}
+        rows.sort(key=lambda row: order[row["id"]])
+    vouchers = [row["voucher_data"] for row in rows if row["voucher_data"]]
+    if not vouchers:
+        raise HTTPException(status_code=404, detail="没有符合条件的识别结果")
+    return vouchers
+
+
+@router.post("/export/excel/results", summary="按结果库记录导出Excel")
+async def export_stored_results(
+    request: ExportRequest,
+    columns: Optional[str] = Query(None, description=EXPORT_COLUMNS_DESCRIPTION),
+):
+    """
+    从结果库组装Excel，无需客户端回传凭证数据
+    
+    按结果ID、批次或筛选条件选择识别成功的结果（跳过重复图片），
+    给定 result_ids 时按其顺序导出，否则按识别顺序导出。
+    """
+    service = _export_service(columns)
+    vouchers = await _select_stored_vouchers(request)
+    return await _excel_response(vouchers, service=service)
+
+
+async def _append_vouchers_of(request: WorkbookAppendRequest) -> List[VoucherData]:
+    """追加请求中的凭证：直接给出的凭证数据，或从结果库选择"""
+    if request.vouchers is not None:
+        if not request.vouchers:
+            raise HTTPException(status_code=400, detail="没有可追加的凭证数据")
+        return request.vouchers
+    return await _select_stored_vouchers(request)
+
+
+def _rows_for_seq(vouchers: List[VoucherData]):
+    """按起始凭证序号依次展开凭证行"""
+    def rows_for_seq(start_seq: int):
+        for seq, voucher in enumerate(vouchers, start_seq):
+            yield seq, excel_service.voucher_rows(voucher, seq)
+    return rows_for_seq
+
+
+@router.post("/export/excel/append", summary="追加到上传的工作簿")
+async def append_to_uploaded_workbook(
+    file: UploadFile = File(..., description="已有的凭证工作簿（xlsx）"),
+    selection: str = Form(..., description="JSON：{\"vouchers\": [...]} 或结果库选择条件（result_ids、batch_ids、日期等）"),
+):
+    """
+    向上传的工作簿追加凭证行并返回新文件
+    
+    已有单元格原样保留（流式插入新行，不重写工作表），凭证序号从工作簿中已有的最大序号继续。
+    """
+    try:
+        request = WorkbookAppendRequest.model_validate_json(selection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"selection 格式错误: {str(e)}")
+    vouchers = await _append_vouchers_of(request)
+    
+    src = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    dst_path = src.name[:-5] + ".out.xlsx"
+    try:
+        with src:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, src)
+        summary = await asyncio.to_thread(append_vouchers, src.name, dst_path, _rows_for_seq(vouchers))
+    except WorkbookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(src.name)
+    
+    logger.info(
+        f"追加到上传的工作簿 - {file.filename}, 新增凭证: {summary.voucher_count}, "
+        f"凭证序号: {summary.first_seq}-{summary.last_seq}"
+    )
+    return FileResponse(
+        dst_path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=file.filename or "vouchers.xlsx",
+        headers={"X-Rows-Added": str(summary.rows_added)},
+        background=BackgroundTask(os.unlink, dst_path),
     )
 
 
+def _workbook_lock(name: str) -> asyncio.Lock:
+    """同一工作簿的写操作串行执行"""
+    return workbook_locks.setdefault(workbook_service.path_for(name), asyncio.Lock())
+
+
+@router.get("/workbooks", response_model=List[WorkbookInfo], summary="服务端工作簿列表")
+async def list_workbooks():
+    """列出服务端保存的工作簿"""
+    return await asyncio.to_thread(workbook_service.list)
+
+
+@router.post("/workbooks/{name}", response_model=WorkbookInfo, summary="上传工作簿")
+async def upload_workbook(name: str, file: UploadFile = File(...)):
+    """上传（覆盖）服务端工作簿，之后可按名称追加凭证"""
+    try:
+        async with _workbook_lock(name):
+            await asyncio.to_thread(workbook_service.save, name, file.file)
+    except WorkbookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return workbook_service.info(name)
+
+
+@router.get("/workbooks/{name}", summary="下载工作簿")
+async def download_workbook(name: str):
+    """下载服务端工作簿"""
+    try:
+        path = workbook_service.path_for(name)
+    except WorkbookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"工作簿不存在: {name}")
+    return FileResponse(path, media_type=XLSX_MEDIA_TYPE, filename=os.path.basename(path))
+
+
+@router.delete("/workbooks/{name}", summary="删除工作簿")
+async def delete_workbook(name: str):
+    """删除服务端工作簿"""
+    try:
+        async with _workbook_lock(name):
+            deleted = await asyncio.to_thread(workbook_service.delete, name)
+    except WorkbookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"工作簿不存在: {name}")
+    return {"success": True}
+
+
+@router.post("/workbooks/{name}/append", response_model=WorkbookAppendResult, summary="追加到服务端工作簿")
+async def append_to_workbook(name: str, request: WorkbookAppendRequest):
+    """
+    向服务端工作簿（如每月一个的流水账）追加凭证，工作簿不存在时从模板创建
+    
+    已有单元格原样保留，凭证序号从工作簿中已有的最大序号继续；追加完成后通过 GET /workbooks/{name} 下载。
+    """
+    vouchers = await _append_vouchers_of(request)
+    try:
+        async with _workbook_lock(name):
+            summary = await asyncio.to_thread(
+                workbook_service.append, name, _rows_for_seq(vouchers), excel_service.generate_template(),
+            )
+    except WorkbookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info(
+        f"追加到工作簿 - {name}, 新增凭证: {summary.voucher_count}, "
+        f"凭证序号: {summary.first_seq}-{summary.last_seq}, 最后一行: {summary.last_row}"
+    )
+    return WorkbookAppendResult(
+        workbook=name,
+        rows_added=summary.rows_added,
+        voucher_count=summary.voucher_count,
+        first_seq=summary.first_seq,
+        last_seq=summary.last_seq,
+        last_row=summary.last_row,
+    )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较，忽略 W/ 前缀）"""
+    client_tags = [tag.strip().removeprefix("W/") for tag in (if_none_match or "").split(",")]
+    return "*" in client_tags or etag in client_tags
+
+
 @router.get("/export/template", summary="下载Excel模板")
-async def download_template():
-    """下载空白Excel模板"""
-    excel_data = excel_service.generate_template()
-    
-    return StreamingResponse(
-        io.BytesIO(excel_data),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": "attachment; filename=template.xlsx"
-        }
+async def download_template(if_none_match: Optional[str] = Header(None)):
+    """
+    下载空白Excel模板
+    
+    模板按列定义生成一次后缓存；支持 ETag / If-None-Match 条件请求，未变化时返回304。
+    """
+    etag = f'"{excel_service.template_etag}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(
+        content=excel_service.generate_template(),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={**headers, "Content-Disposition": "attachment; filename=template.xlsx"},
     )
 
 
+# ============ 凭证校验API ============
+
+@router.post("/validate", response_model=List[VoucherValidation], summary="校验凭证")
+async def validate(vouchers: List[dict]):
+    """
+    整批校验凭证数据（如人工修改后的识别结果）
+    
+    检查借贷平衡、金额、编制日期、借贷方向和科目编码/名称，按顺序返回每张凭证的校验结果。
+    """
+    return await asyncio.to_thread(_validations, vouchers)
+
+
+# ============ 缩略图API ============
+
+@router.get("/thumbnails/{variant}/{filename:path}", summary="上传图片的缩略图/预览图")
+async def get_thumbnail(
+    variant: str,
+    filename: str,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    获取上传图片的派生图
+    
+    variant: thumb（约240px，列表展示）或 preview（约1280px，详情查看）。
+    客户端支持WebP时返回WebP，否则返回JPEG；首次请求时生成并缓存，
+    之后带强ETag和长期缓存头返回。
+    """
+    fmt = "webp" if accept and "image/webp" in accept else "jpeg"
+    try:
+        derivative = await thumbnail_service.get(filename, variant, fmt)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"图片不存在: {filename}")
+    except ThumbnailError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    etag = f'"{derivative.etag}"'
+    headers = {
+        "ETag": etag,
+        # 上传文件名随机且内容不变，派生图可长期缓存；按Accept返回不同格式
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept",
+    }
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(derivative.path, media_type=derivative.media_type, headers=headers)
+
+
 # ============ 会计科目API ============
 
 @router.get("/subjects", response_model=List[SubjectInfo], summary="获取会计科目列表")
@@ -464,14 +1719,71 @@ async def get_subject_by_code(code: str):
     raise HTTPException(status_code=404, detail="科目不存在")
 
 
+# ============ 用量与预算 ============
+
+@router.get("/usage", summary="用量与预算")
+async def get_usage(
+    start: Optional[str] = Query(None, description="开始日期（含），YYYY-MM-DD"),
+    end: Optional[str] = Query(None, description="结束日期（含），YYYY-MM-DD"),
+    kind: Optional[str] = Query(None, description="类型: llm(大模型token) / ocr(计费调用次数)"),
+    provider: Optional[str] = Query(None, description="提供商"),
+):
+    """按天、提供商/模型汇总的大模型token和OCR计费调用次数（含估算费用），以及各预算当日的用量"""
+    if usage_store is None:
+        raise HTTPException(status_code=404, detail="未启用用量记账")
+    if kind is not None and kind not in USAGE_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的类型: {kind}，可选: {', '.join(USAGE_KINDS)}")
+    for value in (start, end):
+        if value is not None and not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            raise HTTPException(status_code=400, detail=f"日期格式应为YYYY-MM-DD: {value}")
+    days, budgets = await asyncio.to_thread(
+        lambda: (usage_store.daily(start, end, kind, provider), usage_store.budgets_status())
+    )
+    return {"days": days, "budgets": budgets}
+
+
 # ============ 健康检查 ============
 
 @router.get("/health", summary="健康检查")
 async def health_check():
-    """服务健康检查"""
+    """服务健康检查（含外部端点熔断状态）"""
+    breakers = breaker_registry.snapshot()
+    open_breakers = [breaker["name"] for breaker in breakers if breaker["state"] != CircuitBreaker.CLOSED]
     return {
-        "status": "healthy",
+        "status": "degraded" if open_breakers else "healthy",
         "ocr_configured": ocr_service is not None,
         "llm_configured": llm_service is not None,
+        "open_circuits": open_breakers,
+        "circuit_breakers": breakers,
     }
 
+
+
+# ============ 运行指标 ============
+
+@router.get("/metrics", summary="运行指标")
+async def get_metrics():
+    """服务运行指标（LLM响应解析成功率/修复率等）"""
+    metrics = {
+        "llm_parse": parse_stats.snapshot(),
+        "llm_cascade": cascade_stats.snapshot(),
+        "llm_prompt": prompt_stats.snapshot(),
+        "ocr_cascade": ocr_cascade_stats.snapshot(),
+    }
+    if export_cache is not None:
+        metrics["export_cache"] = export_cache.snapshot()
+    metrics["admission"] = admission.snapshot()
+    if idempotency_store is not None:
+        metrics["idempotency"] = idempotency_store.snapshot()
+    if usage_store is not None:
+        metrics["usage"] = await asyncio.to_thread(usage_store.snapshot)
+    metrics["scheduler"] = {"ocr": ocr_scheduler.snapshot(), "llm": llm_scheduler.snapshot()}
+    if text_normalizer is not None:
+        metrics["ocr_normalization"] = text_normalizer.snapshot()
+    metrics["uploads"] = upload_store.snapshot()
+    metrics["thumbnails"] = thumbnail_service.snapshot()
+    if isinstance(ocr_service, OCRRouter):
+        metrics["ocr_router"] = ocr_service.snapshot()
+    if isinstance(llm_service, LLMRouter):
+        metrics["llm_router"] = llm_service.snapshot()
+    return metrics
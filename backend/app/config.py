@@ -27,6 +27,41 @@ class Settings(BaseSettings):
         description="OCR API端点"
     )
     
+    ocr_timeout: float = Field(default=30.0, description="OCR单次请求超时（秒）")
+    
+    ocr_qps: float = Field(default=0, description="OCR每秒最大调用次数（用于PDF多页并行识别），0表示不限制")
+    
+    # OCR路由配置
+    ocr_router_failure_threshold: int = Field(default=3, description="OCR提供商连续失败多少次后熔断")
+    ocr_router_recovery_timeout: float = Field(default=60.0, description="OCR提供商熔断后多少秒进入半开试探")
+    ocr_probe_interval: float = Field(default=30.0, description="OCR提供商健康探测间隔（秒），0表示不探测")
+    
+    # OCR级联配置（仅百度：先用便宜快速的通用文字识别接口，低置信度或失败时再用高精度/票据接口）
+    ocr_cascade_enabled: bool = Field(default=False, description="是否启用OCR级联")
+    ocr_cascade_fast_endpoint: str = Field(
+        default="https://aip.baidubce.com/rest/2.0/ocr/v1/general",
+        description="级联第一层的快速接口（需返回每行置信度，返回位置时才能裁剪重识别，如 general、general_basic）",
+    )
+    ocr_cascade_crop_endpoint: str = Field(
+        default="https://aip.baidubce.com/rest/2.0/ocr/v1/accurate_basic",
+        description="低置信度行裁剪后重识别使用的高精度接口",
+    )
+    ocr_cascade_min_confidence: float = Field(
+        default=0.9, ge=0, le=1, description="低置信度行以外各行的平均置信度（按字数加权）低于此值时整图改用票据接口（ocr_endpoint）"
+    )
+    ocr_cascade_line_confidence: float = Field(default=0.8, ge=0, le=1, description="单行置信度低于此值视为低置信度行")
+    ocr_cascade_max_crops: int = Field(
+        default=3, ge=0, description="低置信度行不超过此数时只裁剪这些行重识别，超过时整图改用票据接口"
+    )
+    ocr_cascade_min_lines: int = Field(default=3, ge=0, description="快速接口识别出的行数少于此值时整图改用票据接口")
+    
+    # OCR文本规范化配置（发送给大模型前统一字符、金额和日期写法，去掉重复行和固定文字）
+    ocr_normalize_enabled: bool = Field(default=True, description="是否在调用大模型前规范化OCR文本")
+    ocr_boilerplate_patterns: Optional[list[str]] = Field(
+        default=None,
+        description="要去掉的票据固定文字（JSON，正则，整行匹配），不配置时使用内置列表（监制章、联次说明、密码区等）",
+    )
+    
     # 大模型配置
     llm_provider: str = Field(default="deepseek", description="LLM提供商: doubao, deepseek, kimi, openrouter")
     llm_api_key: Optional[str] = Field(
@@ -39,9 +74,140 @@ class Settings(BaseSettings):
         description="LLM API端点"
     )
     
+    llm_timeout: float = Field(default=120.0, description="大模型单次请求超时（秒）")
+    
+    # 大模型路由配置
+    llm_hedge_enabled: bool = Field(default=True, description="是否启用对冲请求（主提供商超过p90延迟时请求备用提供商）")
+    llm_hedge_delay: float = Field(default=15.0, description="延迟样本不足时的默认对冲等待时间（秒）")
+    llm_health_window: int = Field(default=50, description="计算健康分时参考的最近调用次数")
+    
+    # 模型级联配置（先用小模型识别，校验不通过或置信度低时升级到配置的模型）
+    llm_cascade: dict[str, list[str]] = Field(
+        default={},
+        description="各提供商在配置模型之前依次尝试的较小模型（JSON），如 {\"kimi\": [\"moonshot-v1-8k\"], \"doubao\": [\"doubao-lite-32k\"]}",
+    )
+    llm_cascade_escalate_on: list[str] = Field(
+        default=["no_entries", "unbalanced", "bad_amount", "bad_direction", "unknown_subject", "fixed", "subject_guessed"],
+        description="触发升级的原因：凭证校验问题代码，以及 repaired(本地修复JSON)、fixed(经修正请求)、subject_guessed(按名称猜测科目)",
+    )
+    
+    # 上下文预算配置（发送前估算token数，提示词放不下时压缩/截断OCR文本、精简科目表或换用更大上下文的模型）
+    llm_context_windows: dict[str, int] = Field(
+        default={
+            "moonshot-v1-8k": 8192,
+            "moonshot-v1-32k": 32768,
+            "moonshot-v1-128k": 131072,
+            "deepseek-chat": 65536,
+            "deepseek-reasoner": 65536,
+        },
+        description="各模型的上下文窗口（JSON，tokens），未列出的模型按名称后缀（如 -32k）推断",
+    )
+    llm_default_context_window: int = Field(default=32768, description="无法推断上下文窗口的模型按此大小处理")
+    llm_larger_context_models: dict[str, str] = Field(
+        default={
+            "moonshot-v1-8k": "moonshot-v1-32k",
+            "moonshot-v1-32k": "moonshot-v1-128k",
+            "doubao-lite-4k": "doubao-lite-32k",
+            "doubao-lite-32k": "doubao-lite-128k",
+            "doubao-pro-4k": "doubao-pro-32k",
+            "doubao-pro-32k": "doubao-pro-128k",
+        },
+        description="提示词放不下时换用的更大上下文模型（JSON），在截断OCR文本之前尝试",
+    )
+    llm_max_output_tokens: int = Field(default=4096, description="大模型输出上限（max_tokens）")
+    llm_min_output_tokens: int = Field(default=1536, description="上下文不足时输出上限最低降到多少")
+    llm_token_estimate_margin: float = Field(default=1.1, description="token估算结果的放大系数（留出估算误差）")
+    
+    # 熔断配置（按外部端点）
+    circuit_failure_threshold: int = Field(default=5, description="端点连续失败多少次后熔断")
+    circuit_recovery_timeout: float = Field(default=30.0, description="端点熔断后多少秒进入半开试探")
+    
+    # 图片去重配置
+    dedup_enabled: bool = Field(default=True, description="是否对上传图片去重（同批次及跨批次）")
+    dedup_phash_threshold: int = Field(
+        default=10,
+        description="感知哈希汉明距离阈值（256位），不超过时标记为疑似重复（仍正常识别和导出），0表示不检测",
+    )
+    dedup_history_size: int = Field(default=1000, description="跨批次去重记住的最近图片数")
+    
+    # PDF配置
+    pdf_dpi: int = Field(default=200, description="PDF页面栅格化分辨率")
+    pdf_ocr_concurrency: int = Field(default=4, description="PDF同时进行OCR的页数")
+    
+    # 压缩包批量上传配置
+    archive_max_members: int = Field(default=1000, description="压缩包最多处理的文件数（含被跳过的系统文件、不支持的文件等，不含目录）")
+    archive_max_member_size: int = Field(default=20 * 1024 * 1024, description="压缩包内单个文件解压后的最大大小(20MB)")
+    archive_max_total_size: int = Field(default=500 * 1024 * 1024, description="压缩包解压后的最大总大小(500MB)")
+    archive_max_ratio: float = Field(default=100.0, description="压缩包成员允许的最大压缩比（防压缩炸弹）")
+    archive_prefetch: int = Field(default=4, description="识别当前文件时预先解压的文件数")
+    
+    # 识别结果存储配置
+    results_store_enabled: bool = Field(default=True, description="是否将识别结果保存到本地数据库")
+    results_db_path: str = Field(default="./data/results.db", description="识别结果SQLite数据库路径")
+    
+    # Excel列定义
+    excel_columns_file: Optional[str] = Field(default=None, description="自定义Excel列定义JSON文件（默认使用内置列）")
+    
+    # 导出缓存配置
+    export_cache_enabled: bool = Field(default=True, description="是否缓存生成的Excel文件（按内容哈希）")
+    export_cache_dir: str = Field(default="./data/export_cache", description="导出文件缓存目录")
+    export_cache_max_size: int = Field(default=200 * 1024 * 1024, description="导出文件缓存总大小上限(200MB)")
+    workbook_dir: str = Field(default="./data/workbooks", description="服务端保存的工作簿目录（用于追加导出）")
+    
+    # 响应压缩配置
+    compression_enabled: bool = Field(default=True, description="是否压缩JSON等文本响应（按Accept-Encoding协商br/zstd/gzip）")
+    compression_min_size: int = Field(default=1024, description="小于该大小（字节）的响应不压缩")
+    
+    # 优先级调度配置（OCR/大模型调用按 交互/批量/后台 通道和租户加权公平排队）
+    ocr_concurrency: int = Field(default=8, description="同时进行的OCR调用数上限，0表示不限（不排队）")
+    llm_concurrency: int = Field(default=8, description="同时进行的大模型调用数上限，0表示不限（不排队）")
+    scheduler_weights: dict[str, float] = Field(
+        default={"interactive": 8.0, "batch": 2.0, "background": 1.0},
+        description="各调度通道的权重（JSON），权重越大分到的调用越多",
+    )
+    interactive_reserved_share: float = Field(default=0.25, description="为交互通道（单张识别）保留的调用容量比例")
+    
+    # 准入控制配置（容量不足时排队，排不上返回429）
+    admission_max_files: int = Field(default=200, description="同时处理的上传文件数上限，0表示不限")
+    admission_max_bytes: int = Field(default=1024 * 1024 * 1024, description="同时接收/缓冲的识别请求体总大小上限(1GB)，0表示不限")
+    admission_queue_size: int = Field(default=32, description="容量不足时排队等待的请求数上限")
+    admission_max_wait: float = Field(default=10.0, description="排队最长等待秒数，超时返回429")
+    
+    # 幂等请求配置（识别接口的 Idempotency-Key）
+    idempotency_enabled: bool = Field(default=True, description="识别接口是否支持 Idempotency-Key 请求头")
+    idempotency_db_path: str = Field(default="./data/idempotency.db", description="幂等记录SQLite数据库路径")
+    idempotency_ttl: int = Field(default=24 * 3600, description="已完成请求的响应保留秒数")
+    idempotency_pending_timeout: int = Field(default=1800, description="执行中的请求超过多少秒未完成视为已中断，可重新执行")
+    
+    # 用量记账与预算配置（大模型按 prompt+completion tokens、OCR按计费调用次数，按自然日统计）
+    usage_enabled: bool = Field(default=True, description="是否记录大模型token用量和OCR计费调用次数")
+    usage_db_path: str = Field(default="./data/usage.db", description="用量记账SQLite数据库路径")
+    llm_daily_token_budgets: dict[str, int] = Field(
+        default={},
+        description="大模型每日token上限（JSON），键为 provider 或 provider/model，如 {\"deepseek\": 5000000}",
+    )
+    ocr_daily_call_budgets: dict[str, int] = Field(
+        default={},
+        description="OCR每日计费调用次数上限（JSON），键为 provider 或 provider/接口名，如 {\"baidu/multiple_invoice\": 1000}",
+    )
+    usage_soft_limit_ratio: float = Field(default=0.8, description="用量达到预算的该比例时记录告警（软限额），达到预算时拒绝调用")
+    llm_token_prices: dict[str, dict[str, float]] = Field(
+        default={},
+        description="大模型单价（JSON，元/百万tokens），如 {\"deepseek\": {\"prompt\": 2, \"cached\": 0.5, \"completion\": 8}}",
+    )
+    ocr_call_prices: dict[str, float] = Field(default={}, description="OCR单价（JSON，元/次），键同OCR预算")
+    
+    # 缩略图配置
+    thumbnail_dir: str = Field(default="./data/thumbnails", description="缩略图/预览图缓存目录")
+    thumbnail_workers: int = Field(default=2, description="生成缩略图的线程数")
+    
     # 文件上传配置
     max_file_size: int = Field(default=10 * 1024 * 1024, description="最大文件大小(10MB)")
+    max_request_size: int = Field(default=500 * 1024 * 1024, description="批量/压缩包识别请求体的最大大小(500MB，与nginx压缩包上传上限一致)")
     upload_dir: str = Field(default="./uploads", description="上传目录")
+    upload_retention_days: int = Field(default=0, description="上传文件保留天数（从最后一次上传算起），0表示被识别结果引用的文件一直保留")
+    upload_orphan_grace: int = Field(default=3600, description="未被识别结果引用的上传文件保留多少秒后清理")
+    upload_gc_interval: float = Field(default=3600.0, description="上传文件清理间隔（秒），0表示不清理")
     
     # 日志配置
     log_dir: str = Field(default="./logs", description="日志目录")
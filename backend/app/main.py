@@ -4,15 +4,26 @@ import time
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 
-from .api import router
+from .api import router, routes
+from .services import OCRRouter
 from .config import get_settings
 from .utils.logger import setup_logging, get_logger, get_request_logger
+from .utils.circuit_breaker import breaker_registry
+from .utils.compression import CompressionMiddleware, available_encodings
+from .utils.admission import AdmissionMiddleware
+from .utils.idempotency import IdempotencyMiddleware
 
 settings = get_settings()
 
+# 外部端点熔断阈值
+breaker_registry.configure(
+    failure_threshold=settings.circuit_failure_threshold,
+    recovery_timeout=settings.circuit_recovery_timeout,
+)
+
 # 初始化日志
 setup_logging(log_dir=settings.log_dir, log_level=settings.log_level)
 logger = get_logger(__name__)
@@ -25,6 +36,8 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    # 默认用orjson编码响应
+    default_response_class=ORJSONResponse,
 )
 
 # 请求日志中间件
@@ -70,6 +83,29 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
                 content={"detail": "内部服务器错误"}
             )
 
+# 识别请求幂等（Idempotency-Key）：超时后重试的请求等待原请求完成或直接返回已保存的结果
+# 位于压缩中间件内层，保存的是未压缩的响应体
+if routes.idempotency_store is not None:
+    app.add_middleware(IdempotencyMiddleware, store=routes.idempotency_store, paths=["/api/recognize"])
+
+# 响应压缩（批量识别结果中的OCR文本重复度高，压缩后传输量大幅减少）
+# 在请求日志中间件之前添加（位于其内层），直接拿到完整响应体，压缩后仍带 Content-Length
+if settings.compression_enabled:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size)
+
+# 识别请求准入：按请求体大小申请缓冲容量，超限的上传在接收过程中即返回413，容量不足返回429
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=routes.admission,
+    limits=[
+        # 单张识别只有一个文件，另留1MB给表单其他字段和分隔符
+        ("/api/recognize/single", settings.max_file_size + 1024 * 1024, settings.max_file_size),
+        # 批量识别的每个文件都不能超过单文件上限；压缩包只按请求体上限控制
+        ("/api/recognize/batch", settings.max_request_size, settings.max_file_size),
+        ("/api/recognize", settings.max_request_size, None),
+    ],
+)
+
 # 添加请求日志中间件
 app.add_middleware(RequestLoggingMiddleware)
 
@@ -110,15 +146,23 @@ async def startup_event():
     from app.services import OCRService, LLMService
     from app.api import routes
     
+    # 后台清理未被引用/超过保留期的上传文件，并删除对应的缩略图
+    routes.upload_store.start_gc(
+        settings.upload_gc_interval,
+        referenced=routes.referenced_uploads,
+        after=routes.thumbnail_service.prune,
+    )
+    
     # 初始化OCR服务（如果配置了默认值）
     if settings.ocr_api_key and settings.ocr_secret_key:
         try:
-            routes.ocr_service = OCRService(
+            routes.set_ocr_service(OCRService(
                 provider=settings.ocr_provider,
                 api_key=settings.ocr_api_key,
                 secret_key=settings.ocr_secret_key,
                 endpoint=settings.ocr_endpoint,
-            )
+                usage=routes.usage_store,
+            ))
             routes.current_config["ocr"] = {
                 "provider": settings.ocr_provider,
                 "api_key": settings.ocr_api_key,
@@ -137,6 +181,7 @@ async def startup_event():
                 api_key=settings.llm_api_key,
                 model=settings.llm_model,
                 endpoint=settings.llm_endpoint,
+                usage=routes.usage_store,
             )
             routes.current_config["llm"] = {
                 "provider": settings.llm_provider,
@@ -148,12 +193,34 @@ async def startup_event():
         except Exception as e:
             logger.warning(f"LLM服务自动初始化失败: {str(e)}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止后台任务"""
+    from app.api import routes
+    
+    if isinstance(routes.ocr_service, OCRRouter):
+        routes.ocr_service.stop_probing()
+    routes.upload_store.stop_gc()
+    if routes.results_store is not None:
+        routes.results_store.close()
+    if routes.idempotency_store is not None:
+        routes.idempotency_store.close()
+    if routes.usage_store is not None:
+        routes.usage_store.close()
+    routes.thumbnail_service.close()
+
 # 启动日志
 logger.info("=" * 50)
 logger.info(f"启动 {settings.app_name}")
 logger.info(f"日志级别: {settings.log_level}")
 logger.info(f"日志目录: {settings.log_dir}")
 logger.info(f"上传目录: {settings.upload_dir}")
+if settings.upload_retention_days > 0:
+    logger.info(f"上传文件保留: {settings.upload_retention_days} 天")
+if settings.results_store_enabled:
+    logger.info(f"结果库: {settings.results_db_path}")
+if settings.compression_enabled:
+    logger.info(f"响应压缩: {', '.join(available_encodings())} (>= {settings.compression_min_size} bytes)")
 logger.info("=" * 50)
 
 
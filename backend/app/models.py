@@ -1,6 +1,28 @@
 """数据模型定义"""
-from pydantic import BaseModel, Field
-from typing import Optional, List
+import re
+from pydantic import BaseModel, BeforeValidator, Field, computed_field, field_validator
+from typing import Annotated, Any, Optional, List
+
+
+def _coerce_number(value: Any, default: Optional[float]) -> Any:
+    """清洗大模型以字符串形式返回的数字（如 "¥1,234.50"），交由pydantic转换为数值"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        cleaned = re.sub(r"[\s,，¥￥元]", "", value)
+        if cleaned in ("", "-", "null", "None"):
+            return default
+        return cleaned
+    return value
+
+
+def _coerce_str(value: Any) -> Any:
+    """将 None/数字 等非字符串值转换为字符串"""
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
 
 
 class OCRConfig(BaseModel):
@@ -9,6 +31,20 @@ class OCRConfig(BaseModel):
     api_key: str = Field(description="API Key")
     secret_key: Optional[str] = Field(default=None, description="Secret Key (部分提供商需要)")
     endpoint: Optional[str] = Field(default=None, description="API端点 (可选)")
+    cascade: Optional[bool] = Field(
+        default=None, description="是否启用OCR级联（仅百度，先快速接口，低置信度再用高精度/票据接口），不传时使用服务端配置"
+    )
+
+
+class OCRRouterMemberConfig(OCRConfig):
+    """OCR路由中的单个提供商配置"""
+    cost: float = Field(default=0.0, ge=0, description="单次调用成本（cost模式下按此排序）")
+
+
+class OCRRouterConfig(BaseModel):
+    """OCR路由配置"""
+    providers: List[OCRRouterMemberConfig] = Field(description="按优先级排列的OCR提供商列表")
+    mode: str = Field(default="ordered", description="路由模式: ordered(按顺序), cost(按成本), latency(按延迟)")
 
 
 class LLMConfig(BaseModel):
@@ -17,6 +53,21 @@ class LLMConfig(BaseModel):
     api_key: str = Field(description="API Key")
     model: Optional[str] = Field(default=None, description="模型名称")
     endpoint: Optional[str] = Field(default=None, description="API端点 (可选)")
+    cascade: Optional[List[str]] = Field(
+        default=None,
+        description="在 model 之前依次尝试的较小模型（级联），不传时使用服务端配置 llm_cascade，传空列表表示不级联",
+    )
+
+
+class LLMRouterMemberConfig(LLMConfig):
+    """大模型路由中的单个提供商配置"""
+    weight: float = Field(default=1.0, ge=0, description="路由权重")
+
+
+class LLMRouterConfig(BaseModel):
+    """大模型路由配置"""
+    providers: List[LLMRouterMemberConfig] = Field(description="参与路由的提供商列表")
+    hedge_enabled: Optional[bool] = Field(default=None, description="是否启用对冲请求（默认使用服务端配置）")
 
 
 class AppConfig(BaseModel):
@@ -50,9 +101,40 @@ class VoucherEntry(BaseModel):
     department: str = Field(default="", description="部门名称")
     project: str = Field(default="", description="项目名称")
 
+    @field_validator("amount", "original_amount", mode="before")
+    @classmethod
+    def _parse_amount(cls, value):
+        return _coerce_number(value, 0)
+
+    @field_validator("exchange_rate", mode="before")
+    @classmethod
+    def _parse_exchange_rate(cls, value):
+        return _coerce_number(value, 1)
+
+    @field_validator("quantity", "unit_price", mode="before")
+    @classmethod
+    def _parse_optional_number(cls, value):
+        return _coerce_number(value, None)
+
+    @field_validator(
+        "subject_code", "subject_name", "summary", "direction", "currency",
+        "settlement_method", "settlement_date", "settlement_no", "business_date",
+        "employee_no", "employee_name", "partner_no", "partner_name",
+        "product_no", "product_name", "department", "project",
+        mode="before",
+    )
+    @classmethod
+    def _parse_str(cls, value):
+        return _coerce_str(value)
+
 
 class VoucherData(BaseModel):
-    """凭证数据"""
+    """
+    凭证数据
+    
+    识别、校验、存储、导出之间传递的凭证对象（不再传递原始dict）；
+    从JSON文本构造时用 model_validate_json 直接解析，不经过中间dict。
+    """
     voucher_date: str = Field(default="", description="编制日期")
     voucher_type: str = Field(default="记", description="凭证类型")
     voucher_no: str = Field(default="", description="凭证号")
@@ -61,6 +143,54 @@ class VoucherData(BaseModel):
     fiscal_year: str = Field(default="", description="会计年度")
     entries: List[VoucherEntry] = Field(default_factory=list, description="分录列表")
 
+    @field_validator("attachment_count", mode="before")
+    @classmethod
+    def _parse_attachment_count(cls, value):
+        if isinstance(value, str):
+            digits = re.search(r"\d+", value)
+            return int(digits.group()) if digits else 0
+        if isinstance(value, float):
+            return int(value)
+        return 0 if value is None else value
+
+    @field_validator("voucher_date", "voucher_type", "voucher_no", "preparer", "fiscal_year", mode="before")
+    @classmethod
+    def _parse_str(cls, value):
+        return _coerce_str(value)
+
+    @field_validator("entries", mode="before")
+    @classmethod
+    def _parse_entries(cls, value):
+        if value is None:
+            return []
+        # 只有一条分录时模型有时直接返回对象而不是数组
+        if isinstance(value, dict):
+            return [value]
+        return value
+
+
+def _drop_failed(value: Any) -> Any:
+    """客户端回传的识别失败项（含 error 字段）不是凭证，导出时跳过"""
+    if isinstance(value, list):
+        return [item for item in value if not (isinstance(item, dict) and "error" in item)]
+    return value
+
+
+# 客户端提交的凭证列表（导出、追加）
+VoucherList = Annotated[List[VoucherData], BeforeValidator(_drop_failed)]
+
+
+class VoucherValidation(BaseModel):
+    """凭证校验结果"""
+    valid: bool = Field(description="是否通过全部校验")
+    issues: List[str] = Field(default_factory=list, description="问题说明")
+    codes: List[str] = Field(
+        default_factory=list,
+        description="问题代码: no_entries, unbalanced, bad_amount, bad_direction, bad_date, unknown_subject, subject_name_mismatch",
+    )
+    debit_total: float = Field(description="借方合计")
+    credit_total: float = Field(description="贷方合计")
+
 
 class RecognitionResult(BaseModel):
     """识别结果"""
@@ -68,18 +198,135 @@ class RecognitionResult(BaseModel):
     filename: str = Field(description="文件名")
     image_url: Optional[str] = Field(default=None, description="图片URL，用于显示缩略图")
     ocr_text: Optional[str] = Field(default=None, description="OCR识别的文本")
-    voucher_data: Optional[dict] = Field(default=None, description="结构化凭证数据")
+    voucher_data: Optional[VoucherData] = Field(default=None, description="结构化凭证数据")
     error: Optional[str] = Field(default=None, description="错误信息")
+    duplicate_of: Optional[str] = Field(default=None, description="重复图片时为首次识别的文件名，结果复用自该文件，导出时应跳过")
+    possible_duplicate_of: Optional[str] = Field(
+        default=None,
+        description="疑似重复：图片与该文件相似（如重新拍摄，或同一模板的不同票据），仍单独识别和导出，请人工核对",
+    )
+    pages: Optional[List[int]] = Field(default=None, description="来自PDF时该凭证所在的页码")
+    page_image_urls: Optional[List[Optional[str]]] = Field(
+        default=None, description="来自PDF时各页图片的URL（与 pages 一一对应，保存失败的页面为null）"
+    )
+    file_hash: Optional[str] = Field(default=None, description="上传文件内容的SHA-256")
+    ocr_time: Optional[float] = Field(default=None, description="OCR耗时（秒）")
+    llm_time: Optional[float] = Field(default=None, description="大模型耗时（秒）")
+    llm_provider: Optional[str] = Field(default=None, description="实际给出识别结果的大模型提供商")
+    llm_model: Optional[str] = Field(default=None, description="实际给出识别结果的模型")
+    result_id: Optional[int] = Field(default=None, description="识别结果在结果库中的ID")
+    validation: Optional[VoucherValidation] = Field(default=None, description="凭证校验结果（借贷平衡、金额、日期、方向、科目）")
+
+    def _derivative_url(self, variant: str) -> Optional[str]:
+        if not self.image_url or not self.image_url.startswith("/uploads/"):
+            return None
+        return f"/thumbnails/{variant}/{self.image_url[len('/uploads/'):]}"
+
+    @computed_field(description="缩略图URL（列表展示用，约240px）")
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return self._derivative_url("thumb")
+
+    @computed_field(description="预览图URL（详情查看用，约1280px）")
+    @property
+    def preview_url(self) -> Optional[str]:
+        return self._derivative_url("preview")
 
 
 class BatchRecognitionResult(BaseModel):
     """批量识别结果"""
+    batch_id: Optional[str] = Field(default=None, description="结果库中的批次ID")
     total: int = Field(description="总数")
     success_count: int = Field(description="成功数")
     failed_count: int = Field(description="失败数")
+    duplicate_count: int = Field(default=0, description="重复图片数（未重复识别）")
+    invalid_count: int = Field(default=0, description="未通过凭证校验的结果数")
     results: List[RecognitionResult] = Field(description="识别结果列表")
 
 
+class ArchiveMemberResult(BaseModel):
+    """压缩包成员处理结果"""
+    name: str = Field(description="压缩包内的文件路径")
+    size: int = Field(description="解压后大小（字节）")
+    status: str = Field(description="处理状态: processed(已识别), skipped(已跳过)")
+    reason: Optional[str] = Field(default=None, description="跳过原因")
+    result_indexes: List[int] = Field(default_factory=list, description="对应的识别结果在 results 中的下标")
+
+
+class ArchiveRecognitionResult(BatchRecognitionResult):
+    """压缩包识别结果"""
+    members: List[ArchiveMemberResult] = Field(description="各成员的处理结果")
+    error: Optional[str] = Field(default=None, description="压缩包整体错误（如超出限制而中止）")
+
+
+class StoredResult(RecognitionResult):
+    """结果库中保存的识别结果"""
+    result_id: int = Field(description="识别结果ID")
+    batch_id: str = Field(description="批次ID")
+    created_at: str = Field(description="识别时间")
+    ocr_provider: Optional[str] = Field(default=None, description="OCR提供商")
+
+
+class StoredResultPage(BaseModel):
+    """识别结果分页"""
+    total: int = Field(description="符合条件的总数")
+    page: int = Field(description="页码（从1开始）")
+    page_size: int = Field(description="每页条数")
+    items: List[StoredResult] = Field(description="当前页的识别结果")
+
+
+class BatchInfo(BaseModel):
+    """识别批次"""
+    id: str = Field(description="批次ID")
+    source: str = Field(description="来源: single, batch, archive, streamlit")
+    filename: Optional[str] = Field(default=None, description="上传的文件名（压缩包等）")
+    created_at: str = Field(description="识别时间")
+    total: int = Field(description="结果数")
+    success_count: int = Field(description="成功数")
+    failed_count: int = Field(description="失败数")
+    duplicate_count: int = Field(description="重复图片数")
+
+
+class BatchInfoPage(BaseModel):
+    """识别批次分页"""
+    total: int = Field(description="批次总数")
+    page: int = Field(description="页码（从1开始）")
+    page_size: int = Field(description="每页条数")
+    items: List[BatchInfo] = Field(description="当前页的批次")
+
+
+class ExportRequest(BaseModel):
+    """按结果库中的记录导出Excel（各条件同时满足）"""
+    result_ids: Optional[List[int]] = Field(default=None, description="识别结果ID（按给定顺序导出）")
+    batch_ids: Optional[List[str]] = Field(default=None, description="批次ID")
+    date_from: Optional[str] = Field(default=None, description="凭证日期起（含），YYYY-MM-DD")
+    date_to: Optional[str] = Field(default=None, description="凭证日期止（含），YYYY-MM-DD")
+    voucher_no: Optional[str] = Field(default=None, description="凭证号")
+    partner: Optional[str] = Field(default=None, description="往来单位名称（前缀匹配）")
+
+
+class WorkbookAppendRequest(ExportRequest):
+    """向工作簿追加凭证：直接给出凭证数据，或按结果库条件选择"""
+    vouchers: Optional[VoucherList] = Field(default=None, description="凭证数据列表（给出时忽略结果库选择条件）")
+
+
+class WorkbookAppendResult(BaseModel):
+    """追加结果"""
+    workbook: str = Field(description="工作簿名称")
+    rows_added: int = Field(description="新增行数")
+    voucher_count: int = Field(description="新增凭证数")
+    first_seq: Optional[int] = Field(default=None, description="新增凭证的起始凭证序号")
+    last_seq: Optional[int] = Field(default=None, description="新增凭证的最后凭证序号")
+    last_row: int = Field(description="追加后的最后一行行号")
+
+
+class WorkbookInfo(BaseModel):
+    """服务端工作簿"""
+    name: str = Field(description="工作簿名称")
+    size: int = Field(description="文件大小（字节）")
+    modified_at: str = Field(description="最后修改时间")
+
+
 class SubjectInfo(BaseModel):
     """会计科目信息"""
     code: str = Field(description="科目编码")
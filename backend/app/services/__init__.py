@@ -1,6 +1,18 @@
 from .ocr_service import OCRService
+from .ocr_router import OCRRouter, OCRRouterMember
 from .llm_service import LLMService
+from .llm_router import LLMRouter, RouterMember
 from .excel_service import ExcelService
+from .pdf_service import PDFService
+from .archive_service import ArchiveService
+from .results_store import ResultsStore
+from .export_cache import ExportCache
+from .workbook_service import WorkbookService
+from .thumbnail_service import ThumbnailService
+from .upload_store import UploadStore
+from .idempotency_store import IdempotencyStore
+from .usage_store import UsageStore
+from .text_normalizer import TextNormalizer
 
-__all__ = ["OCRService", "LLMService", "ExcelService"]
+__all__ = ["OCRService", "OCRRouter", "OCRRouterMember", "LLMService", "LLMRouter", "RouterMember", "ExcelService", "PDFService", "ArchiveService", "ResultsStore", "ExportCache", "WorkbookService", "ThumbnailService", "UploadStore", "IdempotencyStore", "UsageStore", "TextNormalizer"]
 
@@ -0,0 +1,156 @@
+"""压缩包服务 - 流式读取ZIP/TAR中的凭证文件，并做大小和压缩炸弹防护"""
+import os
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+
+class ArchiveError(Exception):
+    """压缩包无法处理"""
+
+
+class ArchiveLimitError(ArchiveError):
+    """压缩包超出整体限制（成员数量、解压总大小），停止继续解压"""
+
+
+@dataclass
+class ArchiveMember:
+    """压缩包中的一个成员"""
+    name: str
+    size: int  # 解压后大小（被拒绝时为声明的大小）
+    data: Optional[bytes] = None
+    skipped_reason: Optional[str] = None  # 被跳过/拒绝的原因
+
+
+class ArchiveService:
+    """压缩包服务"""
+
+    SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".pdf"}
+    READ_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        max_members: int = 1000,
+        max_member_size: int = 20 * 1024 * 1024,
+        max_total_size: int = 500 * 1024 * 1024,
+        max_ratio: float = 100.0,
+    ):
+        """
+        Args:
+            max_members: 最多处理的成员数（目录以外的所有成员，含被跳过的）
+            max_member_size: 单个成员解压后的最大字节数
+            max_total_size: 所有成员解压后的最大总字节数
+            max_ratio: ZIP成员允许的最大压缩比（超过视为压缩炸弹）
+        """
+        self.max_members = max_members
+        self.max_member_size = max_member_size
+        self.max_total_size = max_total_size
+        self.max_ratio = max_ratio
+
+    def iter_members(self, fileobj: BinaryIO) -> Iterator[ArchiveMember]:
+        """
+        逐个产出压缩包成员
+
+        ZIP按需解压每个成员；TAR（含 .tar.gz/.tar.bz2/.tar.xz）以流模式顺序读取，
+        都不会先把整个压缩包解压到磁盘或内存。
+
+        Raises:
+            ArchiveError: 不是支持的压缩包格式
+            ArchiveLimitError: 超出成员数量或解压总大小限制
+        """
+        fileobj.seek(0)
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            yield from self._iter_zip(fileobj)
+            return
+
+        fileobj.seek(0)
+        try:
+            archive = tarfile.open(fileobj=fileobj, mode="r|*")
+        except tarfile.TarError:
+            raise ArchiveError("不支持的压缩包格式，仅支持 ZIP 和 TAR（含 .tar.gz/.tgz）")
+        with archive:
+            yield from self._iter_tar(archive)
+
+    def _iter_zip(self, fileobj: BinaryIO) -> Iterator[ArchiveMember]:
+        with zipfile.ZipFile(fileobj) as archive:
+            counter = _Counter(self)
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # 被跳过的成员也计数，否则大量无关的小文件不受数量限制
+                counter.add_member()
+                reason = self._check_name(info.filename)
+                if reason is None and info.flag_bits & 0x1:
+                    reason = "加密文件不支持"
+                if reason is None and info.compress_size and info.file_size / info.compress_size > self.max_ratio:
+                    reason = f"压缩比异常（{info.file_size / info.compress_size:.0f}:1），疑似压缩炸弹"
+                if reason is None and info.file_size > self.max_member_size:
+                    reason = f"文件过大（{info.file_size} 字节）"
+                if reason:
+                    yield ArchiveMember(info.filename, info.file_size, skipped_reason=reason)
+                    continue
+
+                with archive.open(info) as stream:
+                    yield self._read_member(info.filename, stream, counter)
+
+    def _iter_tar(self, archive: tarfile.TarFile) -> Iterator[ArchiveMember]:
+        counter = _Counter(self)
+        for info in archive:
+            if not info.isfile():
+                continue
+            counter.add_member()
+            reason = self._check_name(info.name)
+            if reason is None and info.size > self.max_member_size:
+                reason = f"文件过大（{info.size} 字节）"
+            if reason:
+                yield ArchiveMember(info.name, info.size, skipped_reason=reason)
+                continue
+
+            stream = archive.extractfile(info)
+            yield self._read_member(info.name, stream, counter)
+
+    def _check_name(self, name: str) -> Optional[str]:
+        """检查成员名称，返回跳过原因"""
+        basename = os.path.basename(name)
+        if name.startswith("__MACOSX/") or basename.startswith("."):
+            return "系统文件"
+        ext = os.path.splitext(basename)[-1].lower()
+        if ext not in self.SUPPORTED_EXTENSIONS:
+            return f"不支持的文件类型: {ext or '无扩展名'}"
+        return None
+
+    def _read_member(self, name: str, stream: BinaryIO, counter: "_Counter") -> ArchiveMember:
+        """按块读取成员，以实际解压字节数（而不是头部声明的大小）执行限制"""
+        chunks = []
+        size = 0
+        while True:
+            chunk = stream.read(self.READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            counter.add_bytes(len(chunk))
+            if size > self.max_member_size:
+                return ArchiveMember(name, size, skipped_reason=f"文件过大（超过 {self.max_member_size} 字节）")
+            chunks.append(chunk)
+        return ArchiveMember(name, size, data=b"".join(chunks))
+
+
+class _Counter:
+    """统计已遍历的成员数和已解压的字节数"""
+
+    def __init__(self, service: ArchiveService):
+        self.service = service
+        self.members = 0
+        self.total_bytes = 0
+
+    def add_member(self):
+        self.members += 1
+        if self.members > self.service.max_members:
+            raise ArchiveLimitError(f"压缩包文件数超过上限 {self.service.max_members}")
+
+    def add_bytes(self, count: int):
+        self.total_bytes += count
+        if self.total_bytes > self.service.max_total_size:
+            raise ArchiveLimitError(f"压缩包解压总大小超过上限 {self.service.max_total_size} 字节")
@@ -0,0 +1,122 @@
+"""图片去重服务 - 精确哈希识别重复上传的凭证图片，感知哈希（差值哈希）提示疑似重复"""
+import hashlib
+import io
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+
+# 感知哈希边长：16 → 256位 dHash，比常见的8×8更能区分同一模板的不同票据
+PHASH_SIZE = 16
+# 置位数过少（或过多）的感知哈希来自接近纯色的图片（如空白页），不用于近似匹配
+PHASH_MIN_BITS = 16
+
+
+@dataclass(frozen=True)
+class ImageFingerprint:
+    """图片指纹"""
+    exact: str  # 文件内容的SHA-256
+    phash: Optional[int] = None  # 感知哈希（无法解码为图片时为None）
+
+
+def exact_hash(data: bytes) -> str:
+    """文件内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data: bytes, hash_size: int = PHASH_SIZE) -> Optional[int]:
+    """
+    计算差值哈希（dHash）
+
+    缩放为 (hash_size+1) × hash_size 灰度图后比较相邻像素亮度，
+    对重新拍摄/重新压缩/轻微缩放的同一张票据保持稳定。
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (hash_size * 8, hash_size * 8))  # JPEG按需降采样解码，减少CPU开销
+            pixels = list(
+                image.convert("L")
+                .resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+                .getdata()
+            )
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(data: bytes) -> ImageFingerprint:
+    """计算图片指纹（CPU密集，在异步代码中应放到线程中执行）"""
+    return ImageFingerprint(exact=exact_hash(data), phash=perceptual_hash(data))
+
+
+class DedupIndex:
+    """
+    重复图片索引
+
+    只有内容完全相同（精确哈希一致）的图片视为重复，可以复用识别结果；
+    感知哈希汉明距离接近的图片只是疑似重复：同一模板的不同票据（金额、票号不同）
+    的差值哈希可能非常接近，不能据此跳过识别。
+    超过容量时淘汰最早加入的记录。
+    """
+
+    def __init__(self, max_entries: int = 1000, phash_threshold: int = 10):
+        """
+        Args:
+            max_entries: 最多保留的记录数
+            phash_threshold: 感知哈希汉明距离不超过该值视为疑似重复（256位中），0表示不检测
+        """
+        self.max_entries = max_entries
+        self.phash_threshold = phash_threshold
+        self._entries: OrderedDict[str, tuple[ImageFingerprint, str, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def find(self, fp: ImageFingerprint) -> Optional[tuple[str, Any]]:
+        """
+        查找内容完全相同的图片
+
+        Returns:
+            (原始文件名, 记录的识别结果)，未找到时返回None
+        """
+        entry = self._entries.get(fp.exact)
+        if entry is not None:
+            return entry[1], entry[2]
+        return None
+
+    def find_similar(self, fp: ImageFingerprint) -> Optional[tuple[str, int]]:
+        """
+        查找感知哈希最接近的相似图片（疑似重复，仅用于提示人工核对）
+
+        Returns:
+            (文件名, 汉明距离)，未找到时返回None
+        """
+        if fp.phash is None or self.phash_threshold <= 0:
+            return None
+        bits = fp.phash.bit_count()
+        if bits < PHASH_MIN_BITS or bits > PHASH_SIZE * PHASH_SIZE - PHASH_MIN_BITS:
+            return None
+        best = None
+        best_distance = self.phash_threshold + 1
+        for other, filename, _ in self._entries.values():
+            if other.phash is None or other.exact == fp.exact:
+                continue
+            distance = (fp.phash ^ other.phash).bit_count()
+            if distance < best_distance:
+                best, best_distance = (filename, distance), distance
+        return best
+
+    def add(self, fp: ImageFingerprint, filename: str, result: Any):
+        """记录一张图片及其识别结果"""
+        self._entries[fp.exact] = (fp, filename, result)
+        self._entries.move_to_end(fp.exact)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
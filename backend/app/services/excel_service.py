@@ -1,226 +1,237 @@
 """Excel服务 - 生成财务凭证Excel表格"""
+import copy
+import hashlib
 import io
-from datetime import datetime
-from typing import Optional
+import json
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
 from openpyxl import Workbook
+from openpyxl.cell import Cell
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
+from openpyxl.utils.indexed_list import IndexedList
 
+from ..models import VoucherData
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """表格列定义"""
+    header: str  # 表头
+    field: str  # 数据字段名（voucher_seq 为自动生成的凭证序号）
+    scope: str = "entry"  # 取值来源: voucher(凭证级) / entry(分录级)
+    width: float = 12
+    numeric: bool = False  # 数字列右对齐
+    default: Any = ""  # 字段缺失时的值
+
+
+# 默认列定义（顺序即Excel列顺序）
+DEFAULT_COLUMNS: tuple[ColumnSpec, ...] = (
+    ColumnSpec("编制日期", "voucher_date", "voucher", 12),
+    ColumnSpec("凭证类型", "voucher_type", "voucher", 10, default="记"),
+    ColumnSpec("凭证序号", "voucher_seq", "voucher", 8, numeric=True),
+    ColumnSpec("凭证号", "voucher_no", "voucher", 10),
+    ColumnSpec("制单人", "preparer", "voucher", 10),
+    ColumnSpec("附件张数", "attachment_count", "voucher", 8, numeric=True, default=0),
+    ColumnSpec("会计年度", "fiscal_year", "voucher", 10),
+    ColumnSpec("科目编码", "subject_code", width=10),
+    ColumnSpec("科目名称", "subject_name", width=15),
+    ColumnSpec("凭证摘要", "summary", width=20),
+    ColumnSpec("借贷方向", "direction", width=8),
+    ColumnSpec("金额", "amount", width=12, numeric=True),
+    ColumnSpec("币种", "currency", width=8, default="人民币"),
+    ColumnSpec("汇率", "exchange_rate", width=8, numeric=True, default=1),
+    ColumnSpec("原币金额", "original_amount", width=12, numeric=True),
+    ColumnSpec("数量", "quantity", width=10, numeric=True),
+    ColumnSpec("单价", "unit_price", width=10, numeric=True),
+    ColumnSpec("结算方式名称", "settlement_method", width=12),
+    ColumnSpec("结算日期", "settlement_date", width=12),
+    ColumnSpec("结算票号", "settlement_no", width=12),
+    ColumnSpec("业务日期", "business_date", width=12),
+    ColumnSpec("员工编号", "employee_no", width=10),
+    ColumnSpec("员工姓名", "employee_name", width=10),
+    ColumnSpec("往来单位编号", "partner_no", width=12),
+    ColumnSpec("往来单位名称", "partner_name", width=15),
+    ColumnSpec("货品编号", "product_no", width=10),
+    ColumnSpec("货品名称", "product_name", width=15),
+    ColumnSpec("部门名称", "department", width=12),
+    ColumnSpec("项目名称", "project", width=15),
+)
 
 # Excel表头定义
-EXCEL_HEADERS = [
-    "编制日期",
-    "凭证类型",
-    "凭证序号",
-    "凭证号",
-    "制单人",
-    "附件张数",
-    "会计年度",
-    "科目编码",
-    "科目名称",
-    "凭证摘要",
-    "借贷方向",
-    "金额",
-    "币种",
-    "汇率",
-    "原币金额",
-    "数量",
-    "单价",
-    "结算方式名称",
-    "结算日期",
-    "结算票号",
-    "业务日期",
-    "员工编号",
-    "员工姓名",
-    "往来单位编号",
-    "往来单位名称",
-    "货品编号",
-    "货品名称",
-    "部门名称",
-    "项目名称",
-]
+EXCEL_HEADERS = [column.header for column in DEFAULT_COLUMNS]
 
 # 字段映射（从LLM返回的数据字段到Excel列）
-FIELD_MAPPING = {
-    "voucher_date": "编制日期",
-    "voucher_type": "凭证类型",
-    "voucher_seq": "凭证序号",
-    "voucher_no": "凭证号",
-    "preparer": "制单人",
-    "attachment_count": "附件张数",
-    "fiscal_year": "会计年度",
-    "subject_code": "科目编码",
-    "subject_name": "科目名称",
-    "summary": "凭证摘要",
-    "direction": "借贷方向",
-    "amount": "金额",
-    "currency": "币种",
-    "exchange_rate": "汇率",
-    "original_amount": "原币金额",
-    "quantity": "数量",
-    "unit_price": "单价",
-    "settlement_method": "结算方式名称",
-    "settlement_date": "结算日期",
-    "settlement_no": "结算票号",
-    "business_date": "业务日期",
-    "employee_no": "员工编号",
-    "employee_name": "员工姓名",
-    "partner_no": "往来单位编号",
-    "partner_name": "往来单位名称",
-    "product_no": "货品编号",
-    "product_name": "货品名称",
-    "department": "部门名称",
-    "project": "项目名称",
-}
+FIELD_MAPPING = {column.field: column.header for column in DEFAULT_COLUMNS}
+
+SHEET_TITLE = "财务凭证"
+
+# 样式对象不可变，进程内只创建一次
+THIN_BORDER = Border(
+    left=Side(style="thin"),
+    right=Side(style="thin"),
+    top=Side(style="thin"),
+    bottom=Side(style="thin"),
+)
+HEADER_FONT = Font(bold=True, size=11)
+HEADER_FILL = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+DATA_ALIGNMENT = Alignment(horizontal="left", vertical="center")
+NUMBER_ALIGNMENT = Alignment(horizontal="right", vertical="center")
+
+# 工作簿中的样式表（单元格只保存样式在这些表中的序号），复制表头时一并复制
+STYLE_TABLES = ("_fonts", "_fills", "_borders", "_alignments", "_protections", "_number_formats", "_cell_styles")
+
+
+def load_columns(path: str) -> tuple[ColumnSpec, ...]:
+    """
+    从JSON文件加载自定义列定义
+    
+    文件内容为列定义数组，如 [{"header": "编制日期", "field": "voucher_date", "scope": "voucher"}, ...]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    columns = tuple(ColumnSpec(**item) for item in items)
+    if not columns:
+        raise ValueError(f"列定义为空: {path}")
+    for column in columns:
+        if column.scope not in ("voucher", "entry"):
+            raise ValueError(f"列「{column.header}」的 scope 无效: {column.scope}")
+    return columns
 
 
 class ExcelService:
     """Excel服务"""
     
-    def __init__(self):
-        self.headers = EXCEL_HEADERS
-        self.field_mapping = FIELD_MAPPING
+    # 按列定义缓存的空白模板和带表头的工作簿原型，同样列定义的服务实例共用
+    _template_cache: dict[tuple, bytes] = {}
+    _prototype_cache: dict[tuple, Workbook] = {}
+    _template_lock = threading.Lock()
+    # 生成模板时会创建工作簿（需要原型），原型单独加锁
+    _prototype_lock = threading.Lock()
+    
+    def __init__(self, columns: Optional[tuple[ColumnSpec, ...]] = None, sheet_title: str = SHEET_TITLE):
+        """
+        Args:
+            columns: 列定义，默认使用 DEFAULT_COLUMNS
+            sheet_title: 工作表名称
+        """
+        self.columns = tuple(columns or DEFAULT_COLUMNS)
+        self.sheet_title = sheet_title
+        self.headers = [column.header for column in self.columns]
+        self.field_mapping = {column.field: column.header for column in self.columns}
+        self._column_letters = [get_column_letter(col) for col in range(1, len(self.columns) + 1)]
+        self._alignments = [NUMBER_ALIGNMENT if column.numeric else DATA_ALIGNMENT for column in self.columns]
+        self._entry_columns = [column for column in self.columns if column.scope == "entry"]
+        # 列定义决定模板内容，以其哈希作为模板的ETag
+        config = json.dumps(
+            {"title": sheet_title, "columns": [asdict(column) for column in self.columns]},
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        self.template_etag = hashlib.sha256(config.encode("utf-8")).hexdigest()[:32]
     
     def create_workbook(self) -> Workbook:
-        """创建新的工作簿"""
+        """
+        创建新的工作簿（带表头）
+        
+        表头按列定义在进程内只生成一次（工作簿原型），之后复制原型的样式表、表头单元格、列宽和冻结窗格。
+        """
+        prototype = self._prototype()
+        source = prototype.active
         wb = Workbook()
+        for name in STYLE_TABLES:
+            setattr(wb, name, IndexedList(getattr(prototype, name)))
         ws = wb.active
-        ws.title = "财务凭证"
-        
-        # 设置表头样式
-        header_font = Font(bold=True, size=11)
-        header_fill = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin"),
-        )
+        ws.title = source.title
+        for (row, col), cell in source._cells.items():
+            header = Cell(ws, row=row, column=col, value=cell.value)
+            header._style = copy.copy(cell._style)
+            ws._cells[(row, col)] = header
+        for letter, dimension in source.column_dimensions.items():
+            ws.column_dimensions[letter].width = dimension.width
+        ws.freeze_panes = source.freeze_panes
+        return wb
+    
+    def _prototype(self) -> Workbook:
+        """带表头的工作簿原型（只读，不直接写入数据）"""
+        key = (self.sheet_title, self.columns)
+        prototype = self._prototype_cache.get(key)
+        if prototype is None:
+            with self._prototype_lock:
+                prototype = self._prototype_cache.get(key)
+                if prototype is None:
+                    prototype = self._build_workbook()
+                    self._prototype_cache[key] = prototype
+        return prototype
+    
+    def _build_workbook(self) -> Workbook:
+        """按列定义生成带表头样式、列宽的工作簿"""
+        wb = Workbook()
+        ws = wb.active
+        ws.title = self.sheet_title
         
         # 写入表头
         for col, header in enumerate(self.headers, 1):
             cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = thin_border
+            cell.font = HEADER_FONT
+            cell.fill = HEADER_FILL
+            cell.alignment = HEADER_ALIGNMENT
+            cell.border = THIN_BORDER
         
         # 设置列宽
-        column_widths = {
-            "编制日期": 12,
-            "凭证类型": 10,
-            "凭证序号": 8,
-            "凭证号": 10,
-            "制单人": 10,
-            "附件张数": 8,
-            "会计年度": 10,
-            "科目编码": 10,
-            "科目名称": 15,
-            "凭证摘要": 20,
-            "借贷方向": 8,
-            "金额": 12,
-            "币种": 8,
-            "汇率": 8,
-            "原币金额": 12,
-            "数量": 10,
-            "单价": 10,
-            "结算方式名称": 12,
-            "结算日期": 12,
-            "结算票号": 12,
-            "业务日期": 12,
-            "员工编号": 10,
-            "员工姓名": 10,
-            "往来单位编号": 12,
-            "往来单位名称": 15,
-            "货品编号": 10,
-            "货品名称": 15,
-            "部门名称": 12,
-            "项目名称": 15,
-        }
-        
-        for col, header in enumerate(self.headers, 1):
-            ws.column_dimensions[get_column_letter(col)].width = column_widths.get(header, 12)
+        for letter, column in zip(self._column_letters, self.columns):
+            ws.column_dimensions[letter].width = column.width
         
         # 冻结首行
         ws.freeze_panes = "A2"
         
         return wb
     
-    def add_voucher_data(self, ws, voucher_data: dict, voucher_seq: int = 1):
-        """添加凭证数据到工作表"""
-        # 获取当前最后一行
-        last_row = ws.max_row
+    def voucher_rows(self, voucher_data: VoucherData, voucher_seq: int = 1) -> list[dict]:
+        """
+        将一张凭证展开为表格行（每条分录一行）
         
+        Returns:
+            行数据列表，每行是 {表头: 值}；凭证中没有的字段取列定义的默认值
+        """
         # 通用凭证信息
-        common_data = {
-            "编制日期": voucher_data.get("voucher_date", ""),
-            "凭证类型": voucher_data.get("voucher_type", "记"),
-            "凭证序号": voucher_seq,
-            "凭证号": voucher_data.get("voucher_no", ""),
-            "制单人": voucher_data.get("preparer", ""),
-            "附件张数": voucher_data.get("attachment_count", 0),
-            "会计年度": voucher_data.get("fiscal_year", ""),
-        }
-        
-        # 设置单元格样式
-        data_alignment = Alignment(horizontal="left", vertical="center")
-        number_alignment = Alignment(horizontal="right", vertical="center")
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin"),
-        )
+        common_data = {}
+        for column in self.columns:
+            if column.field == "voucher_seq":
+                common_data[column.header] = voucher_seq
+            elif column.scope == "voucher":
+                common_data[column.header] = getattr(voucher_data, column.field, column.default)
         
         # 处理每条分录
-        entries = voucher_data.get("entries", [])
+        entries = voucher_data.entries
         if not entries:
-            entries = [{}]  # 至少添加一行空数据
+            # 至少添加一行空数据
+            return [{**common_data, **{column.header: column.default for column in self._entry_columns}}]
         
+        rows = []
         for entry in entries:
-            last_row += 1
             row_data = common_data.copy()
+            for column in self._entry_columns:
+                row_data[column.header] = getattr(entry, column.field, column.default)
+            rows.append(row_data)
+        return rows
+    
+    def add_voucher_data(self, ws, voucher_data: VoucherData, voucher_seq: int = 1):
+        """添加凭证数据到工作表"""
+        # 获取当前最后一行
+        last_row = ws.max_row
+        
+        for row_data in self.voucher_rows(voucher_data, voucher_seq):
+            last_row += 1
             
-            # 添加分录数据
-            row_data.update({
-                "科目编码": entry.get("subject_code", ""),
-                "科目名称": entry.get("subject_name", ""),
-                "凭证摘要": entry.get("summary", ""),
-                "借贷方向": entry.get("direction", ""),
-                "金额": entry.get("amount", ""),
-                "币种": entry.get("currency", "人民币"),
-                "汇率": entry.get("exchange_rate", 1),
-                "原币金额": entry.get("original_amount", ""),
-                "数量": entry.get("quantity", ""),
-                "单价": entry.get("unit_price", ""),
-                "结算方式名称": entry.get("settlement_method", ""),
-                "结算日期": entry.get("settlement_date", ""),
-                "结算票号": entry.get("settlement_no", ""),
-                "业务日期": entry.get("business_date", ""),
-                "员工编号": entry.get("employee_no", ""),
-                "员工姓名": entry.get("employee_name", ""),
-                "往来单位编号": entry.get("partner_no", ""),
-                "往来单位名称": entry.get("partner_name", ""),
-                "货品编号": entry.get("product_no", ""),
-                "货品名称": entry.get("product_name", ""),
-                "部门名称": entry.get("department", ""),
-                "项目名称": entry.get("project", ""),
-            })
-            
-            # 写入数据
-            for col, header in enumerate(self.headers, 1):
-                value = row_data.get(header, "")
-                cell = ws.cell(row=last_row, column=col, value=value)
-                cell.border = thin_border
-                
-                # 数字列右对齐
-                if header in ["金额", "原币金额", "数量", "单价", "汇率", "附件张数", "凭证序号"]:
-                    cell.alignment = number_alignment
-                else:
-                    cell.alignment = data_alignment
+            # 写入数据（数字列右对齐）
+            for col, (header, alignment) in enumerate(zip(self.headers, self._alignments), 1):
+                cell = ws.cell(row=last_row, column=col, value=row_data.get(header, ""))
+                cell.border = THIN_BORDER
+                cell.alignment = alignment
     
-    def generate_excel(self, vouchers: list[dict]) -> bytes:
+    def generate_excel(self, vouchers: list[VoucherData]) -> bytes:
         """
         生成Excel文件
         
@@ -235,8 +246,7 @@ class ExcelService:
         
         # 添加所有凭证数据
         for seq, voucher in enumerate(vouchers, 1):
-            if "error" not in voucher:
-                self.add_voucher_data(ws, voucher, seq)
+            self.add_voucher_data(ws, voucher, seq)
         
         # 保存到内存
         output = io.BytesIO()
@@ -246,12 +256,19 @@ class ExcelService:
         return output.getvalue()
     
     def generate_template(self) -> bytes:
-        """生成空白模板"""
-        wb = self.create_workbook()
-        
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        """
+        空白模板
         
-        return output.getvalue()
-
+        模板内容只由列定义决定，每个进程按列定义生成一次后复用。
+        """
+        key = (self.sheet_title, self.columns)
+        template = self._template_cache.get(key)
+        if template is None:
+            with self._template_lock:
+                template = self._template_cache.get(key)
+                if template is None:
+                    output = io.BytesIO()
+                    self.create_workbook().save(output)
+                    template = output.getvalue()
+                    self._template_cache[key] = template
+        return template
@@ -0,0 +1,108 @@
+"""导出文件缓存 - 按凭证内容哈希缓存生成的Excel文件"""
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Optional
+
+import orjson
+from pydantic import BaseModel
+
+
+def _default(value: Any) -> Any:
+    """orjson 不直接支持的类型：pydantic模型转为dict，其余转为字符串"""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    return str(value)
+
+
+def content_key(vouchers: list) -> str:
+    """凭证内容的哈希（键顺序无关），内容相同的导出请求得到同一个键"""
+    payload = orjson.dumps(vouchers, default=_default, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ExportCache:
+    """
+    导出文件磁盘缓存
+
+    文件名即内容哈希；总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 200 * 1024 * 1024, suffix: str = ".xlsx"):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_size: 缓存总大小上限（字节）
+            suffix: 缓存文件扩展名
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{self.suffix}")
+
+    def get_or_create(self, key: str, build: Callable[[], bytes]) -> tuple[str, bool]:
+        """
+        获取缓存文件，不存在时调用 build 生成并写入缓存
+
+        同步方法（生成Excel和读写文件都会阻塞），在异步代码中应放到线程中执行。
+
+        Returns:
+            (缓存文件路径, 是否命中缓存)
+        """
+        path = self.path_for(key)
+        if self._touch(path):
+            self.hits += 1
+            return path, True
+
+        data = build()
+        self.misses += 1
+        # 先写临时文件再原子替换，并发请求同一内容时不会读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict(keep=path)
+        return path, False
+
+    def _touch(self, path: str) -> bool:
+        """命中时更新访问时间（用于淘汰），返回文件是否存在"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _evict(self, keep: Optional[str] = None):
+        """总大小超过上限时删除最久未访问的文件"""
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
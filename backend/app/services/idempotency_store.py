@@ -0,0 +1,161 @@
+"""幂等记录存储 - 基于SQLite记录带 Idempotency-Key 的识别请求的执行状态和响应，过期自动清理"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    fingerprint TEXT,
+    state TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status_code INTEGER,
+    content_type TEXT,
+    body BLOB,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires_at ON idempotency(expires_at);
+"""
+
+STARTED = "started"
+PENDING = "pending"
+DONE = "done"
+CONFLICT = "conflict"
+
+# 旧版本创建的数据库需要补充的列：(表, 列, 类型)
+MIGRATIONS = (
+    ("idempotency", "fingerprint", "TEXT"),
+)
+
+
+@dataclass
+class IdempotentResponse:
+    """已保存的响应"""
+    status_code: int
+    content_type: str
+    body: bytes
+
+
+class IdempotencyStore:
+    """
+    幂等记录仓库
+
+    每个键一行：执行中（pending）或已完成（done，保存响应体）。
+    执行中的记录超过 pending_timeout 仍未完成视为执行方已退出，可以被重新执行；
+    已完成的记录保留 ttl 秒。
+    sqlite3 是同步接口，在异步代码中应通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str, ttl: float = 86400, pending_timeout: float = 1800):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            ttl: 已完成响应的保留秒数
+            pending_timeout: 执行中记录的最长有效秒数
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        # 区分本进程与其他进程（多worker）创建的执行中记录
+        self.owner = uuid.uuid4().hex
+        # 直接返回已保存响应的次数、等待执行中请求后返回的次数
+        self.replayed = 0
+        self.attached = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """为旧版本创建的数据库补充新增的列"""
+        for table, column, column_type in MIGRATIONS:
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def begin(self, key: str, path: str, fingerprint: str) -> tuple[str, Optional[IdempotentResponse]]:
+        """
+        开始处理一个幂等键
+
+        Args:
+            key: Idempotency-Key
+            path: 请求路径
+            fingerprint: 请求内容指纹，相同的键只回放给内容相同的请求
+
+        Returns:
+            (状态, 已保存的响应)：
+            STARTED 由调用方执行，完成后调用 complete 或 abandon；
+            PENDING 其他请求正在执行；DONE 直接返回已保存的响应；
+            CONFLICT 同一个键用于了其他接口或内容不同的请求
+        """
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 保证多进程同时 begin 同一个键时只有一个能开始执行
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+                row = self._conn.execute(
+                    "SELECT path, fingerprint, state, status_code, content_type, body FROM idempotency WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO idempotency (key, path, fingerprint, state, owner, created_at, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (key, path, fingerprint, PENDING, self.owner, now, now + self.pending_timeout),
+                    )
+                    result = (STARTED, None)
+                elif row[0] != path or (row[1] is not None and row[1] != fingerprint):
+                    # 升级前保存的记录没有指纹，只按路径判断
+                    result = (CONFLICT, None)
+                elif row[2] == DONE:
+                    result = (DONE, IdempotentResponse(row[3], row[4], row[5]))
+                else:
+                    result = (PENDING, None)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def complete(self, key: str, response: IdempotentResponse):
+        """保存执行完成的响应"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency SET state = ?, status_code = ?, content_type = ?, body = ?, expires_at = ? "
+                "WHERE key = ? AND owner = ?",
+                (DONE, response.status_code, response.content_type, response.body, now + self.ttl, key, self.owner),
+            )
+
+    def abandon(self, key: str):
+        """执行失败：删除执行中记录，相同的键可以重新执行"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE key = ? AND owner = ? AND state = ?", (key, self.owner, PENDING)
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM idempotency GROUP BY state").fetchall()
+        counts = dict(rows)
+        return {
+            "pending": counts.get(PENDING, 0),
+            "done": counts.get(DONE, 0),
+            "replayed": self.replayed,
+            "attached": self.attached,
+        }
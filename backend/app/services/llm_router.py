@@ -0,0 +1,238 @@
+"""大模型路由 - 在多个提供商之间做加权路由、对冲请求和故障切换"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from ..models import VoucherData
+from .llm_service import LLMAnswer, LLMService, VoucherParseError
+from .usage_store import BudgetExceeded
+
+llm_logger = logging.getLogger("llm")
+
+
+class RouterMember:
+    """路由中的单个提供商及其近期健康数据"""
+
+    # 计算健康分时的参考延迟（秒）：平均延迟等于该值时延迟因子为0.5
+    REFERENCE_LATENCY = 10.0
+
+    def __init__(self, service: LLMService, weight: float = 1.0, window: int = 50):
+        self.service = service
+        self.weight = max(weight, 0.0)
+        # 近期调用记录：(耗时秒, 是否成功)；对冲落后被取消的调用记为 (已等待秒数, None)，
+        # 其真实延迟至少为已等待的时间（删失样本），计入延迟统计，不计入成功率
+        self.history: deque[tuple[float, Optional[bool]]] = deque(maxlen=window)
+        self.hedged_count = 0
+        self.won_count = 0
+        self.cancelled_count = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.service.provider}/{self.service.model}"
+
+    def record(self, latency: float, ok: Optional[bool]):
+        """记录一次调用结果，ok 为None表示对冲落后被取消（只知道延迟不短于 latency）"""
+        self.history.append((latency, ok))
+
+    def success_rate(self) -> float:
+        """近期成功率（拉普拉斯平滑，无数据时为0.5；不含被取消的调用）"""
+        finished = [success for _, success in self.history if success is not None]
+        return (sum(finished) + 1) / (len(finished) + 2)
+
+    def _latencies(self) -> list[float]:
+        """成功调用的延迟和被取消调用的已等待时间（按下限计）"""
+        return [latency for latency, success in self.history if success is not False]
+
+    def avg_latency(self) -> Optional[float]:
+        """近期平均延迟（含被取消调用的已等待时间）"""
+        latencies = self._latencies()
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def p90_latency(self, min_samples: int = 5) -> Optional[float]:
+        """近期p90延迟（含被取消调用的已等待时间），样本不足时返回None"""
+        latencies = sorted(self._latencies())
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+
+    def health_score(self) -> float:
+        """健康分 = 成功率 × 延迟因子，范围 (0, 1)"""
+        avg = self.avg_latency()
+        latency_factor = 1.0 if avg is None else self.REFERENCE_LATENCY / (self.REFERENCE_LATENCY + avg)
+        return self.success_rate() * latency_factor
+
+    def snapshot(self) -> dict:
+        """导出健康数据"""
+        avg = self.avg_latency()
+        p90 = self.p90_latency()
+        return {
+            "provider": self.service.provider,
+            "model": self.service.model,
+            "weight": self.weight,
+            "samples": len(self.history),
+            "success_rate": round(self.success_rate(), 4),
+            "avg_latency": round(avg, 3) if avg is not None else None,
+            "p90_latency": round(p90, 3) if p90 is not None else None,
+            "health_score": round(self.health_score(), 4),
+            "hedged": self.hedged_count,
+            "won": self.won_count,
+            "cancelled": self.cancelled_count,
+        }
+
+
+class LLMRouter:
+    """
+    大模型路由服务
+
+    与 LLMService 提供相同的 recognize_voucher / recognize 接口：
+    - 按 权重 × 健康分 加权随机选择主提供商
+    - 主提供商超过其p90延迟仍未返回时，向下一个提供商发送对冲请求，取先返回的结果
+    - 调用失败时自动切换到下一个提供商
+    """
+
+    provider = "router"
+
+    def __init__(
+        self,
+        members: list[RouterMember],
+        hedge_enabled: bool = True,
+        hedge_delay: float = 15.0,
+    ):
+        """
+        Args:
+            members: 参与路由的提供商
+            hedge_enabled: 是否启用对冲请求
+            hedge_delay: 样本不足以计算p90时使用的默认对冲等待时间（秒）
+        """
+        if not members:
+            raise ValueError("大模型路由至少需要一个提供商")
+        self.members = members
+        self.hedge_enabled = hedge_enabled
+        self.hedge_delay = hedge_delay
+
+    @property
+    def model(self) -> str:
+        return ",".join(member.name for member in self.members)
+
+    @property
+    def endpoint(self) -> str:
+        return ",".join(member.service.endpoint or "" for member in self.members)
+
+    def _rank(self) -> list[RouterMember]:
+        """按 权重 × 健康分 做加权随机排序（Efraimidis-Spirakis 加权抽样）"""
+        keyed = []
+        for member in self.members:
+            score = member.weight * member.health_score()
+            if score <= 0:
+                continue
+            keyed.append((random.random() ** (1.0 / score), member))
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        return [member for _, member in keyed]
+
+    def _hedge_after(self, member: RouterMember) -> float:
+        """主请求等待多久后发送对冲请求"""
+        p90 = member.p90_latency()
+        return p90 if p90 is not None else self.hedge_delay
+
+    async def _run(self, member: RouterMember, ocr_text: str) -> LLMAnswer:
+        """调用单个提供商并记录健康数据"""
+        start = time.time()
+        try:
+            result = await member.service.recognize(ocr_text)
+        except asyncio.CancelledError:
+            # 对冲落后的一方由 recognize 按删失样本记录已等待时间；
+            # 客户端断开等其他原因的取消与提供商无关，只计数
+            member.cancelled_count += 1
+            raise
+        except BudgetExceeded:
+            # 预算用完不是提供商故障，不影响健康分
+            raise
+        except Exception:
+            member.record(time.time() - start, False)
+            raise
+        member.record(time.time() - start, True)
+        return result
+
+    async def recognize_voucher(self, ocr_text: str) -> VoucherData:
+        """识别凭证内容并返回结构化数据"""
+        return (await self.recognize(ocr_text)).voucher
+
+    async def recognize(self, ocr_text: str) -> LLMAnswer:
+        """识别凭证内容，返回结构化数据及实际给出结果的提供商和模型"""
+        candidates = self._rank()
+        if not candidates:
+            raise Exception("没有可用的大模型提供商（所有提供商权重为0）")
+
+        pending: dict[asyncio.Task, tuple[RouterMember, float]] = {}
+        next_idx = 0
+        last_error: Optional[Exception] = None
+        # 有提供商返回了无法解析的响应时优先报告解析错误（保留原始响应）
+        last_parse_error: Optional[VoucherParseError] = None
+
+        def launch() -> RouterMember:
+            nonlocal next_idx
+            member = candidates[next_idx]
+            next_idx += 1
+            task = asyncio.create_task(self._run(member, ocr_text))
+            pending[task] = (member, time.time())
+            return member
+
+        won = False
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_enabled and len(pending) == 1 and next_idx < len(candidates):
+                    member, started = next(iter(pending.values()))
+                    timeout = max(0.0, started + self._hedge_after(member) - time.time())
+
+                done, _ = await asyncio.wait(
+                    pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    slow_member, _ = next(iter(pending.values()))
+                    hedge_member = launch()
+                    hedge_member.hedged_count += 1
+                    llm_logger.info(
+                        f"{slow_member.name} 超过对冲阈值仍未返回，发送对冲请求到 {hedge_member.name}"
+                    )
+                    continue
+
+                for task in done:
+                    member, _ = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except VoucherParseError as e:
+                        llm_logger.warning(f"大模型响应无效，切换提供商 - {member.name}: {str(e)}")
+                        last_parse_error = e
+                        continue
+                    except Exception as e:
+                        llm_logger.warning(f"大模型调用失败，切换提供商 - {member.name}: {str(e)}")
+                        last_error = e
+                        continue
+                    member.won_count += 1
+                    won = True
+                    return result
+
+                # 已完成的请求都失败了且没有其他在途请求：切换到下一个提供商
+                if not pending and next_idx < len(candidates):
+                    launch()
+        finally:
+            now = time.time()
+            for task, (member, started) in pending.items():
+                if won:
+                    # 落后于对冲的另一方：延迟至少为已等待的时间，否则总是落后的提供商只留下偶尔快的样本
+                    member.record(now - started, None)
+                task.cancel()
+
+        if last_parse_error is not None:
+            raise last_parse_error
+        raise last_error or Exception("所有大模型提供商均调用失败")
+
+    def snapshot(self) -> list[dict]:
+        """导出各提供商的健康数据"""
+        return [member.snapshot() for member in self.members]
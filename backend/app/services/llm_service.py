@@ -1,8 +1,25 @@
 """大模型服务 - 支持豆包、DeepSeek、Kimi、OpenRouter等"""
+import asyncio
 import httpx
 import json
+import logging
+import re
+import time
+from dataclasses import dataclass
 from typing import Optional
+from pydantic import ValidationError
 from ..data import ACCOUNTING_SUBJECTS, match_subject
+from ..models import VoucherData
+from ..utils.json_repair import loads_tolerant
+from ..utils.circuit_breaker import breaker_registry, endpoint_name
+from .usage_store import LLM, UsageStore, parse_llm_usage
+from .validation_service import validate_vouchers
+from .prompt_budget import TRUNCATED, PromptBudget, PromptPlan, model_family, prompt_stats
+
+llm_logger = logging.getLogger("llm")
+
+# 400响应中表明模型不支持JSON模式的错误信息
+JSON_MODE_ERROR_PATTERN = re.compile(r"response_format|json[_ ]?(mode|object)", re.IGNORECASE)
 
 
 # 凭证识别提示词模板
@@ -63,14 +80,143 @@ VOUCHER_RECOGNITION_PROMPT = """你是一个专业的财务凭证识别助手。
 只输出JSON，不要输出其他内容。"""
 
 
-def build_subjects_table() -> str:
-    """构建会计科目表字符串"""
+# JSON修正提示词（仅在本地修复失败时发送）
+JSON_FIX_PROMPT = """你上一次的输出无法解析为合法的JSON，错误信息：{error}
+
+请按照要求的JSON格式重新输出完整的识别结果，只输出JSON，不要输出任何其他内容。"""
+
+
+class LLMParseStats:
+    """按 provider/model 统计LLM响应的解析情况"""
+
+    def __init__(self):
+        self._stats: dict[tuple[str, str], dict[str, int]] = {}
+
+    def record(self, provider: str, model: str, outcome: str):
+        """
+        记录一次解析结果
+
+        Args:
+            outcome: ok(直接解析成功) / repaired(本地修复成功) /
+                     fixed(修正请求后成功) / failed(最终失败)
+        """
+        stats = self._stats.setdefault(
+            (provider, model),
+            {"total": 0, "ok": 0, "repaired": 0, "fixed": 0, "failed": 0},
+        )
+        stats["total"] += 1
+        stats[outcome] += 1
+
+    def snapshot(self) -> list[dict]:
+        """导出统计数据（含失败率和修复率）"""
+        result = []
+        for (provider, model), stats in self._stats.items():
+            total = stats["total"] or 1
+            result.append({
+                "provider": provider,
+                "model": model,
+                **stats,
+                "parse_failure_rate": round((total - stats["ok"]) / total, 4),
+                "repair_rate": round(stats["repaired"] / total, 4),
+                "fix_request_rate": round((stats["fixed"] + stats["failed"]) / total, 4),
+                "failure_rate": round(stats["failed"] / total, 4),
+            })
+        return result
+
+
+# 全局解析统计
+parse_stats = LLMParseStats()
+
+
+class LLMCascadeStats:
+    """按 provider/层级 统计模型级联的升级率和延迟"""
+
+    def __init__(self):
+        self._stats: dict[tuple[str, int], dict] = {}
+
+    def record(self, provider: str, tier: int, model: str, latency: float, outcome: str, reasons: list[str] = ()):
+        """
+        记录一层的一次识别
+
+        Args:
+            tier: 层级（0为最小的模型）
+            outcome: accepted(结果被采用) / escalated(升级到下一层) / failed(最后一层仍失败)
+            reasons: 升级原因（校验问题代码、fixed、subject_guessed、error）
+        """
+        stats = self._stats.setdefault((provider, tier), {
+            "model": model, "calls": 0, "accepted": 0, "escalated": 0, "failed": 0,
+            "latency_total": 0.0, "reasons": {},
+        })
+        stats["model"] = model
+        stats["calls"] += 1
+        stats[outcome] += 1
+        stats["latency_total"] += latency
+        for reason in reasons:
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+
+    def snapshot(self) -> list[dict]:
+        """导出各层统计（含升级率和平均延迟）"""
+        result = []
+        for (provider, tier), stats in sorted(self._stats.items()):
+            calls = stats["calls"] or 1
+            result.append({
+                "provider": provider,
+                "tier": tier,
+                "model": stats["model"],
+                "calls": stats["calls"],
+                "accepted": stats["accepted"],
+                "escalated": stats["escalated"],
+                "failed": stats["failed"],
+                "escalation_rate": round(stats["escalated"] / calls, 4),
+                "avg_latency": round(stats["latency_total"] / calls, 3),
+                "reasons": dict(stats["reasons"]),
+            })
+        return result
+
+
+# 全局级联统计
+cascade_stats = LLMCascadeStats()
+
+
+class VoucherParseError(Exception):
+    """LLM响应无法解析为凭证数据"""
+
+    def __init__(self, message: str, raw_response: Optional[str] = None):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+@dataclass
+class LLMAnswer:
+    """一次凭证识别的结果，以及实际给出结果的提供商和模型（级联、换用更大上下文模型或路由后可能与配置的不同）"""
+    voucher: VoucherData
+    provider: str
+    model: str
+
+
+SYSTEM_PROMPT = "你是一个专业的财务凭证识别助手，擅长从OCR文本中提取结构化的财务数据。"
+
+
+def build_subjects_table(subjects: Optional[dict[str, str]] = None) -> str:
+    """构建会计科目表字符串（默认为完整科目表）"""
     lines = []
-    for code, name in sorted(ACCOUNTING_SUBJECTS.items()):
+    for code, name in sorted((subjects if subjects is not None else ACCOUNTING_SUBJECTS).items()):
         lines.append(f"{code}: {name}")
     return "\n".join(lines)
 
 
+def build_messages(subjects: dict[str, str], ocr_text: str) -> list[dict]:
+    """构建凭证识别请求的消息列表"""
+    prompt = VOUCHER_RECOGNITION_PROMPT.format(
+        subjects_table=build_subjects_table(subjects),
+        ocr_text=ocr_text,
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
 class LLMService:
     """大模型服务"""
     
@@ -90,20 +236,81 @@ class LLMService:
         "openrouter": "deepseek/deepseek-chat",
     }
     
+    # 支持 response_format={"type": "json_object"} 的提供商
+    JSON_MODE_PROVIDERS = {"doubao", "deepseek", "kimi", "openrouter"}
+    
     def __init__(
         self,
         provider: str = "deepseek",
         api_key: str = None,
         model: str = None,
         endpoint: str = None,
+        timeout: Optional[float] = None,
+        usage: Optional[UsageStore] = None,
+        cascade: Optional[list[str]] = None,
     ):
+        """
+        Args:
+            usage: 用量记账（记录每次调用的token数并检查每日预算），为None时不记账
+            cascade: 在 model 之前依次尝试的较小模型，默认取配置 llm_cascade 中该提供商的列表
+        """
+        from ..config import get_settings
+        
+        settings = get_settings()
         self.provider = provider
         self.api_key = api_key
         self.model = model or self.DEFAULT_MODELS.get(provider, "deepseek-chat")
         self.endpoint = endpoint or self.DEFAULT_ENDPOINTS.get(provider)
+        self.json_mode = provider in self.JSON_MODE_PROVIDERS
+        # 调用时返回400、不支持JSON模式的模型，之后对这些模型不再使用JSON模式
+        self.json_mode_rejected: set[str] = set()
+        self.timeout = timeout or settings.llm_timeout
+        self.usage = usage
+        self.cascade = settings.llm_cascade.get(provider, []) if cascade is None else cascade
+        self.escalate_on = set(settings.llm_cascade_escalate_on)
+        # 按模型的上下文窗口调整提示词
+        self.prompt_budget = PromptBudget(
+            windows=settings.llm_context_windows,
+            larger_models=settings.llm_larger_context_models,
+            default_window=settings.llm_default_context_window,
+            max_output=settings.llm_max_output_tokens,
+            min_output=settings.llm_min_output_tokens,
+            margin=settings.llm_token_estimate_margin,
+        )
+    
+    @property
+    def tiers(self) -> list[str]:
+        """级联的各层模型：配置的小模型在前，model 为最后一层"""
+        tiers = []
+        for model in [*self.cascade, self.model]:
+            if model == self.model:
+                break
+            if model not in tiers:
+                tiers.append(model)
+        return tiers + [self.model]
     
-    async def _call_api(self, messages: list[dict]) -> str:
-        """调用大模型API"""
+    async def _call_api(
+        self,
+        messages: list[dict],
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        estimated_tokens: Optional[int] = None,
+    ) -> str:
+        """
+        调用大模型API（支持时使用JSON模式）
+        
+        Args:
+            model: 本次调用的模型，默认 self.model
+            max_tokens: 输出上限，默认 llm_max_output_tokens
+            estimated_tokens: 发送前估算的输入token数，与响应 usage 对比统计估算偏差
+        
+        Raises:
+            BudgetExceeded: 该提供商/模型今日token预算已用完
+        """
+        model = model or self.model
+        if self.usage is not None:
+            await asyncio.to_thread(self.usage.check, LLM, self.provider, model)
+        
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}",
@@ -115,85 +322,214 @@ class LLMService:
             headers["X-Title"] = "李会计凭证识别"
         
         payload = {
-            "model": self.model,
+            "model": model,
             "messages": messages,
             "temperature": 0.1,  # 低温度以获得更稳定的输出
-            "max_tokens": 4096,
+            "max_tokens": max_tokens or self.prompt_budget.max_output,
         }
+        json_mode = self.json_mode and model not in self.json_mode_rejected
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        
+        async def send() -> dict:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(
+                    self.endpoint,
+                    headers=headers,
+                    json=payload,
+                )
+                if response.status_code == 400 and json_mode and JSON_MODE_ERROR_PATTERN.search(response.text):
+                    # 部分模型（如OpenRouter上的某些模型）不支持JSON模式，该模型关闭后重试；
+                    # 其他400（上下文超长、内容过滤等）与JSON模式无关，照常抛出
+                    llm_logger.warning(
+                        f"{self.provider}/{model} 不支持JSON模式，降级为普通输出: {response.text[:200]}"
+                    )
+                    self.json_mode_rejected.add(model)
+                    payload.pop("response_format")
+                    response = await client.post(
+                        self.endpoint,
+                        headers=headers,
+                        json=payload,
+                    )
+                response.raise_for_status()
+                return response.json()
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                self.endpoint,
-                headers=headers,
-                json=payload,
+        # 端点熔断时直接失败，不再等待完整的超时时间
+        result = await breaker_registry.get(endpoint_name("llm", self.endpoint)).call(send)
+        
+        if self.usage is not None:
+            prompt_tokens, completion_tokens, cached_tokens = parse_llm_usage(result.get("usage"))
+            await asyncio.to_thread(
+                self.usage.record, LLM, self.provider, model,
+                prompt_tokens, completion_tokens, cached_tokens,
+            )
+        if estimated_tokens is not None:
+            prompt_stats.record_tokens(
+                model_family(self.provider, model), estimated_tokens, parse_llm_usage(result.get("usage"))[0]
             )
-            response.raise_for_status()
-            result = response.json()
         
         # 提取回复内容
         return result["choices"][0]["message"]["content"]
     
-    async def recognize_voucher(self, ocr_text: str) -> dict:
+    async def recognize_voucher(self, ocr_text: str) -> VoucherData:
         """识别凭证内容并返回结构化数据"""
-        subjects_table = build_subjects_table()
+        return (await self.recognize(ocr_text)).voucher
+    
+    async def recognize(self, ocr_text: str) -> LLMAnswer:
+        """
+        识别凭证内容，返回结构化数据及实际给出结果的模型
         
-        prompt = VOUCHER_RECOGNITION_PROMPT.format(
-            subjects_table=subjects_table,
-            ocr_text=ocr_text,
-        )
+        配置了级联（cascade）时先用较小的模型识别，结果校验不通过或置信度低
+        （原因在 llm_cascade_escalate_on 中）时升级到下一层，最后一层的结果直接返回。
+        每一层发送前按该模型的上下文窗口调整提示词（见 PromptBudget）。
+        
+        Raises:
+            VoucherParseError: 修正请求后响应仍无法解析为凭证数据
+            PromptTooLong: 提示词无法放入模型的上下文窗口
+        """
+        tiers = self.tiers
+        if len(tiers) == 1:
+            voucher_data, _, answered_by = await self._recognize_with(ocr_text, self.model)
+            return LLMAnswer(voucher_data, self.provider, answered_by)
+        
+        for tier, model in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            start = time.time()
+            try:
+                voucher_data, signals, answered_by = await self._recognize_with(ocr_text, model)
+            except Exception as e:
+                latency = time.time() - start
+                cascade_stats.record(self.provider, tier, model, latency, "failed" if last else "escalated", ["error"])
+                if last:
+                    raise
+                llm_logger.warning(f"级联第{tier + 1}层 {self.provider}/{model} 识别失败，升级: {str(e)}")
+                continue
+            latency = time.time() - start
+            
+            reasons = [
+                reason for reason in [*validate_vouchers([voucher_data]).check(0).codes, *signals]
+                if reason in self.escalate_on
+            ]
+            if not reasons or last:
+                cascade_stats.record(self.provider, tier, model, latency, "accepted")
+                return LLMAnswer(voucher_data, self.provider, answered_by)
+            cascade_stats.record(self.provider, tier, model, latency, "escalated", reasons)
+            llm_logger.info(f"级联第{tier + 1}层 {self.provider}/{model} 结果未通过（{', '.join(reasons)}），升级")
+    
+    def plan_prompt(self, ocr_text: str, model: Optional[str] = None) -> PromptPlan:
+        """
+        生成适配模型上下文窗口的识别请求（可能压缩/截断OCR文本、精简科目表或换用更大上下文的模型）
         
-        messages = [
-            {"role": "system", "content": "你是一个专业的财务凭证识别助手，擅长从OCR文本中提取结构化的财务数据。"},
-            {"role": "user", "content": prompt},
-        ]
+        Raises:
+            PromptTooLong: 提示词无法放入模型的上下文窗口
+        """
+        model = model or self.model
+        plan = self.prompt_budget.plan(self.provider, model, build_messages, ocr_text, ACCOUNTING_SUBJECTS)
+        if plan.actions:
+            llm_logger.info(
+                f"提示词适配上下文窗口 - {self.provider}/{model} -> {plan.model} "
+                f"(窗口 {plan.context_window}, 估算输入 {plan.prompt_tokens}, 输出上限 {plan.max_tokens}): "
+                f"{', '.join(plan.actions)}"
+            )
+        return plan
+    
+    async def _recognize_with(self, ocr_text: str, model: str) -> tuple[VoucherData, list[str], str]:
+        """
+        用指定模型识别一次（解析失败时发送一次修正请求）
         
-        response_text = await self._call_api(messages)
+        Returns:
+            (凭证数据, 低置信度信号, 实际使用的模型)：
+            信号为 repaired(本地修复JSON) / fixed(经修正请求) / subject_guessed(按名称猜测科目) / truncated(OCR文本被截断)；
+            提示词放不下时实际使用的可能是更大上下文的模型
+        
+        Raises:
+            VoucherParseError: 修正请求后响应仍无法解析为凭证数据
+            PromptTooLong: 提示词无法放入模型的上下文窗口
+        """
+        plan = self.plan_prompt(ocr_text, model)
+        model = plan.model
+        messages = plan.messages
+        signals = [TRUNCATED] if TRUNCATED in plan.actions else []
+        response_text = await self._call_api(messages, model, plan.max_tokens, plan.prompt_tokens)
         
-        # 解析JSON响应
         try:
-            # 尝试提取JSON块
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_str = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                json_str = response_text[json_start:json_end].strip()
-            else:
-                json_str = response_text.strip()
-            
-            voucher_data = json.loads(json_str)
-            
-            # 验证并修正科目编码
-            voucher_data = self._validate_and_fix_subjects(voucher_data)
-            
-            return voucher_data
-            
+            voucher_data, repaired = self._parse_voucher(response_text)
+            parse_stats.record(self.provider, model, "repaired" if repaired else "ok")
+            if repaired:
+                signals.append("repaired")
+        except VoucherParseError as e:
+            # 本地修复失败，发送一次针对性的修正请求
+            llm_logger.warning(f"LLM响应解析失败，请求模型修正JSON - {self.provider}/{model}: {e}")
+            messages = messages + [
+                {"role": "assistant", "content": response_text},
+                {"role": "user", "content": JSON_FIX_PROMPT.format(error=str(e))},
+            ]
+            # 修正请求带上了上一次的输出，按剩余窗口确定输出上限，放不下时不再发送
+            prompt_tokens = self.prompt_budget.estimate_messages(messages, model_family(self.provider, model))
+            max_tokens = min(plan.max_tokens, plan.context_window - prompt_tokens)
+            if max_tokens < self.prompt_budget.min_output:
+                parse_stats.record(self.provider, model, "failed")
+                raise VoucherParseError(
+                    f"解析LLM响应失败: {str(e)}（修正请求超出 {model} 的上下文窗口，未发送）",
+                    raw_response=response_text,
+                ) from e
+            response_text = await self._call_api(messages, model, max_tokens, prompt_tokens)
+            try:
+                voucher_data, _ = self._parse_voucher(response_text)
+                parse_stats.record(self.provider, model, "fixed")
+                signals.append("fixed")
+            except VoucherParseError as e:
+                parse_stats.record(self.provider, model, "failed")
+                raise VoucherParseError(f"解析LLM响应失败: {str(e)}", raw_response=response_text) from e
+        
+        # 模型给出的科目编码不在科目表中、只能按名称匹配时，结果可信度较低
+        if any(entry.subject_code not in ACCOUNTING_SUBJECTS for entry in voucher_data.entries):
+            signals.append("subject_guessed")
+        
+        # 验证并修正科目编码
+        return self._validate_and_fix_subjects(voucher_data), signals, model
+    
+    def _parse_voucher(self, response_text: str) -> tuple[VoucherData, bool]:
+        """
+        解析并校验LLM响应
+        
+        Returns:
+            (凭证数据, 是否经过本地修复)
+        
+        Raises:
+            VoucherParseError: 修复后仍无法解析或不符合凭证结构
+        """
+        try:
+            data, repaired = loads_tolerant(response_text)
         except json.JSONDecodeError as e:
-            return {
-                "error": f"解析LLM响应失败: {str(e)}",
-                "raw_response": response_text,
-            }
+            raise VoucherParseError(f"JSON格式错误: {e}") from e
+        
+        if not isinstance(data, dict):
+            raise VoucherParseError(f"期望JSON对象，实际为 {type(data).__name__}")
+        
+        try:
+            voucher = VoucherData.model_validate(data)
+        except ValidationError as e:
+            raise VoucherParseError(f"凭证结构校验失败: {e}") from e
+        
+        return voucher, repaired
     
-    def _validate_and_fix_subjects(self, voucher_data: dict) -> dict:
+    def _validate_and_fix_subjects(self, voucher_data: VoucherData) -> VoucherData:
         """验证并修正科目编码和名称"""
-        entries = voucher_data.get("entries", [])
-        
-        for entry in entries:
-            subject_code = entry.get("subject_code", "")
-            subject_name = entry.get("subject_name", "")
+        for entry in voucher_data.entries:
+            subject_code = entry.subject_code
+            subject_name = entry.subject_name
             
             # 尝试匹配科目
             if subject_code and subject_code in ACCOUNTING_SUBJECTS:
                 # 科目编码正确，确保名称也正确
-                entry["subject_name"] = ACCOUNTING_SUBJECTS[subject_code]
+                entry.subject_name = ACCOUNTING_SUBJECTS[subject_code]
             elif subject_name:
                 # 尝试通过名称匹配
                 matched_code, matched_name = match_subject(subject_name)
                 if matched_code:
-                    entry["subject_code"] = matched_code
-                    entry["subject_name"] = matched_name
+                    entry.subject_code = matched_code
+                    entry.subject_name = matched_name
         
         return voucher_data
     
@@ -212,6 +548,10 @@ class LLMService:
                 self.endpoint = self.DEFAULT_ENDPOINTS.get(provider)
             if not model:
                 self.model = self.DEFAULT_MODELS.get(provider)
+            self.json_mode = provider in self.JSON_MODE_PROVIDERS
+            self.json_mode_rejected.clear()
+            from ..config import get_settings
+            self.cascade = get_settings().llm_cascade.get(provider, [])
         if api_key:
             self.api_key = api_key
         if model:
@@ -0,0 +1,188 @@
+"""OCR路由 - 按顺序/成本/延迟在多个OCR提供商之间故障切换"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from .ocr_service import OCRService
+from .usage_store import BudgetExceeded
+from ..utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+ocr_logger = logging.getLogger("ocr")
+
+
+class OCRRouterMember:
+    """路由中的单个OCR提供商及其统计数据"""
+
+    def __init__(
+        self,
+        service: OCRService,
+        breaker: CircuitBreaker,
+        cost: float = 0.0,
+        window: int = 50,
+    ):
+        """
+        Args:
+            service: OCR服务
+            breaker: 该提供商的熔断器
+            cost: 单次调用成本（cost模式下按此排序）
+            window: 计算平均延迟时参考的最近成功调用次数
+        """
+        self.service = service
+        self.breaker = breaker
+        self.cost = cost
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_probe_ok: Optional[bool] = None
+        self.last_probe_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return self.service.provider_name
+
+    def avg_latency(self) -> Optional[float]:
+        """近期成功调用的平均延迟"""
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    def snapshot(self) -> dict:
+        """导出统计数据"""
+        avg = self.avg_latency()
+        return {
+            "provider": self.name,
+            "cost": self.cost,
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": round(self.successes / self.calls, 4) if self.calls else None,
+            "avg_latency": round(avg, 3) if avg is not None else None,
+            "circuit": self.breaker.state,
+            "last_probe_ok": self.last_probe_ok,
+            "last_probe_at": self.last_probe_at,
+        }
+
+
+class OCRRouter:
+    """
+    OCR路由服务
+
+    与 OCRService 提供相同的 recognize 接口：
+    - ordered: 按配置顺序，前一个失败或熔断时切换到下一个
+    - cost: 按单次调用成本从低到高尝试
+    - latency: 按近期平均延迟从低到高尝试（无数据的提供商优先，以便收集样本）
+    """
+
+    MODES = ("ordered", "cost", "latency")
+
+    provider_name = "router"
+
+    def __init__(self, members: list[OCRRouterMember], mode: str = "ordered"):
+        if not members:
+            raise ValueError("OCR路由至少需要一个提供商")
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的OCR路由模式: {mode}，可选: {', '.join(self.MODES)}")
+        self.members = members
+        self.mode = mode
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def _ordered_members(self) -> list[OCRRouterMember]:
+        """按路由模式排序"""
+        if self.mode == "cost":
+            return sorted(self.members, key=lambda member: member.cost)
+        if self.mode == "latency":
+            return sorted(self.members, key=lambda member: member.avg_latency() or 0.0)
+        return list(self.members)
+
+    async def recognize(self, image_data: bytes) -> str:
+        """识别图片中的文字，失败时自动切换提供商"""
+        errors = []
+        for member in self._ordered_members():
+            try:
+                member.breaker.before_call()
+            except CircuitOpenError as e:
+                errors.append(str(e))
+                continue
+
+            member.calls += 1
+            start = time.time()
+            try:
+                text = await member.service.recognize(image_data)
+            except asyncio.CancelledError:
+                # 请求被取消（客户端断开等）：既不算成功也不算失败，归还半开试探名额
+                member.calls -= 1
+                member.breaker.release()
+                raise
+            except BudgetExceeded as e:
+                # 预算用完不是提供商故障：不计入调用统计和熔断，直接切换到下一个
+                member.calls -= 1
+                member.breaker.release()
+                ocr_logger.warning(f"OCR提供商 {member.name} 今日预算已用完，尝试下一个")
+                errors.append(f"{member.name}: {str(e)}")
+                continue
+            except Exception as e:
+                member.failures += 1
+                member.breaker.record_failure(e)
+                ocr_logger.warning(f"OCR提供商 {member.name} 调用失败，尝试下一个: {str(e)}")
+                errors.append(f"{member.name}: {str(e)}")
+                continue
+
+            member.successes += 1
+            member.latencies.append(time.time() - start)
+            member.breaker.record_success()
+            return text
+
+        raise Exception("所有OCR提供商均不可用 - " + "; ".join(errors))
+
+    async def health_check(self) -> bool:
+        """任一提供商可用即认为可用"""
+        await self.probe()
+        return any(member.last_probe_ok for member in self.members)
+
+    async def probe(self):
+        """
+        探测所有提供商
+
+        探测成功时让熔断中的提供商提前进入半开状态，探测失败时直接熔断，
+        避免真实请求落到已知不可用的提供商上。
+        """
+        results = await asyncio.gather(
+            *(member.service.health_check() for member in self.members),
+            return_exceptions=True,
+        )
+        for member, ok in zip(self.members, results):
+            ok = ok is True
+            member.last_probe_ok = ok
+            member.last_probe_at = time.time()
+            if ok:
+                member.breaker.half_open()
+            elif member.breaker.state != CircuitBreaker.OPEN:
+                ocr_logger.warning(f"OCR提供商 {member.name} 健康探测失败，熔断")
+                member.breaker.trip()
+
+    def start_probing(self, interval: float):
+        """启动后台健康探测"""
+        if self._probe_task is None and interval > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop(interval))
+
+    def stop_probing(self):
+        """停止后台健康探测"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    async def _probe_loop(self, interval: float):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                ocr_logger.error(f"OCR健康探测异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> dict:
+        """导出路由统计数据"""
+        return {
+            "mode": self.mode,
+            "providers": [member.snapshot() for member in self.members],
+        }
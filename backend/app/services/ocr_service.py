@@ -1,22 +1,169 @@
 """OCR服务 - 支持多种OCR提供商"""
+import asyncio
 import base64
+import io
+import logging
+import time
 import httpx
+from dataclasses import dataclass
 from typing import Optional
 from abc import ABC, abstractmethod
+from PIL import Image, UnidentifiedImageError
+from ..utils.circuit_breaker import CircuitOpenError, breaker_registry, endpoint_name
+from .usage_store import OCR, UsageStore, endpoint_label
+
+ocr_logger = logging.getLogger("ocr")
+
+# OCR级联的层级：快速接口识别整图 / 高精度接口重识别低置信度行的裁剪区域 / 票据接口重识别整图
+FAST = "fast"
+CROP = "crop"
+FULL = "full"
+TIERS = (FAST, CROP, FULL)
+
+# 百度OCR要求图片最短边不小于15像素，裁剪区域至少补到这个尺寸
+MIN_CROP_SIDE = 15
+
+
+@dataclass
+class OCRCascadePolicy:
+    """OCR级联的接口和置信度阈值"""
+    fast_endpoint: str
+    crop_endpoint: str
+    min_confidence: float = 0.9
+    line_confidence: float = 0.8
+    max_crops: int = 3
+    min_lines: int = 3
+    crop_padding: int = 4
+
+
+@dataclass
+class OCRLine:
+    """快速接口识别出的一行文字"""
+    text: str
+    confidence: Optional[float]  # 行平均置信度，接口未返回时为None
+    location: Optional[dict] = None  # {"left", "top", "width", "height"}
+
+
+class OCRCascadeStats:
+    """按层级统计OCR级联的调用次数、失败次数和延迟，以及各文档的处理结果"""
+
+    def __init__(self):
+        self.tiers = {tier: {"calls": 0, "failures": 0, "latency_total": 0.0} for tier in TIERS}
+        self.documents = 0
+        self.accepted = 0  # 直接采用快速接口结果
+        self.cropped = 0  # 低置信度行经裁剪重识别后采用
+        self.escalated = 0  # 整图改用票据接口识别
+        self.reasons: dict[str, int] = {}
+
+    def record_call(self, tier: str, latency: float, ok: bool = True):
+        stats = self.tiers[tier]
+        stats["calls"] += 1
+        stats["latency_total"] += latency
+        if not ok:
+            stats["failures"] += 1
+
+    def record_document(self, outcome: str, reason: Optional[str] = None):
+        """
+        Args:
+            outcome: accepted / cropped / escalated
+            reason: 升级原因：failed 快速接口调用失败、too_few_lines 行数太少、no_confidence 没有返回置信度、
+                low_confidence 整体置信度低或低置信度行没有位置无法裁剪、too_many_low_lines 低置信度行超过 max_crops、
+                crop_failed 裁剪重识别失败
+        """
+        self.documents += 1
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        if reason:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def snapshot(self) -> dict:
+        documents = self.documents or 1
+        return {
+            "documents": self.documents,
+            "accepted": self.accepted,
+            "cropped": self.cropped,
+            "escalated": self.escalated,
+            "escalation_rate": round(self.escalated / documents, 4),
+            "reasons": dict(self.reasons),
+            "tiers": {
+                tier: {
+                    "calls": stats["calls"],
+                    "failures": stats["failures"],
+                    "avg_latency": round(stats["latency_total"] / stats["calls"], 3) if stats["calls"] else None,
+                }
+                for tier, stats in self.tiers.items()
+            },
+        }
+
+
+# 全局统计
+ocr_cascade_stats = OCRCascadeStats()
 
 
 class BaseOCRProvider(ABC):
     """OCR提供商基类"""
     
+    # 单次HTTP请求超时（秒），由OCRService按配置覆盖
+    timeout: float = 30.0
+    
+    # 用量记账（按端点记录计费调用次数并检查每日预算），由OCRService设置
+    usage: Optional[UsageStore] = None
+    provider_name: str = "generic"
+    
     @abstractmethod
     async def recognize(self, image_data: bytes) -> str:
         """识别图片中的文字"""
         pass
+    
+    async def health_check(self) -> bool:
+        """健康探测（默认认为可用，子类可覆盖）"""
+        return True
+    
+    async def _post(self, url: str, billable: bool = True, **kwargs) -> httpx.Response:
+        """
+        通过端点熔断器发送POST请求
+        
+        端点熔断时直接抛出 CircuitOpenError，不再等待超时；
+        5xx/429 响应计为端点故障并抛出 httpx.HTTPStatusError。
+        
+        Args:
+            billable: 是否为计费调用（识别接口），计费调用前检查预算、收到响应后记账；
+                      获取访问令牌等请求传False
+        
+        Raises:
+            BudgetExceeded: 该提供商/端点今日调用次数预算已用完
+        """
+        label = endpoint_label(url)
+        if billable and self.usage is not None:
+            await asyncio.to_thread(self.usage.check, OCR, self.provider_name, label)
+        
+        async def send() -> httpx.Response:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(url, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                response.raise_for_status()
+            return response
+        
+        response = await breaker_registry.get(endpoint_name("ocr", url)).call(send)
+        if billable and self.usage is not None:
+            await asyncio.to_thread(self.usage.record, OCR, self.provider_name, label)
+        return response
+    
+    async def _probe_url(self, url: str) -> bool:
+        """检查端点是否可达（服务端未返回5xx即认为可用）"""
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.get(url)
+            return response.status_code < 500
+        except httpx.HTTPError:
+            return False
 
 
 class BaiduOCRProvider(BaseOCRProvider):
     """百度OCR"""
     
+    # OCR级联策略，由OCRService按配置设置；为None时直接调用配置的接口（默认 multiple_invoice）
+    cascade: Optional[OCRCascadePolicy] = None
+    
     def __init__(self, api_key: str, secret_key: str, endpoint: Optional[str] = None):
         self.api_key = api_key
         self.secret_key = secret_key
@@ -30,21 +177,154 @@ class BaiduOCRProvider(BaseOCRProvider):
         if self._access_token:
             return self._access_token
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.token_url,
-                params={
-                    "grant_type": "client_credentials",
-                    "client_id": self.api_key,
-                    "client_secret": self.secret_key,
-                }
-            )
-            result = response.json()
-            self._access_token = result.get("access_token")
-            return self._access_token
+        self._access_token = await self._fetch_access_token()
+        return self._access_token
+    
+    async def _fetch_access_token(self) -> Optional[str]:
+        """请求新的访问令牌"""
+        response = await self._post(
+            self.token_url,
+            billable=False,
+            params={
+                "grant_type": "client_credentials",
+                "client_id": self.api_key,
+                "client_secret": self.secret_key,
+            }
+        )
+        result = response.json()
+        return result.get("access_token")
+    
+    async def health_check(self) -> bool:
+        """健康探测：能否用当前密钥获取访问令牌"""
+        try:
+            token = await self._fetch_access_token()
+        except (httpx.HTTPError, CircuitOpenError, ValueError):
+            return False
+        if token:
+            self._access_token = token
+        return bool(token)
     
     async def recognize(self, image_data: bytes) -> str:
         """识别图片"""
+        if self.cascade is None:
+            return await self._recognize_invoice(image_data)
+        return await self._recognize_cascade(image_data)
+    
+    async def _recognize_cascade(self, image_data: bytes) -> str:
+        """
+        级联识别
+        
+        先用便宜快速的接口（返回每行置信度和位置）识别整图：
+        - 行数足够且全部行置信度达标：直接采用
+        - 低置信度行不超过 max_crops 行、其余行的整体置信度达标：只把低置信度行的区域裁剪出来用高精度接口重识别
+        - 其他情况（调用失败、行数太少、没有置信度、整体置信度低、低置信度行太多、
+          低置信度行没有位置无法裁剪、裁剪重识别失败）：
+          整图改用配置的票据接口识别
+        """
+        policy = self.cascade
+        started = time.monotonic()
+        try:
+            lines = await self._recognize_lines(policy.fast_endpoint, image_data)
+        except Exception as e:
+            ocr_cascade_stats.record_call(FAST, time.monotonic() - started, ok=False)
+            ocr_logger.warning(f"OCR级联 - 快速接口识别失败，改用票据接口: {e}")
+            return await self._escalate(image_data, "failed")
+        ocr_cascade_stats.record_call(FAST, time.monotonic() - started)
+        
+        if len(lines) < policy.min_lines:
+            return await self._escalate(image_data, "too_few_lines")
+        if any(line.confidence is None for line in lines):
+            return await self._escalate(image_data, "no_confidence")
+        low = [index for index, line in enumerate(lines) if line.confidence < policy.line_confidence]
+        if len(low) > policy.max_crops:
+            return await self._escalate(image_data, "too_many_low_lines")
+        if any(lines[index].location is None for index in low):
+            # 快速接口没有返回位置（如 general_basic），低置信度行无法裁剪重识别
+            return await self._escalate(image_data, "low_confidence")
+        # 整体置信度只看其余行（低置信度行会单独重识别）
+        rest = [line for index, line in enumerate(lines) if index not in low]
+        total_chars = sum(len(line.text) for line in rest) or 1
+        confidence = sum(line.confidence * len(line.text) for line in rest) / total_chars
+        if confidence < policy.min_confidence:
+            return await self._escalate(image_data, "low_confidence")
+        if not low:
+            ocr_cascade_stats.record_document("accepted")
+            return "\n".join(line.text for line in lines)
+        
+        try:
+            # 解码整图和裁剪编码都较耗CPU，在线程中执行，整图只解码一次
+            crops = await asyncio.to_thread(
+                _crop_lines, image_data, [lines[index].location for index in low], policy.crop_padding
+            )
+        except Exception as e:
+            ocr_logger.warning(f"OCR级联 - 低置信度行裁剪失败，改用票据接口: {e}")
+            return await self._escalate(image_data, "crop_failed")
+        
+        texts = [line.text for line in lines]
+        for index, crop in zip(low, crops):
+            started = time.monotonic()
+            try:
+                crop_lines = await self._recognize_lines(policy.crop_endpoint, crop)
+            except Exception as e:
+                ocr_cascade_stats.record_call(CROP, time.monotonic() - started, ok=False)
+                ocr_logger.warning(f"OCR级联 - 低置信度行裁剪重识别失败，改用票据接口: {e}")
+                return await self._escalate(image_data, "crop_failed")
+            ocr_cascade_stats.record_call(CROP, time.monotonic() - started)
+            text = " ".join(line.text for line in crop_lines)
+            if text:
+                texts[index] = text
+        ocr_cascade_stats.record_document("cropped")
+        ocr_logger.info(f"OCR级联 - 快速接口识别 {len(lines)} 行，{len(low)} 行低置信度经裁剪重识别")
+        return "\n".join(texts)
+    
+    async def _escalate(self, image_data: bytes, reason: str) -> str:
+        """整图改用票据接口识别"""
+        ocr_logger.info(f"OCR级联 - 升级到票据接口 {self.ocr_url}，原因: {reason}")
+        ocr_cascade_stats.record_document("escalated", reason)
+        started = time.monotonic()
+        try:
+            text = await self._recognize_invoice(image_data)
+        except Exception:
+            ocr_cascade_stats.record_call(FULL, time.monotonic() - started, ok=False)
+            raise
+        ocr_cascade_stats.record_call(FULL, time.monotonic() - started)
+        return text
+    
+    async def _recognize_lines(self, url: str, image_data: bytes) -> list[OCRLine]:
+        """
+        调用通用文字识别接口（general_basic/general/accurate_basic/accurate 等），返回每行的文字、置信度和位置
+        
+        *_basic 接口不返回位置，此时 location 为None。
+        """
+        access_token = await self._get_access_token()
+        response = await self._post(
+            url,
+            params={"access_token": access_token},
+            data={
+                "image": base64.b64encode(image_data).decode("utf-8"),
+                "probability": "true",
+                "location": "true",
+            },
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+            },
+        )
+        result = response.json()
+        if "error_code" in result:
+            raise Exception(f"百度OCR API错误: {result.get('error_msg', '未知错误')} (错误码: {result.get('error_code')})")
+        lines = []
+        for item in result.get("words_result") or []:
+            text = (item.get("words") or "").strip()
+            if not text:
+                continue
+            probability = item.get("probability")
+            confidence = probability.get("average") if isinstance(probability, dict) else None
+            lines.append(OCRLine(text, float(confidence) if confidence is not None else None, item.get("location")))
+        return lines
+    
+    async def _recognize_invoice(self, image_data: bytes) -> str:
+        """调用配置的接口（默认智能财务票据识别 multiple_invoice）识别整图"""
         import logging
         import sys
         ocr_logger = logging.getLogger("ocr")
@@ -69,18 +349,17 @@ class BaiduOCRProvider(BaseOCRProvider):
         
         # multiple_invoice 为主接口；当只返回分类结果（type=others 等）时，不在这里降级
         # 降级逻辑在后面的解析部分处理，根据type调用对应的专用接口（如bank_receipt_new）
-        async with httpx.AsyncClient() as client:
-            # 第一次调用：智能财务票据识别 multiple_invoice
-            response = await client.post(
-                self.ocr_url,
-                params={"access_token": access_token},
-                data=form_data,  # httpx 会自动进行 URL 编码
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json",
-                },
-            )
-            result = response.json()
+        # 第一次调用：智能财务票据识别 multiple_invoice
+        response = await self._post(
+            self.ocr_url,
+            params={"access_token": access_token},
+            data=form_data,  # httpx 会自动进行 URL 编码
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+            },
+        )
+        result = response.json()
             
         # 记录返回数据（用于调试）- 使用INFO级别确保能看到
         ocr_logger.info(f"百度OCR返回数据键: {list(result.keys()) if isinstance(result, dict) else '非字典'}")
@@ -245,17 +524,16 @@ class BaiduOCRProvider(BaseOCRProvider):
         # 手动构建form data字符串（按照文档示例，使用urlencode）
         payload = urlencode(form_data)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.bank_receipt_url,
-                params={"access_token": access_token},
-                content=payload.encode("utf-8"),  # 手动编码为bytes
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Accept": "application/json"
-                }
-            )
-            result = response.json()
+        response = await self._post(
+            self.bank_receipt_url,
+            params={"access_token": access_token},
+            content=payload.encode("utf-8"),  # 手动编码为bytes
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json"
+            }
+        )
+        result = response.json()
         
         ocr_logger.info(f"银行回单OCR返回数据: {result}")
         print(f"[OCR] 银行回单返回数据: {result}", file=sys.stderr)
@@ -305,6 +583,47 @@ class BaiduOCRProvider(BaseOCRProvider):
         return "\n".join(text_lines) if text_lines else ""
 
 
+def _crop_lines(image_data: bytes, locations: list[dict], padding: int) -> list[bytes]:
+    """
+    按OCR返回的位置裁剪出各行文字的区域（四周留 padding 像素），编码为PNG
+
+    同步方法（解码和编码图片），在异步代码中应放到线程中执行。
+
+    Raises:
+        ValueError: 图片无法读取或裁剪区域超出图片范围
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"无法读取图片用于裁剪: {e}")
+    return [_crop_image(image, location, padding) for location in locations]
+
+
+def _crop_image(image: Image.Image, location: dict, padding: int) -> bytes:
+    """裁剪一行文字的区域并编码为PNG"""
+    left = int(location["left"]) - padding
+    top = int(location["top"]) - padding
+    right = int(location["left"]) + int(location["width"]) + padding
+    bottom = int(location["top"]) + int(location["height"]) + padding
+    # 补到接口要求的最小尺寸
+    if right - left < MIN_CROP_SIDE:
+        left -= (MIN_CROP_SIDE - (right - left) + 1) // 2
+        right = left + MIN_CROP_SIDE
+    if bottom - top < MIN_CROP_SIDE:
+        top -= (MIN_CROP_SIDE - (bottom - top) + 1) // 2
+        bottom = top + MIN_CROP_SIDE
+    box = (max(0, left), max(0, top), min(image.width, right), min(image.height, bottom))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError(f"裁剪区域超出图片范围: {location}")
+    crop = image.crop(box)
+    if crop.mode not in ("RGB", "L"):
+        crop = crop.convert("RGB")
+    buffer = io.BytesIO()
+    crop.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 class AliyunOCRProvider(BaseOCRProvider):
     """阿里云OCR"""
     
@@ -312,20 +631,23 @@ class AliyunOCRProvider(BaseOCRProvider):
         self.api_key = api_key
         self.ocr_url = endpoint or "https://ocrapi-advanced.taobao.com/ocrservice/advanced"
     
+    async def health_check(self) -> bool:
+        """健康探测：端点是否可达"""
+        return await self._probe_url(self.ocr_url)
+    
     async def recognize(self, image_data: bytes) -> str:
         """识别图片"""
         image_base64 = base64.b64encode(image_data).decode("utf-8")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.ocr_url,
-                json={"img": image_base64},
-                headers={
-                    "Authorization": f"APPCODE {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-            )
-            result = response.json()
+        response = await self._post(
+            self.ocr_url,
+            json={"img": image_base64},
+            headers={
+                "Authorization": f"APPCODE {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
+        result = response.json()
         
         # 提取文字
         if "prism_wordsInfo" in result:
@@ -342,6 +664,10 @@ class TencentOCRProvider(BaseOCRProvider):
         self.secret_key = secret_key
         self.endpoint = endpoint or "ocr.tencentcloudapi.com"
     
+    async def health_check(self) -> bool:
+        """健康探测：端点是否可达"""
+        return await self._probe_url(f"https://{self.endpoint}")
+    
     async def recognize(self, image_data: bytes) -> str:
         """识别图片"""
         import hashlib
@@ -385,20 +711,19 @@ class TencentOCRProvider(BaseOCRProvider):
         # 构建授权头
         authorization = f"{algorithm} Credential={self.secret_id}/{credential_scope}, SignedHeaders={signed_headers}, Signature={signature}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"https://{self.endpoint}",
-                content=payload,
-                headers={
-                    "Authorization": authorization,
-                    "Content-Type": "application/json",
-                    "Host": self.endpoint,
-                    "X-TC-Action": "GeneralBasicOCR",
-                    "X-TC-Version": "2018-11-19",
-                    "X-TC-Timestamp": str(timestamp),
-                }
-            )
-            result = response.json()
+        response = await self._post(
+            f"https://{self.endpoint}",
+            content=payload,
+            headers={
+                "Authorization": authorization,
+                "Content-Type": "application/json",
+                "Host": self.endpoint,
+                "X-TC-Action": "GeneralBasicOCR",
+                "X-TC-Version": "2018-11-19",
+                "X-TC-Timestamp": str(timestamp),
+            }
+        )
+        result = response.json()
         
         # 提取文字
         response_data = result.get("Response", {})
@@ -415,6 +740,12 @@ class GenericOCRProvider(BaseOCRProvider):
         self.secret_key = secret_key
         self.endpoint = endpoint
     
+    async def health_check(self) -> bool:
+        """健康探测：端点是否可达"""
+        if not self.endpoint:
+            return False
+        return await self._probe_url(self.endpoint)
+    
     async def recognize(self, image_data: bytes) -> str:
         """识别图片 - 通用实现"""
         if not self.endpoint:
@@ -422,16 +753,15 @@ class GenericOCRProvider(BaseOCRProvider):
         
         image_base64 = base64.b64encode(image_data).decode("utf-8")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.endpoint,
-                json={"image": image_base64},
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-            )
-            result = response.json()
+        response = await self._post(
+            self.endpoint,
+            json={"image": image_base64},
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
+        result = response.json()
         
         # 尝试从常见字段提取文字
         if "text" in result:
@@ -461,11 +791,35 @@ class OCRService:
         api_key: str = None,
         secret_key: str = None,
         endpoint: str = None,
+        timeout: Optional[float] = None,
+        usage: Optional[UsageStore] = None,
+        cascade: Optional[bool] = None,
     ):
+        """
+        Args:
+            usage: 用量记账（记录计费调用次数并检查每日预算），为None时不记账
+            cascade: 是否启用OCR级联（先快速接口，低置信度再用高精度/票据接口，仅百度支持），
+                     为None时按配置 ocr_cascade_enabled
+        """
+        from ..config import get_settings
+        
+        settings = get_settings()
         self.provider_name = provider
         self.api_key = api_key
         self.secret_key = secret_key
         self.endpoint = endpoint
+        self.timeout = timeout or settings.ocr_timeout
+        self.usage = usage
+        self.cascade: Optional[OCRCascadePolicy] = None
+        if provider == "baidu" and (settings.ocr_cascade_enabled if cascade is None else cascade):
+            self.cascade = OCRCascadePolicy(
+                fast_endpoint=settings.ocr_cascade_fast_endpoint,
+                crop_endpoint=settings.ocr_cascade_crop_endpoint,
+                min_confidence=settings.ocr_cascade_min_confidence,
+                line_confidence=settings.ocr_cascade_line_confidence,
+                max_crops=settings.ocr_cascade_max_crops,
+                min_lines=settings.ocr_cascade_min_lines,
+            )
         self._provider: Optional[BaseOCRProvider] = None
     
     def _get_provider(self) -> BaseOCRProvider:
@@ -477,6 +831,11 @@ class OCRService:
                 secret_key=self.secret_key,
                 endpoint=self.endpoint,
             )
+            self._provider.timeout = self.timeout
+            self._provider.usage = self.usage
+            self._provider.provider_name = self.provider_name
+            if isinstance(self._provider, BaiduOCRProvider):
+                self._provider.cascade = self.cascade
         return self._provider
     
     async def recognize(self, image_data: bytes) -> str:
@@ -484,6 +843,10 @@ class OCRService:
         provider = self._get_provider()
         return await provider.recognize(image_data)
     
+    async def health_check(self) -> bool:
+        """健康探测"""
+        return await self._get_provider().health_check()
+    
     def update_config(
         self,
         provider: str = None,
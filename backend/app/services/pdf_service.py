@@ -0,0 +1,203 @@
+"""PDF服务 - 多页PDF逐页提取图片、并行OCR，并按凭证分组"""
+import asyncio
+import logging
+import re
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+from ..utils.rate_limiter import AsyncRateLimiter
+from ..utils.scheduler import PriorityScheduler
+
+ocr_logger = logging.getLogger("ocr")
+
+PDF_MAGIC = b"%PDF-"
+
+# 出现这些字样的页面视为一张新凭证/票据的首页
+VOUCHER_HEADER_PATTERN = re.compile(
+    r"发票代码|发票号码|电子发票|增值税|记账凭证|收款凭证|付款凭证|转账凭证|回单|收据|报销单"
+)
+# 出现这些字样的页面视为上一页的续页
+CONTINUATION_PATTERN = re.compile(
+    r"续页|[（(]续[）)]|接上页|第\s*([2-9]|\d{2,})\s*页|(?<![\d/])([2-9]|\d{2,})\s*/\s*\d+\s*页?(?![\d/])"
+)
+
+
+@dataclass
+class PdfPage:
+    """PDF中的一页"""
+    number: int  # 页码，从1开始
+    image_data: bytes
+    image_ext: str  # 图片扩展名，如 .png/.jpg
+    ocr_text: str = ""
+    error: Optional[str] = None
+    saved_name: Optional[str] = None  # 页面图片保存后的文件名
+
+
+@dataclass
+class PdfVoucherGroup:
+    """属于同一张凭证的若干页"""
+    pages: list[PdfPage] = field(default_factory=list)
+
+    @property
+    def page_numbers(self) -> list[int]:
+        return [page.number for page in self.pages]
+
+    @property
+    def ocr_text(self) -> str:
+        """合并各页OCR文本，多页时标注页码"""
+        if len(self.pages) == 1:
+            return self.pages[0].ocr_text
+        return "\n".join(f"--- 第{page.number}页 ---\n{page.ocr_text}" for page in self.pages)
+
+
+def is_pdf(head: bytes) -> bool:
+    """根据文件头判断是否为PDF"""
+    return head.lstrip()[:5] == PDF_MAGIC
+
+
+def _import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        raise Exception("处理PDF需要安装 PyMuPDF: pip install pymupdf")
+    return pymupdf
+
+
+class PDFService:
+    """PDF识别服务"""
+
+    GROUP_MODES = ("auto", "page", "document")
+
+    def __init__(
+        self,
+        dpi: int = 200,
+        concurrency: int = 4,
+        rate_limiter: Optional[AsyncRateLimiter] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+    ):
+        """
+        Args:
+            dpi: 页面栅格化分辨率
+            concurrency: 同时进行OCR的页数（同时也限制了内存中待识别的页数）
+            rate_limiter: OCR调用限流器（遵守提供商的QPS限制）
+            scheduler: OCR调用调度器（与其他请求按优先级共享OCR容量）
+        """
+        self.dpi = dpi
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter
+        self.scheduler = scheduler
+
+    def iter_pages(self, pdf_path: str) -> Iterator[PdfPage]:
+        """
+        逐页产出页面图片
+
+        按文件路径打开PDF，MuPDF按需读取页面，不会一次性加载整个文档。
+        扫描件（整页只有一张嵌入图片）直接提取原图，其余页面按 dpi 栅格化。
+        """
+        pymupdf = _import_pymupdf()
+        with pymupdf.open(pdf_path) as doc:
+            for index in range(doc.page_count):
+                page = doc.load_page(index)
+                yield self._page_image(doc, page, index + 1)
+
+    def _page_image(self, doc, page, number: int) -> PdfPage:
+        """提取或渲染单页图片"""
+        images = page.get_images(full=True)
+        if len(images) == 1 and not page.get_text("text").strip():
+            xref = images[0][0]
+            extracted = doc.extract_image(xref)
+            if extracted and extracted.get("ext") in ("jpeg", "jpg", "png", "bmp"):
+                ext = "jpg" if extracted["ext"] == "jpeg" else extracted["ext"]
+                return PdfPage(number=number, image_data=extracted["image"], image_ext=f".{ext}")
+
+        pixmap = page.get_pixmap(dpi=self.dpi)
+        return PdfPage(number=number, image_data=pixmap.tobytes("png"), image_ext=".png")
+
+    async def ocr_pages(
+        self,
+        pdf_path: str,
+        ocr,
+        save_page: Optional[Callable[[PdfPage], str]] = None,
+    ) -> list[PdfPage]:
+        """
+        并行识别所有页面
+
+        页面在线程中逐页提取（MuPDF文档对象不能被多个线程同时使用），
+        每提取一页就提交OCR；并发数由 concurrency 控制，调用频率由 rate_limiter 控制。
+        识别完成后页面图片交给 save_page 保存并从内存中释放。
+
+        Args:
+            pdf_path: PDF文件路径
+            ocr: OCR服务（需提供 recognize 方法）
+            save_page: 保存页面图片的函数，返回保存后的文件名
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pages: list[PdfPage] = []
+        tasks = []
+
+        async def recognize_page(page: PdfPage):
+            try:
+                async with self.scheduler.slot() if self.scheduler else nullcontext():
+                    if self.rate_limiter:
+                        await self.rate_limiter.acquire()
+                    page.ocr_text = await ocr.recognize(page.image_data)
+            except Exception as e:
+                ocr_logger.error(f"PDF第{page.number}页OCR失败: {str(e)}")
+                page.error = str(e)
+            finally:
+                try:
+                    if save_page:
+                        page.saved_name = await asyncio.to_thread(save_page, page)
+                except Exception as e:
+                    ocr_logger.warning(f"保存PDF第{page.number}页图片失败: {str(e)}")
+                page.image_data = b""
+                semaphore.release()
+
+        pages_iter = self.iter_pages(pdf_path)
+        try:
+            while True:
+                # 先占用并发名额再提取下一页，避免页面图片在内存中堆积
+                await semaphore.acquire()
+                page = await asyncio.to_thread(next, pages_iter, None)
+                if page is None:
+                    semaphore.release()
+                    break
+                pages.append(page)
+                tasks.append(asyncio.create_task(recognize_page(page)))
+        finally:
+            pages_iter.close()
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        return pages
+
+    def group_pages(self, pages: list[PdfPage], mode: str = "auto") -> list[PdfVoucherGroup]:
+        """
+        将页面分组为凭证
+
+        - page: 每页一张凭证
+        - document: 整个PDF为一张凭证
+        - auto: 出现续页标记、或没有票据抬头的页面归入上一张凭证，其余页面开始新凭证
+        """
+        if mode not in self.GROUP_MODES:
+            raise ValueError(f"不支持的PDF分组方式: {mode}，可选: {', '.join(self.GROUP_MODES)}")
+
+        groups: list[PdfVoucherGroup] = []
+        for page in pages:
+            if not groups or mode == "page":
+                groups.append(PdfVoucherGroup([page]))
+                continue
+            if mode == "document":
+                groups[0].pages.append(page)
+                continue
+
+            text = page.ocr_text
+            is_continuation = bool(CONTINUATION_PATTERN.search(text)) or (
+                bool(text.strip()) and not VOUCHER_HEADER_PATTERN.search(text)
+            )
+            if is_continuation and not groups[-1].pages[-1].error:
+                groups[-1].pages.append(page)
+            else:
+                groups.append(PdfVoucherGroup([page]))
+        return groups
@@ -0,0 +1,291 @@
+"""上下文预算 - 按模型系列估算token数，发送前让提示词适配模型的上下文窗口"""
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# 各模型系列每个字符的token数（偏保守的估计）：(中日韩字符及全角符号, 其他字符)
+# DeepSeek：1个中文字符约0.6 token，1个英文字符约0.3 token；Kimi/豆包：1 token约1.5~2个汉字
+FAMILY_RATES = {
+    "deepseek": (0.6, 0.3),
+    "moonshot": (0.7, 0.3),
+    "doubao": (0.7, 0.3),
+    "default": (1.0, 0.35),
+}
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]")
+WINDOW_SUFFIX_PATTERN = re.compile(r"(\d+)k\b", re.IGNORECASE)
+# 只有数字、金额、日期等的行（重复出现可能是不同分录的金额，不去重）
+NUMERIC_LINE_PATTERN = re.compile(r"^[\d\s.,:%¥$+\-/()]*$")
+
+# 上下文不足时总是保留的常用科目
+CORE_SUBJECTS = ("1001", "1002", "1122", "1221", "2202", "2221", "2241", "6601", "6602", "6603")
+
+# 调整动作
+COMPRESSED = "compressed"
+SUBJECTS_SHRUNK = "subjects_shrunk"
+OUTPUT_REDUCED = "output_reduced"
+ROUTED = "routed"
+TRUNCATED = "truncated"
+ACTIONS = (COMPRESSED, SUBJECTS_SHRUNK, OUTPUT_REDUCED, ROUTED, TRUNCATED)
+
+
+class PromptTooLong(Exception):
+    """提示词的固定部分已超过模型的上下文窗口，无法发送"""
+
+
+def model_family(provider: str, model: str) -> str:
+    """按模型名（其次按提供商）判断模型系列"""
+    name = (model or "").lower()
+    for family, keys in (("moonshot", ("moonshot", "kimi")), ("deepseek", ("deepseek",)), ("doubao", ("doubao",))):
+        if any(key in name for key in keys):
+            return family
+    return {"kimi": "moonshot", "deepseek": "deepseek", "doubao": "doubao"}.get(provider, "default")
+
+
+def estimate_tokens(text: str, family: str = "default") -> int:
+    """估算文本的token数"""
+    if not text:
+        return 0
+    cjk_rate, other_rate = FAMILY_RATES.get(family, FAMILY_RATES["default"])
+    cjk = len(CJK_PATTERN.findall(text))
+    return int(cjk * cjk_rate + (len(text) - cjk) * other_rate) + 1
+
+
+def compress_text(text: str) -> str:
+    """
+    压缩OCR文本：去掉行首尾空白、合并连续空白、删除空行和紧邻重复的文字行
+
+    不相邻的重复行、单字行（借贷方向）和纯数字/金额行保留，多分录凭证中摘要、科目、金额相同的分录不会被合并。
+    """
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if len(line) > 1 and not NUMERIC_LINE_PATTERN.match(line) and lines and lines[-1] == line:
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def relevant_subjects(text: str, subjects: dict[str, str]) -> dict[str, str]:
+    """只保留名称（或名称中任意两个连续字）出现在OCR文本中的科目，以及常用科目"""
+    result = {}
+    for code, name in subjects.items():
+        if code in CORE_SUBJECTS or name in text or any(name[i:i + 2] in text for i in range(len(name) - 1)):
+            result[code] = name
+    return result
+
+
+@dataclass
+class PromptPlan:
+    """适配上下文窗口后的请求"""
+    model: str
+    messages: list[dict]
+    max_tokens: int
+    prompt_tokens: int  # 估算的输入token数
+    context_window: int
+    actions: list[str] = field(default_factory=list)
+
+
+class PromptBudgetStats:
+    """按模型系列统计提示词调整次数和token估算偏差"""
+
+    def __init__(self):
+        self._stats: dict[str, dict] = {}
+
+    def _entry(self, family: str) -> dict:
+        return self._stats.setdefault(family, {
+            "plans": 0, **{action: 0 for action in ACTIONS},
+            "estimated": 0, "actual": 0, "samples": 0,
+        })
+
+    def record_plan(self, family: str, actions: list[str]):
+        stats = self._entry(family)
+        stats["plans"] += 1
+        for action in actions:
+            stats[action] += 1
+
+    def record_tokens(self, family: str, estimated: int, actual: int):
+        """记录一次调用的估算和实际输入token数（来自响应的 usage）"""
+        if actual <= 0:
+            return
+        stats = self._entry(family)
+        stats["estimated"] += estimated
+        stats["actual"] += actual
+        stats["samples"] += 1
+
+    def snapshot(self) -> list[dict]:
+        result = []
+        for family, stats in self._stats.items():
+            result.append({
+                "family": family,
+                **{key: value for key, value in stats.items() if key not in ("estimated", "actual")},
+                # 估算/实际 > 1 表示估算偏保守
+                "estimate_ratio": round(stats["estimated"] / stats["actual"], 3) if stats["actual"] else None,
+            })
+        return result
+
+
+# 全局统计
+prompt_stats = PromptBudgetStats()
+
+
+class PromptBudget:
+    """
+    上下文预算
+
+    发送前估算提示词token数，保证 输入 + 输出上限 不超过模型的上下文窗口。放不下时依次：
+    1. 压缩OCR文本（空白、空行、重复行）
+    2. 科目表只保留与OCR文本相关的科目
+    3. 把输出上限降到不低于 min_output
+    4. 换用配置的更大上下文的模型（如 moonshot-v1-8k -> moonshot-v1-32k），重新规划
+    5. 截断OCR文本
+    固定部分（提示词模板、精简后的科目表）都放不下时抛出 PromptTooLong。
+    """
+
+    def __init__(
+        self,
+        windows: Optional[dict[str, int]] = None,
+        larger_models: Optional[dict[str, str]] = None,
+        default_window: int = 32768,
+        max_output: int = 4096,
+        min_output: int = 1536,
+        margin: float = 1.1,
+    ):
+        """
+        Args:
+            windows: 模型 -> 上下文窗口（tokens）；未配置的模型按名称后缀（如 -8k）推断，否则用 default_window
+            larger_models: 模型 -> 上下文更大的同系列模型
+            max_output: 期望的输出上限（max_tokens）
+            min_output: 输出上限最低降到多少
+            margin: 估算结果的放大系数（留出估算误差）
+        """
+        self.windows = dict(windows or {})
+        self.larger_models = dict(larger_models or {})
+        self.default_window = default_window
+        self.max_output = max_output
+        self.min_output = min(min_output, max_output)
+        self.margin = margin
+
+    def window(self, model: str) -> int:
+        """模型的上下文窗口"""
+        if model in self.windows:
+            return self.windows[model]
+        match = WINDOW_SUFFIX_PATTERN.search(model or "")
+        return int(match.group(1)) * 1024 if match else self.default_window
+
+    def estimate_messages(self, messages: list[dict], family: str) -> int:
+        """估算消息列表的输入token数（含放大系数）"""
+        raw = sum(estimate_tokens(message["content"], family) + MESSAGE_OVERHEAD for message in messages)
+        return int(raw * self.margin)
+
+    def plan(
+        self,
+        provider: str,
+        model: str,
+        render: Callable[[dict[str, str], str], list[dict]],
+        ocr_text: str,
+        subjects: dict[str, str],
+    ) -> PromptPlan:
+        """
+        生成适配上下文窗口的请求
+
+        Args:
+            render: (科目表, OCR文本) -> 消息列表
+            subjects: 完整科目表（编码 -> 名称）
+
+        Raises:
+            PromptTooLong: 固定部分已超过上下文窗口
+        """
+        plan = self._plan(provider, model, render, ocr_text, subjects)
+        prompt_stats.record_plan(model_family(provider, plan.model), plan.actions)
+        return plan
+
+    def _plan(
+        self,
+        provider: str,
+        model: str,
+        render: Callable[[dict[str, str], str], list[dict]],
+        ocr_text: str,
+        subjects: dict[str, str],
+    ) -> PromptPlan:
+        family = model_family(provider, model)
+        window = self.window(model)
+        actions = []
+
+        def build(text: str, table: dict[str, str], max_tokens: Optional[int] = None) -> Optional[PromptPlan]:
+            messages = render(table, text)
+            tokens = self.estimate_messages(messages, family)
+            available = window - tokens
+            if max_tokens is None:
+                if available < self.max_output:
+                    return None
+                max_tokens = self.max_output
+            elif available < max_tokens:
+                return None
+            return PromptPlan(model, messages, max_tokens, tokens, window, list(actions))
+
+        text, table = ocr_text, subjects
+        plan = build(text, table)
+        if plan is None:
+            compressed = compress_text(text)
+            if compressed != text:
+                text = compressed
+                actions.append(COMPRESSED)
+                plan = build(text, table)
+        if plan is None:
+            shrunk = relevant_subjects(text, table)
+            if len(shrunk) < len(table):
+                table = shrunk
+                actions.append(SUBJECTS_SHRUNK)
+                plan = build(text, table)
+        if plan is None:
+            tokens = self.estimate_messages(render(table, text), family)
+            if window - tokens >= self.min_output:
+                actions.append(OUTPUT_REDUCED)
+                plan = build(text, table, window - tokens)
+        if plan is None and self.larger_models.get(model):
+            # 换用更大上下文的模型，从原始文本重新规划（可能不再需要压缩）
+            plan = self._plan(provider, self.larger_models[model], render, ocr_text, subjects)
+            plan.actions.insert(0, ROUTED)
+            return plan
+        if plan is None:
+            fixed = self.estimate_messages(render(table, ""), family)
+            available = int((window - self.min_output - fixed) / self.margin)
+            if available <= 0:
+                raise PromptTooLong(
+                    f"提示词固定部分（约 {fixed} tokens）加最低输出 {self.min_output} tokens "
+                    f"超过 {model} 的上下文窗口 {window} tokens"
+                )
+            text = truncate_text(text, available, family)
+            actions.append(TRUNCATED)
+            tokens = self.estimate_messages(render(table, text), family)
+            plan = build(text, table, min(self.max_output, window - tokens))
+            if plan is None:
+                raise PromptTooLong(f"OCR文本截断后仍超过 {model} 的上下文窗口 {window} tokens")
+        return plan
+
+
+def truncate_text(text: str, max_tokens: int, family: str) -> str:
+    """按行截断文本到估算的 max_tokens 以内，末尾注明省略的内容"""
+    budget = max_tokens - 20  # 留给省略说明
+    lines = text.split("\n")
+    kept = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line, family) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if len(kept) == len(lines):
+        return text
+    if not kept:
+        # 第一行就超出（如OCR文本没有换行）：按最坏的每字符token数截断
+        chars = max(0, int(budget / max(FAMILY_RATES.get(family, FAMILY_RATES["default"]))))
+        return f"{text[:chars]}\n……（OCR文本过长，以下省略 {len(text) - chars} 字）"
+    return "\n".join(kept) + f"\n……（OCR文本过长，以下省略 {len(lines) - len(kept)} 行）"
@@ -0,0 +1,359 @@
+"""识别结果存储 - 基于SQLite持久化识别结果，支持按日期、批次、凭证号、往来单位查询"""
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Optional, Union
+
+import orjson
+
+from ..models import VoucherData
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    filename TEXT,
+    created_at TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    success_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    duplicate_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_batches_created_at ON batches(created_at);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_hash TEXT,
+    image_url TEXT,
+    success INTEGER NOT NULL,
+    error TEXT,
+    duplicate_of TEXT,
+    possible_duplicate_of TEXT,
+    pages TEXT,
+    page_image_urls TEXT,
+    ocr_text TEXT,
+    voucher_json TEXT,
+    voucher_date TEXT,
+    voucher_no TEXT,
+    ocr_provider TEXT,
+    llm_provider TEXT,
+    llm_model TEXT,
+    ocr_time REAL,
+    llm_time REAL
+);
+CREATE INDEX IF NOT EXISTS idx_results_batch ON results(batch_id, seq);
+CREATE INDEX IF NOT EXISTS idx_results_voucher_date ON results(voucher_date);
+CREATE INDEX IF NOT EXISTS idx_results_voucher_no ON results(voucher_no);
+CREATE INDEX IF NOT EXISTS idx_results_file_hash ON results(file_hash);
+
+-- 一张凭证可能涉及多个往来单位，单独建表便于按单位查询
+CREATE TABLE IF NOT EXISTS result_partners (
+    result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+    partner_name TEXT NOT NULL,
+    PRIMARY KEY (partner_name, result_id)
+) WITHOUT ROWID;
+"""
+
+# 已有数据库升级时补充的列：(表, 列, 类型)
+MIGRATIONS = (
+    ("results", "possible_duplicate_of", "TEXT"),
+    ("results", "page_image_urls", "TEXT"),
+)
+
+# 查询列表时默认不返回的大字段
+LIST_COLUMNS = (
+    "id, batch_id, seq, created_at, filename, file_hash, image_url, success, error, duplicate_of, possible_duplicate_of, "
+    "pages, page_image_urls, voucher_json, voucher_date, voucher_no, ocr_provider, llm_provider, llm_model, ocr_time, llm_time"
+)
+
+DATE_PATTERN = re.compile(r"(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})")
+
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    """将 2024/1/5、2024年1月5日 等日期统一为 2024-01-05，无法识别时返回None"""
+    if not value:
+        return None
+    match = DATE_PATTERN.search(value)
+    if not match:
+        compact = re.fullmatch(r"\s*(\d{4})(\d{2})(\d{2})\s*", value)
+        if not compact:
+            return None
+        match = compact
+    year, month, day = (int(part) for part in match.groups())
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def _partner_names(voucher: Optional[VoucherData]) -> list[str]:
+    """提取凭证分录中出现的往来单位名称（去重，保持顺序）"""
+    names: list[str] = []
+    for entry in voucher.entries if voucher else []:
+        name = entry.partner_name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _as_voucher(voucher: Union[VoucherData, dict, None]) -> Optional[VoucherData]:
+    """凭证数据统一为 VoucherData（兼容传入字典的调用方）"""
+    if not voucher:
+        return None
+    return voucher if isinstance(voucher, VoucherData) else VoucherData.model_validate(voucher)
+
+
+class ResultsStore:
+    """
+    识别结果仓库
+
+    每次识别请求记为一个批次，批次内每条识别结果一行。
+    sqlite3 是同步接口，在异步代码中应通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """为旧版本创建的数据库补充新增的列"""
+        for table, column, column_type in MIGRATIONS:
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def save_batch(
+        self,
+        source: str,
+        results: list[dict],
+        filename: Optional[str] = None,
+        ocr_provider: Optional[str] = None,
+        llm_provider: Optional[str] = None,
+        llm_model: Optional[str] = None,
+    ) -> tuple[str, list[int]]:
+        """
+        保存一个批次的识别结果
+
+        Args:
+            source: 来源，如 single/batch/archive/streamlit
+            results: 识别结果（RecognitionResult 字段的字典，voucher_data 可为 VoucherData 或字典）
+            filename: 批次对应的上传文件名（压缩包等）
+            llm_provider/llm_model: 结果中没有 llm_provider/llm_model（实际给出结果的模型）时记录的值
+
+        Returns:
+            (批次ID, 按顺序对应每条结果的记录ID)
+        """
+        batch_id = uuid.uuid4().hex
+        created_at = datetime.now().isoformat(timespec="seconds")
+        success_count = sum(1 for result in results if result.get("success"))
+        duplicate_count = sum(1 for result in results if result.get("duplicate_of"))
+
+        ids = []
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO batches (id, source, filename, created_at, total, success_count, failed_count, duplicate_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, source, filename, created_at, len(results), success_count,
+                 len(results) - success_count, duplicate_count),
+            )
+            for seq, result in enumerate(results):
+                voucher = _as_voucher(result.get("voucher_data"))
+                cursor = self._conn.execute(
+                    "INSERT INTO results (batch_id, seq, created_at, filename, file_hash, image_url, success, error, "
+                    "duplicate_of, possible_duplicate_of, pages, page_image_urls, ocr_text, voucher_json, voucher_date, "
+                    "voucher_no, ocr_provider, llm_provider, llm_model, ocr_time, llm_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        batch_id, seq, created_at,
+                        result.get("filename") or "",
+                        result.get("file_hash"),
+                        result.get("image_url"),
+                        1 if result.get("success") else 0,
+                        result.get("error"),
+                        result.get("duplicate_of"),
+                        result.get("possible_duplicate_of"),
+                        orjson.dumps(result["pages"]).decode() if result.get("pages") else None,
+                        orjson.dumps(result["page_image_urls"]).decode() if result.get("page_image_urls") else None,
+                        result.get("ocr_text"),
+                        voucher.model_dump_json() if voucher else None,
+                        normalize_date(voucher.voucher_date) if voucher else None,
+                        (voucher.voucher_no.strip() or None) if voucher else None,
+                        ocr_provider,
+                        result.get("llm_provider") or llm_provider,
+                        result.get("llm_model") or llm_model,
+                        result.get("ocr_time"),
+                        result.get("llm_time"),
+                    ),
+                )
+                result_id = cursor.lastrowid
+                ids.append(result_id)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO result_partners (result_id, partner_name) VALUES (?, ?)",
+                    [(result_id, name) for name in _partner_names(voucher)],
+                )
+        return batch_id, ids
+
+    def query_results(
+        self,
+        batch_id: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        voucher_no: Optional[str] = None,
+        partner: Optional[str] = None,
+        success: Optional[bool] = None,
+        include_duplicates: bool = True,
+        offset: int = 0,
+        limit: Optional[int] = 50,
+        include_ocr_text: bool = False,
+        batch_ids: Optional[list[str]] = None,
+        newest_first: bool = True,
+        result_ids: Optional[list[int]] = None,
+    ) -> tuple[int, list[dict]]:
+        """
+        按条件分页查询识别结果
+
+        Args:
+            date_from/date_to: 凭证编制日期范围（含两端），格式 YYYY-MM-DD
+            partner: 往来单位名称前缀
+            limit: 每页条数，None表示不分页
+            batch_ids: 限定在这些批次中（与 batch_id 同时给出时取并集）
+            newest_first: 最新的在前；为False时按识别顺序
+            result_ids: 限定在这些结果ID中
+
+        Returns:
+            (符合条件的总数, 当前页记录)
+        """
+        batch_ids = list(batch_ids or []) + ([batch_id] if batch_id else [])
+        where, params = self._filters(result_ids, batch_ids, date_from, date_to, voucher_no, partner, success, include_duplicates)
+        columns = LIST_COLUMNS + (", ocr_text" if include_ocr_text else "")
+        order = "id DESC" if newest_first else "id"
+        page_sql = f"SELECT {columns} FROM results {where} ORDER BY {order}"
+        page_params = list(params)
+        if limit is not None:
+            page_sql += " LIMIT ? OFFSET ?"
+            page_params += [limit, offset]
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM results {where}", params).fetchone()[0]
+            rows = self._conn.execute(page_sql, page_params).fetchall()
+        return total, [self._row_to_dict(row) for row in rows]
+
+    def get_result(self, result_id: int) -> Optional[dict]:
+        """获取单条识别结果（含OCR文本）"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {LIST_COLUMNS}, ocr_text FROM results WHERE id = ?", (result_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_batches(self, offset: int = 0, limit: int = 50) -> tuple[int, list[dict]]:
+        """分页列出批次，最新的在前"""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM batches").fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT * FROM batches ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        """获取批次信息"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete_batch(self, batch_id: str) -> bool:
+        """删除批次及其全部识别结果"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+        return cursor.rowcount > 0
+
+    def referenced_files(self, url_prefix: str = "/uploads/") -> set[str]:
+        """识别结果引用的上传文件名（image_url 和PDF各页图片URL去掉前缀）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT image_url FROM results WHERE image_url >= ?1 AND image_url < ?2 "
+                "UNION SELECT page.value FROM results, json_each(results.page_image_urls) AS page "
+                "WHERE results.page_image_urls IS NOT NULL AND page.value >= ?1 AND page.value < ?2",
+                (url_prefix, url_prefix + "\U0010ffff"),
+            ).fetchall()
+        return {row[0][len(url_prefix):] for row in rows}
+
+    @staticmethod
+    def _filters(
+        result_ids: Optional[list[int]],
+        batch_ids: list[str],
+        date_from: Optional[str],
+        date_to: Optional[str],
+        voucher_no: Optional[str],
+        partner: Optional[str],
+        success: Optional[bool],
+        include_duplicates: bool,
+    ) -> tuple[str, list[Any]]:
+        """构造WHERE子句"""
+        clauses = []
+        params: list[Any] = []
+        # ID列表作为一个JSON参数传入，不受SQLite单条语句参数个数上限的限制
+        if result_ids is not None:
+            clauses.append("id IN (SELECT value FROM json_each(?))")
+            params.append(orjson.dumps(list(result_ids)).decode())
+        if batch_ids:
+            clauses.append("batch_id IN (SELECT value FROM json_each(?))")
+            params.append(orjson.dumps(list(batch_ids)).decode())
+        if date_from:
+            clauses.append("voucher_date >= ?")
+            params.append(normalize_date(date_from) or date_from)
+        if date_to:
+            clauses.append("voucher_date <= ?")
+            params.append(normalize_date(date_to) or date_to)
+        if voucher_no:
+            clauses.append("voucher_no = ?")
+            params.append(voucher_no.strip())
+        if partner:
+            # 前缀匹配可以利用 result_partners 的主键索引
+            clauses.append(
+                "id IN (SELECT result_id FROM result_partners WHERE partner_name >= ? AND partner_name < ?)"
+            )
+            prefix = partner.strip()
+            params += [prefix, prefix + "\U0010ffff"]
+        if success is not None:
+            clauses.append("success = ?")
+            params.append(1 if success else 0)
+        if not include_duplicates:
+            clauses.append("duplicate_of IS NULL")
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> dict:
+        """数据库行转换为接口返回的字典"""
+        data = dict(row)
+        data["success"] = bool(data["success"])
+        data["pages"] = orjson.loads(data["pages"]) if data.get("pages") else None
+        data["page_image_urls"] = orjson.loads(data["page_image_urls"]) if data.get("page_image_urls") else None
+        voucher_json = data.pop("voucher_json", None)
+        data["voucher_data"] = VoucherData.model_validate_json(voucher_json) if voucher_json else None
+        return data
@@ -0,0 +1,135 @@
+"""OCR文本规范化 - 发送给大模型前统一字符、金额和日期写法，去掉重复行和票据固定文字"""
+import hashlib
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+from .prompt_budget import NUMERIC_LINE_PATTERN, estimate_tokens
+
+# 默认去掉的固定文字（整行匹配，规范化字符之后再匹配）
+DEFAULT_BOILERPLATE = (
+    r"国家税务总局监制",
+    r"全国统一发票监制章?",
+    r"发票专用章",
+    r"第[一二三四五六]联.{0,12}",
+    r"(发票联|抵扣联|记账联)",
+    r"(购买方|销售方|购货方|销货方)(记账|扣税)凭证",
+    r"此联不作.{0,12}使用",
+    r"密码区",
+    # 增值税发票密码区的密文
+    r"(?=.*[<>*/+])[0-9<>+\-*/]{20,}",
+)
+
+AMOUNT_SEPARATOR_PATTERN = re.compile(r"(?<=\d),(?=\d{3}(?:\D|$))")
+CURRENCY_SPACE_PATTERN = re.compile(r"([¥$])\s+(?=\d)")
+DATE_PATTERN = re.compile(r"(?<!\d)(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*日?(?!\d)")
+
+
+@dataclass
+class NormalizedText:
+    """规范化结果"""
+    text: str
+    chars_before: int
+    chars_after: int
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def chars_saved(self) -> int:
+        return self.chars_before - self.chars_after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _canonical_date(match: re.Match) -> str:
+    year, month, day = (int(group) for group in match.groups())
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return match.group(0)
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+class TextNormalizer:
+    """
+    OCR文本规范化
+
+    依次：
+    1. NFKC 字符规范化（全角字母数字和标点转半角，如 ＡＢ１２３，（） -> AB123,()）
+    2. 合并行内连续空白，去掉空行
+    3. 金额去掉千分位和货币符号后的空格（¥ 1,234.50 -> ¥1234.50）
+    4. 日期统一为 YYYY-MM-DD（2024年1月5日、2024/1/5 -> 2024-01-05）
+    5. 去掉匹配固定文字的整行（监制章、联次说明、密码区等）
+    6. 去掉紧邻重复的文字行（OCR重复识别同一行），单字和纯数字/金额行保留（可能是不同分录的方向和金额）；
+       不相邻的重复行不去掉：多分录凭证中各分录的摘要、科目可能相同，去掉会把不同分录合并
+    同一内容的OCR结果规范化后相同，可以作为缓存键（见 cache_key）。
+    """
+
+    def __init__(self, boilerplate: Optional[Sequence[str]] = None):
+        """
+        Args:
+            boilerplate: 要去掉的固定文字（正则，整行匹配），默认 DEFAULT_BOILERPLATE
+        """
+        patterns = DEFAULT_BOILERPLATE if boilerplate is None else boilerplate
+        self._boilerplate = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+        self.documents = 0
+        self.chars_before = 0
+        self.chars_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def normalize_text(self, text: str) -> str:
+        """规范化文本（不计入统计）"""
+        text = unicodedata.normalize("NFKC", text)
+        lines = []
+        for line in text.splitlines():
+            line = " ".join(line.split())
+            if not line:
+                continue
+            line = AMOUNT_SEPARATOR_PATTERN.sub("", line)
+            line = CURRENCY_SPACE_PATTERN.sub(r"\1", line)
+            line = DATE_PATTERN.sub(_canonical_date, line)
+            if self._boilerplate is not None and self._boilerplate.fullmatch(line):
+                continue
+            if len(line) > 1 and not NUMERIC_LINE_PATTERN.match(line) and lines and lines[-1] == line:
+                continue
+            lines.append(line)
+        return "\n".join(lines)
+
+    def normalize(self, text: str, family: str = "default") -> NormalizedText:
+        """
+        规范化文本并统计节省的字符数和token数
+
+        Args:
+            family: 估算token数使用的模型系列
+        """
+        normalized = self.normalize_text(text)
+        result = NormalizedText(
+            text=normalized,
+            chars_before=len(text),
+            chars_after=len(normalized),
+            tokens_before=estimate_tokens(text, family),
+            tokens_after=estimate_tokens(normalized, family),
+        )
+        self.documents += 1
+        self.chars_before += result.chars_before
+        self.chars_after += result.chars_after
+        self.tokens_before += result.tokens_before
+        self.tokens_after += result.tokens_after
+        return result
+
+    def cache_key(self, text: str) -> str:
+        """规范化后文本的SHA-256，OCR结果只有空白、全半角等差异时得到相同的键"""
+        return hashlib.sha256(self.normalize_text(text).encode("utf-8")).hexdigest()
+
+    def snapshot(self) -> dict:
+        documents = self.documents or 1
+        return {
+            "documents": self.documents,
+            "chars_saved": self.chars_before - self.chars_after,
+            "tokens_saved": self.tokens_before - self.tokens_after,
+            "avg_chars_saved": round((self.chars_before - self.chars_after) / documents, 1),
+            "avg_tokens_saved": round((self.tokens_before - self.tokens_after) / documents, 1),
+            "char_reduction": round(1 - self.chars_after / self.chars_before, 4) if self.chars_before else 0.0,
+        }
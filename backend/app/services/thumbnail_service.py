@@ -0,0 +1,157 @@
+"""缩略图服务 - 为上传图片生成缩略图和中等预览图，按需生成并缓存到磁盘"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+# 派生图规格: 名称 -> 最长边像素
+VARIANTS = {
+    "thumb": 240,
+    "preview": 1280,
+}
+
+# 输出格式: 名称 -> (Pillow格式, 媒体类型, 保存参数)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 78, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# 生成算法变化时递增，使旧的缓存和ETag失效
+VERSION = 1
+
+
+class ThumbnailError(Exception):
+    """无法为该文件生成派生图"""
+
+
+@dataclass
+class Derivative:
+    """已生成的派生图"""
+    path: str
+    media_type: str
+    etag: str
+
+
+class ThumbnailService:
+    """
+    派生图服务
+
+    上传文件按内容哈希命名、内容不变，派生图按 (文件名, 规格, 格式) 生成一次后长期缓存；
+    图片解码和缩放在线程池中执行，同一派生图的并发请求只生成一次。
+    """
+
+    def __init__(self, upload_dir: str, cache_dir: str, max_workers: int = 2):
+        """
+        Args:
+            upload_dir: 原图所在的上传目录
+            cache_dir: 派生图缓存目录
+            max_workers: 生成派生图的线程数
+        """
+        self.upload_dir = upload_dir
+        self.cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self._pending: dict[str, asyncio.Future] = {}
+        self.generated = 0
+        self.hits = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_path(self, filename: str) -> str:
+        """原图路径（上传目录下的相对文件名，如 ab/ab12...ef.jpg，不允许 .. 等跳出上传目录）"""
+        parts = filename.split("/") if filename else []
+        if not parts or "\\" in filename or any(not part or part.startswith(".") for part in parts):
+            raise ThumbnailError(f"无效的文件名: {filename}")
+        path = os.path.join(self.upload_dir, *parts)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(filename)
+        return path
+
+    def _key(self, filename: str, variant: str, fmt: str) -> tuple[str, str]:
+        """缓存文件路径和ETag"""
+        # 重复上传会刷新原图修改时间，内容不变，不把修改时间计入键
+        size = os.path.getsize(self.source_path(filename))
+        digest = hashlib.sha256(f"{VERSION}:{filename}:{size}:{variant}:{fmt}".encode("utf-8")).hexdigest()[:32]
+        # 缓存文件名保留原图相对路径，原图删除后可据此清理
+        *subdirs, basename = filename.split("/")
+        path = os.path.join(self.cache_dir, variant, *subdirs, f"{basename}.{digest[:8]}.{fmt}")
+        return path, digest
+
+    async def get(self, filename: str, variant: str, fmt: str = "webp") -> Derivative:
+        """
+        获取派生图，不存在时生成
+
+        Raises:
+            ThumbnailError: 规格/格式无效，或原图无法解码
+            FileNotFoundError: 原图不存在
+        """
+        if variant not in VARIANTS:
+            raise ThumbnailError(f"不支持的规格: {variant}")
+        if fmt not in FORMATS:
+            raise ThumbnailError(f"不支持的格式: {fmt}")
+        path, etag = self._key(filename, variant, fmt)
+        media_type = FORMATS[fmt][1]
+        if os.path.exists(path):
+            self.hits += 1
+            return Derivative(path, media_type, etag)
+
+        future = self._pending.get(path)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, self._generate, self.source_path(filename), path, VARIANTS[variant], fmt
+            )
+            self._pending[path] = future
+            future.add_done_callback(lambda _: self._pending.pop(path, None))
+            self.generated += 1
+        await asyncio.shield(future)
+        return Derivative(path, media_type, etag)
+
+    @staticmethod
+    def _generate(source: str, path: str, max_side: int, fmt: str):
+        """解码原图、缩放并写入缓存（在线程池中执行）"""
+        pil_format, _, options = FORMATS[fmt]
+        try:
+            with Image.open(source) as img:
+                # JPEG可直接按目标尺寸降采样解码，大图时明显更快、更省内存
+                img.draft("RGB", (max_side, max_side))
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGBA" if fmt == "webp" and "A" in img.getbands() else "RGB")
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        img.save(f, pil_format, **options)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ThumbnailError(f"无法生成缩略图: {e}") from e
+
+    def prune(self) -> int:
+        """删除原图已不存在的派生图（同步方法），返回删除的文件数"""
+        removed = 0
+        for variant in VARIANTS:
+            variant_dir = os.path.join(self.cache_dir, variant)
+            for directory, _, filenames in os.walk(variant_dir):
+                for name in filenames:
+                    source = os.path.relpath(os.path.join(directory, name.rsplit(".", 2)[0]), variant_dir)
+                    if not os.path.exists(os.path.join(self.upload_dir, source)):
+                        try:
+                            os.unlink(os.path.join(directory, name))
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+        return removed
+
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "generated": self.generated, "pending": len(self._pending)}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
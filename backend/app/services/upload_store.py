@@ -0,0 +1,230 @@
+"""上传文件存储 - 按内容哈希命名并分目录存放，内容相同的上传只存一份，后台按引用和保留期清理"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 扩展名只保留字母数字，其余情况（含空扩展名）按图片处理
+EXT_PATTERN = re.compile(r"^\.[a-z0-9]{1,8}$")
+DEFAULT_EXT = ".jpg"
+
+URL_PREFIX = "/uploads/"
+
+# 按内容哈希保存的文件名：<哈希前2位>/<SHA-256><扩展名>
+NAME_PATTERN = re.compile(r"^([0-9a-f]{2})/\1[0-9a-f]{62}\.[a-z0-9]{1,8}$")
+
+
+def safe_ext(filename: Optional[str]) -> str:
+    """从原始文件名取扩展名（小写），不合法时返回 .jpg"""
+    ext = os.path.splitext(filename or "")[-1].lower()
+    return ext if EXT_PATTERN.match(ext) else DEFAULT_EXT
+
+
+class UploadStore:
+    """
+    内容寻址的上传文件存储
+
+    文件保存为 <根目录>/<哈希前2位>/<SHA-256><扩展名>，同一内容重复上传时只刷新修改时间。
+    垃圾回收只处理按内容哈希保存的文件（旧版本直接存放在根目录下的文件等不删除，只计入磁盘占用），按以下规则删除：
+    - 没有被任何识别结果引用，且超过 orphan_grace 秒未再上传（给进行中的识别留出保存结果的时间）
+    - retention_days > 0 时，超过保留天数未再上传的文件无论是否被引用都删除
+    """
+
+    def __init__(self, root: str, retention_days: int = 0, orphan_grace: float = 3600):
+        """
+        Args:
+            root: 上传根目录（同时作为 /uploads 静态目录）
+            retention_days: 保留天数，0表示被引用的文件一直保留
+            orphan_grace: 未被引用的文件保留的秒数
+        """
+        self.root = root
+        self.retention_days = retention_days
+        self.orphan_grace = orphan_grace
+        self._lock = threading.Lock()
+        self._gc_task: Optional[asyncio.Task] = None
+        self.saved = 0
+        self.deduplicated = 0
+        self.usage: dict = {"files": None, "bytes": None}
+        self.last_gc: dict = {}
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def name_for(digest: str, ext: str) -> str:
+        """内容哈希对应的相对文件名"""
+        return f"{digest[:2]}/{digest}{ext}"
+
+    @staticmethod
+    def url_for(name: str) -> str:
+        return URL_PREFIX + name
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    def save(self, data: bytes, ext: str = DEFAULT_EXT, digest: Optional[str] = None) -> str:
+        """
+        保存上传内容，返回相对文件名（如 ab/ab12...ef.jpg）
+
+        同步方法，写入的文件不大（受上传大小限制），与原有的保存方式一致直接调用。
+
+        Args:
+            ext: 扩展名（如 .png），不合法时使用 .jpg
+            digest: 已计算好的内容SHA-256，省去重复计算
+        """
+        digest = digest or hashlib.sha256(data).hexdigest()
+        ext = ext.lower() if EXT_PATTERN.match(ext.lower()) else DEFAULT_EXT
+        name = self.name_for(digest, ext)
+        path = self.path_for(name)
+        if self._touch(path):
+            self.deduplicated += 1
+            return name
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再原子替换，并发上传同一内容时不会读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.saved += 1
+        return name
+
+    def _touch(self, path: str) -> bool:
+        """已存在时刷新修改时间（保留期从最后一次上传算起），返回文件是否存在"""
+        with self._lock:
+            try:
+                os.utime(path)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def collect(self, referenced: Optional[set[str]] = None, now: Optional[float] = None) -> dict:
+        """
+        执行一次垃圾回收并统计磁盘占用
+
+        同步方法（遍历目录），在异步代码中应放到线程中执行。
+
+        Args:
+            referenced: 被识别结果引用的文件名；为None时引用情况未知，只按保留期清理
+
+        Returns:
+            本次回收统计
+        """
+        started = time.time()
+        now = started if now is None else now
+        retention = self.retention_days * 86400 if self.retention_days > 0 else None
+        files = total = removed = removed_bytes = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if not NAME_PATTERN.match(name):
+                    files += 1
+                    total += stat.st_size
+                    continue
+                age = now - stat.st_mtime
+                expired = retention is not None and age > retention
+                orphaned = referenced is not None and name not in referenced and age > self.orphan_grace
+                if (expired or orphaned) and self._remove(path, stat.st_mtime):
+                    removed += 1
+                    removed_bytes += stat.st_size
+                    continue
+                files += 1
+                total += stat.st_size
+            if directory != self.root and not os.listdir(directory):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+        self.usage = {"files": files, "bytes": total}
+        self.last_gc = {
+            "at": round(now, 3),
+            "removed_files": removed,
+            "removed_bytes": removed_bytes,
+            "duration": round(time.time() - started, 3),
+        }
+        return self.last_gc
+
+    def _remove(self, path: str, mtime: float) -> bool:
+        """删除文件；期间被重新上传（修改时间变化）的文件保留"""
+        with self._lock:
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+                os.unlink(path)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def start_gc(
+        self,
+        interval: float,
+        referenced: Callable[[], Optional[set[str]]],
+        after: Optional[Callable[[], None]] = None,
+    ):
+        """
+        启动后台垃圾回收
+
+        Args:
+            interval: 回收间隔（秒），不大于0时不启动
+            referenced: 获取被引用文件名的函数（在线程中调用）
+            after: 每次回收后调用（在线程中调用），如清理已删除文件的缩略图
+        """
+        if self._gc_task is None and interval > 0:
+            self._gc_task = asyncio.create_task(self._gc_loop(interval, referenced, after))
+
+    def stop_gc(self):
+        """停止后台垃圾回收"""
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            self._gc_task = None
+
+    async def _gc_loop(
+        self,
+        interval: float,
+        referenced: Callable[[], Optional[set[str]]],
+        after: Optional[Callable[[], None]],
+    ):
+        def run() -> dict:
+            stats = self.collect(referenced())
+            if after is not None:
+                after()
+            return stats
+
+        while True:
+            try:
+                stats = await asyncio.to_thread(run)
+                if stats["removed_files"]:
+                    logger.info(
+                        f"上传文件清理 - 删除 {stats['removed_files']} 个文件, 释放 {stats['removed_bytes']} bytes, "
+                        f"剩余 {self.usage['files']} 个文件 / {self.usage['bytes']} bytes"
+                    )
+            except Exception as e:
+                logger.error(f"上传文件清理异常: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.usage,
+            "saved": self.saved,
+            "deduplicated": self.deduplicated,
+            "retention_days": self.retention_days,
+            "last_gc": self.last_gc or None,
+        }
@@ -0,0 +1,275 @@
+"""用量记账 - 按天、按提供商/模型汇总大模型token和OCR计费调用次数，按日预算软/硬限额"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, kind, provider, model)
+) WITHOUT ROWID;
+"""
+
+LLM = "llm"
+OCR = "ocr"
+KINDS = (LLM, OCR)
+
+
+class BudgetExceeded(Exception):
+    """提供商当日用量已达到硬限额"""
+
+    def __init__(self, kind: str, key: str, used: int, limit: int):
+        self.kind = kind
+        self.key = key
+        self.used = used
+        self.limit = limit
+        unit = "tokens" if kind == LLM else "次调用"
+        super().__init__(f"{key} 今日用量已达上限（{used}/{limit} {unit}），请明天再试或调整预算")
+
+
+def parse_llm_usage(usage: Optional[dict]) -> tuple[int, int, int]:
+    """
+    从 chat/completions 响应的 usage 中取 (prompt, completion, cached) tokens
+
+    缓存命中的token各家字段不同：OpenAI/豆包/OpenRouter 为 prompt_tokens_details.cached_tokens，
+    DeepSeek 为 prompt_cache_hit_tokens，Kimi 为 cached_tokens。
+    """
+    if not isinstance(usage, dict):
+        return 0, 0, 0
+    details = usage.get("prompt_tokens_details") or {}
+    cached = (
+        details.get("cached_tokens")
+        or usage.get("prompt_cache_hit_tokens")
+        or usage.get("cached_tokens")
+        or 0
+    )
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), int(cached)
+
+
+def endpoint_label(url: str) -> str:
+    """OCR端点的记账名称：接口路径最后一段（如 multiple_invoice），没有路径时用域名"""
+    parsed = urlparse(url if "://" in url else f"https://{url}")
+    path = parsed.path.rstrip("/")
+    return path.rsplit("/", 1)[-1] if path else parsed.netloc
+
+
+class UsageStore:
+    """
+    用量记账仓库
+
+    每 (日期, 类型, 提供商, 模型/端点) 一行，调用结束时累加。
+    预算按 "提供商" 或 "提供商/模型"（OCR为 "提供商/端点"）配置每日上限：
+    大模型按 prompt+completion tokens 计，OCR按计费调用次数计；
+    达到 soft_ratio × 上限时记录告警，达到上限时调用前抛出 BudgetExceeded。
+    sqlite3 是同步接口，在异步代码中应通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        llm_budgets: Optional[dict[str, int]] = None,
+        ocr_budgets: Optional[dict[str, int]] = None,
+        soft_ratio: float = 0.8,
+        llm_prices: Optional[dict[str, dict[str, float]]] = None,
+        ocr_prices: Optional[dict[str, float]] = None,
+    ):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            llm_budgets: 大模型每日token上限，键为 provider 或 provider/model
+            ocr_budgets: OCR每日计费调用次数上限，键为 provider 或 provider/端点
+            soft_ratio: 软限额占上限的比例
+            llm_prices: 大模型单价（元/百万tokens），如 {"deepseek": {"prompt": 2, "completion": 8, "cached": 0.5}}
+            ocr_prices: OCR单价（元/次），键同 ocr_budgets
+        """
+        self.db_path = db_path
+        self.budgets = {LLM: dict(llm_budgets or {}), OCR: dict(ocr_budgets or {})}
+        self.soft_ratio = soft_ratio
+        self.llm_prices = dict(llm_prices or {})
+        self.ocr_prices = dict(ocr_prices or {})
+        self.rejected = 0
+        # 已告警过的 (日期, 类型, 预算键)，每天每个预算只告警一次
+        self._warned: set[tuple[str, str, str]] = set()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(
+        self,
+        kind: str,
+        provider: str,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+        calls: int = 1,
+    ):
+        """累加一次调用的用量"""
+        day = date.today().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO usage_daily (day, kind, provider, model, calls, prompt_tokens, completion_tokens, cached_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, kind, provider, model) DO UPDATE SET "
+                "calls = calls + excluded.calls, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "cached_tokens = cached_tokens + excluded.cached_tokens",
+                (day, kind, provider, model or "", calls, prompt_tokens, completion_tokens, cached_tokens),
+            )
+        self._warn_soft_limits(day, kind, provider, model or "")
+
+    def check(self, kind: str, provider: str, model: str):
+        """
+        调用前检查预算
+
+        Raises:
+            BudgetExceeded: 任一适用的预算当日已用完
+        """
+        day = date.today().isoformat()
+        for key, limit, used in self._applicable(day, kind, provider, model or ""):
+            if used >= limit:
+                self.rejected += 1
+                raise BudgetExceeded(kind, key, used, limit)
+
+    def _applicable(self, day: str, kind: str, provider: str, model: str) -> list[tuple[str, int, int]]:
+        """适用于该提供商/模型的预算：[(预算键, 上限, 当日已用)]"""
+        result = []
+        for key, limit in self.budgets[kind].items():
+            if key == provider:
+                used = self._used(day, kind, provider)
+            elif key == f"{provider}/{model}":
+                used = self._used(day, kind, provider, model)
+            else:
+                continue
+            result.append((key, limit, used))
+        return result
+
+    def _used(self, day: str, kind: str, provider: str, model: Optional[str] = None) -> int:
+        """当日已用量：大模型为 prompt+completion tokens，OCR为调用次数"""
+        measure = "prompt_tokens + completion_tokens" if kind == LLM else "calls"
+        sql = f"SELECT COALESCE(SUM({measure}), 0) FROM usage_daily WHERE day = ? AND kind = ? AND provider = ?"
+        params = [day, kind, provider]
+        if model is not None:
+            sql += " AND model = ?"
+            params.append(model)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def _warn_soft_limits(self, day: str, kind: str, provider: str, model: str):
+        for key, limit, used in self._applicable(day, kind, provider, model):
+            warned = (day, kind, key)
+            if used >= limit * self.soft_ratio and warned not in self._warned:
+                self._warned.add(warned)
+                logger.warning(f"用量预算告警 - {kind} {key}: 今日已用 {used}/{limit}")
+
+    def _price(self, prices: dict, provider: str, model: str):
+        return prices.get(f"{provider}/{model}", prices.get(provider))
+
+    def _cost(self, row: dict) -> Optional[float]:
+        """按单价估算费用（元），未配置单价时为None"""
+        if row["kind"] == OCR:
+            price = self._price(self.ocr_prices, row["provider"], row["model"])
+            return round(row["calls"] * price, 4) if price is not None else None
+        price = self._price(self.llm_prices, row["provider"], row["model"])
+        if price is None:
+            return None
+        cached = row["cached_tokens"]
+        cost = (
+            (row["prompt_tokens"] - cached) * price.get("prompt", 0)
+            + cached * price.get("cached", price.get("prompt", 0))
+            + row["completion_tokens"] * price.get("completion", 0)
+        ) / 1_000_000
+        return round(cost, 4)
+
+    def daily(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        kind: Optional[str] = None,
+        provider: Optional[str] = None,
+    ) -> list[dict]:
+        """按天、提供商/模型汇总的用量（日期为 YYYY-MM-DD，含首尾）"""
+        sql = (
+            "SELECT day, kind, provider, model, calls, prompt_tokens, completion_tokens, cached_tokens "
+            "FROM usage_daily WHERE 1 = 1"
+        )
+        params = []
+        for column, op, value in (("day", ">=", start), ("day", "<=", end), ("kind", "=", kind), ("provider", "=", provider)):
+            if value:
+                sql += f" AND {column} {op} ?"
+                params.append(value)
+        sql += " ORDER BY day DESC, kind, provider, model"
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row["cost"] = self._cost(row)
+        return rows
+
+    def budgets_status(self) -> list[dict]:
+        """各预算当日的用量和状态（ok / soft_limit / exhausted）"""
+        day = date.today().isoformat()
+        result = []
+        for kind, budgets in self.budgets.items():
+            for key, limit in budgets.items():
+                provider, _, model = key.partition("/")
+                used = self._used(day, kind, provider, model or None)
+                if used >= limit:
+                    state = "exhausted"
+                elif used >= limit * self.soft_ratio:
+                    state = "soft_limit"
+                else:
+                    state = "ok"
+                result.append({
+                    "kind": kind,
+                    "key": key,
+                    "limit": limit,
+                    "soft_limit": int(limit * self.soft_ratio),
+                    "used": used,
+                    "remaining": max(0, limit - used),
+                    "state": state,
+                })
+        return result
+
+    def snapshot(self) -> dict:
+        """当日用量合计和预算状态"""
+        today = self.daily(start=date.today().isoformat())
+        totals = {}
+        for kind in KINDS:
+            rows = [row for row in today if row["kind"] == kind]
+            costs = [row["cost"] for row in rows if row["cost"] is not None]
+            totals[kind] = {
+                "calls": sum(row["calls"] for row in rows),
+                "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+                "completion_tokens": sum(row["completion_tokens"] for row in rows),
+                "cached_tokens": sum(row["cached_tokens"] for row in rows),
+                "cost": round(sum(costs), 4) if costs else None,
+            }
+        return {
+            "today": totals,
+            "budgets": self.budgets_status(),
+            "rejected": self.rejected,
+        }
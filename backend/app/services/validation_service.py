@@ -0,0 +1,185 @@
+"""凭证校验服务 - 以列式数组对整批凭证做借贷平衡、金额、日期、方向和科目检查"""
+from dataclasses import dataclass
+from typing import Sequence, Union
+
+import numpy as np
+
+from ..data import ACCOUNTING_SUBJECTS
+from .voucher_table import EntryTable, Voucher, as_str_array, voucher_column
+
+
+# 校验项（按位组合为每张凭证的标记）
+NO_ENTRIES = 1 << 0
+UNBALANCED = 1 << 1
+BAD_AMOUNT = 1 << 2
+BAD_DIRECTION = 1 << 3
+BAD_DATE = 1 << 4
+UNKNOWN_SUBJECT = 1 << 5
+SUBJECT_NAME_MISMATCH = 1 << 6
+
+ISSUE_NAMES = {
+    NO_ENTRIES: "no_entries",
+    UNBALANCED: "unbalanced",
+    BAD_AMOUNT: "bad_amount",
+    BAD_DIRECTION: "bad_direction",
+    BAD_DATE: "bad_date",
+    UNKNOWN_SUBJECT: "unknown_subject",
+    SUBJECT_NAME_MISMATCH: "subject_name_mismatch",
+}
+
+DEBIT_VALUES = ["借", "借方", "debit", "Debit", "DEBIT", "D"]
+CREDIT_VALUES = ["贷", "贷方", "credit", "Credit", "CREDIT", "C"]
+
+# 借贷差额容差（分以下视为平衡）
+BALANCE_TOLERANCE = 0.005
+
+_SUBJECT_CODES = np.array(sorted(ACCOUNTING_SUBJECTS), dtype=str)
+_SUBJECT_NAMES = np.array([ACCOUNTING_SUBJECTS[code] for code in _SUBJECT_CODES], dtype=str)
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+@dataclass
+class VoucherCheck:
+    """单张凭证的校验结果"""
+    flags: int
+    issues: list[str]  # 问题说明（中文）
+    codes: list[str]  # 问题代码，见 ISSUE_NAMES
+    debit_total: float
+    credit_total: float
+
+    @property
+    def valid(self) -> bool:
+        return self.flags == 0
+
+
+@dataclass
+class BatchValidation:
+    """整批校验结果（列式，每个数组长度为凭证数）"""
+    flags: np.ndarray
+    debit_total: np.ndarray
+    credit_total: np.ndarray
+    entry_count: np.ndarray
+    bad_amount_count: np.ndarray
+    bad_direction_count: np.ndarray
+    unknown_subject_count: np.ndarray
+    name_mismatch_count: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    @property
+    def invalid_count(self) -> int:
+        return int(np.count_nonzero(self.flags))
+
+    def check(self, index: int) -> VoucherCheck:
+        """生成第 index 张凭证的校验结果"""
+        flags = int(self.flags[index])
+        debit = round(float(self.debit_total[index]), 2)
+        credit = round(float(self.credit_total[index]), 2)
+        issues = []
+        if flags & NO_ENTRIES:
+            issues.append("没有分录")
+        if flags & UNBALANCED:
+            issues.append(f"借贷不平衡：借方 {debit:.2f}，贷方 {credit:.2f}，差额 {debit - credit:.2f}")
+        if flags & BAD_AMOUNT:
+            issues.append(f"{self.bad_amount_count[index]} 条分录金额无效（无法解析或不大于0）")
+        if flags & BAD_DIRECTION:
+            issues.append(f"{self.bad_direction_count[index]} 条分录借贷方向不是「借」或「贷」")
+        if flags & BAD_DATE:
+            issues.append("编制日期不是有效的 YYYY-MM-DD 日期")
+        if flags & UNKNOWN_SUBJECT:
+            issues.append(f"{self.unknown_subject_count[index]} 条分录科目编码不在科目表中")
+        if flags & SUBJECT_NAME_MISMATCH:
+            issues.append(f"{self.name_mismatch_count[index]} 条分录科目名称与编码不一致")
+        return VoucherCheck(
+            flags=flags,
+            issues=issues,
+            codes=[name for bit, name in ISSUE_NAMES.items() if flags & bit],
+            debit_total=debit,
+            credit_total=credit,
+        )
+
+    def checks(self) -> list[VoucherCheck]:
+        return [self.check(index) for index in range(len(self))]
+
+
+def valid_dates(values: Union[list, np.ndarray]) -> np.ndarray:
+    """批量检查 YYYY-MM-DD 日期（含月份天数和闰年）"""
+    text = values if isinstance(values, np.ndarray) else as_str_array(values)
+    if not text.size:
+        return np.zeros(0, dtype=bool)
+    shaped = np.char.str_len(text) == 10
+    # 每个日期拆成10个字符的二维数组，按位置检查分隔符和数字
+    chars = np.where(shaped, text, "0000-00-00").astype("U10").view("U1").reshape(-1, 10)
+    # 只接受ASCII数字（全角数字 isdigit 也为真）
+    is_digit = (chars >= "0") & (chars <= "9") & (chars != "")
+    digit_cols = [0, 1, 2, 3, 5, 6, 8, 9]
+    well_formed = (
+        shaped
+        & (chars[:, 4] == "-")
+        & (chars[:, 7] == "-")
+        & is_digit[:, digit_cols].all(axis=1)
+    )
+    numbers = np.where(is_digit, chars, "0").astype(np.int64)
+    year = numbers[:, 0] * 1000 + numbers[:, 1] * 100 + numbers[:, 2] * 10 + numbers[:, 3]
+    month = numbers[:, 5] * 10 + numbers[:, 6]
+    day = numbers[:, 8] * 10 + numbers[:, 9]
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    month_ok = (month >= 1) & (month <= 12)
+    max_day = _DAYS_IN_MONTH[np.clip(month, 0, 12)] + ((month == 2) & leap)
+    return well_formed & (year >= 1900) & month_ok & (day >= 1) & (day <= max_day)
+
+
+def validate_vouchers(vouchers: Sequence[Voucher]) -> BatchValidation:
+    """
+    校验一批凭证（VoucherData 或客户端提交的原始字典）
+
+    分录展开为列式表后一次性完成所有检查，按凭证下标用 bincount 汇总，
+    不对分录逐条做Python判断。为None的凭证按“没有分录”处理。
+    """
+    table = EntryTable.from_vouchers(vouchers)
+    count = table.voucher_count
+    entry_count = table.entry_counts()
+    amounts, codes, names = table.amount, table.subject_code, table.subject_name
+
+    is_debit = np.isin(table.direction, DEBIT_VALUES)
+    is_credit = np.isin(table.direction, CREDIT_VALUES)
+    amount_ok = np.isfinite(amounts) & (amounts > 0)
+    debit_total = table.sum_by_voucher(amounts, is_debit & amount_ok)
+    credit_total = table.sum_by_voucher(amounts, is_credit & amount_ok)
+
+    # 科目：完全匹配科目表，或前4位是一级科目的明细科目（如 100201）
+    position = np.searchsorted(_SUBJECT_CODES, codes) if codes.size else np.zeros(0, dtype=np.int64)
+    position = np.clip(position, 0, len(_SUBJECT_CODES) - 1)
+    exact = _SUBJECT_CODES[position] == codes if codes.size else np.zeros(0, dtype=bool)
+    prefix = codes.astype("U4") if codes.size else codes
+    detail = (np.char.str_len(codes) > 4) & np.char.isdigit(codes) & np.isin(prefix, _SUBJECT_CODES)
+    known = exact | detail
+    name_mismatch = exact & (names != "") & (names != _SUBJECT_NAMES[position])
+
+    bad_amount_count = table.count_by_voucher(~amount_ok)
+    bad_direction_count = table.count_by_voucher(~(is_debit | is_credit))
+    unknown_subject_count = table.count_by_voucher(~known)
+    name_mismatch_count = table.count_by_voucher(name_mismatch)
+
+    dates_ok = valid_dates(voucher_column(vouchers, "voucher_date"))
+
+    flags = np.zeros(count, dtype=np.int64)
+    flags |= np.where(entry_count == 0, NO_ENTRIES, 0)
+    flags |= np.where((entry_count > 0) & (np.abs(debit_total - credit_total) > BALANCE_TOLERANCE), UNBALANCED, 0)
+    flags |= np.where(bad_amount_count > 0, BAD_AMOUNT, 0)
+    flags |= np.where(bad_direction_count > 0, BAD_DIRECTION, 0)
+    flags |= np.where(~dates_ok, BAD_DATE, 0)
+    flags |= np.where(unknown_subject_count > 0, UNKNOWN_SUBJECT, 0)
+    flags |= np.where(name_mismatch_count > 0, SUBJECT_NAME_MISMATCH, 0)
+
+    return BatchValidation(
+        flags=flags,
+        debit_total=debit_total,
+        credit_total=credit_total,
+        entry_count=entry_count,
+        bad_amount_count=bad_amount_count,
+        bad_direction_count=bad_direction_count,
+        unknown_subject_count=unknown_subject_count,
+        name_mismatch_count=name_mismatch_count,
+    )
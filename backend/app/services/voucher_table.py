@@ -0,0 +1,124 @@
+"""凭证分录列式表 - 把一批凭证的分录按列展开为数组，供整批校验、汇总做向量运算"""
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence, Union
+
+import numpy as np
+
+from ..models import VoucherData
+
+Voucher = Union[VoucherData, dict, None]
+
+# 金额中允许出现、解析前去掉的字符
+AMOUNT_NOISE = [",", "，", "¥", "￥", "元", " "]
+
+# 删除ASCII数字的转换表：删除后为空即只含 0-9
+# （str.isdigit 对 ²、① 等Unicode数字也返回True，但 float() 无法转换）
+ASCII_DIGITS = str.maketrans("", "", "0123456789")
+
+
+def _field(item: Any, name: str) -> Any:
+    """读取 VoucherData/VoucherEntry 的属性或字典的键"""
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+def _entries(voucher: Voucher) -> list:
+    """凭证的分录列表（字典中只有一条分录时可能不是数组）"""
+    if voucher is None:
+        return []
+    if isinstance(voucher, VoucherData):
+        return voucher.entries
+    entries = voucher.get("entries") or []
+    if isinstance(entries, dict):
+        entries = [entries]
+    return [entry if isinstance(entry, dict) else {} for entry in entries]
+
+
+def as_str_array(values: list) -> np.ndarray:
+    """转换为去掉首尾空白的字符串数组（None 视为空字符串）"""
+    array = np.array(["" if value is None else str(value) for value in values], dtype=str)
+    return np.char.strip(array) if array.size else array
+
+
+def parse_amounts(values: list) -> np.ndarray:
+    """
+    批量解析金额：去掉千分位和货币符号后转换为浮点数，无法解析的为 NaN
+
+    只接受 [+-] ASCII数字 [. ASCII数字] 形式的十进制金额；科学计数法（如 1e5）、
+    全角或上标等非ASCII数字视为无效金额（凭证金额不会这样书写，多半是识别错误）。
+    只用 numpy 的字符串向量运算判断格式，不逐个 try/except。
+    """
+    if not values:
+        return np.zeros(0)
+    text = as_str_array(values)
+    for noise in AMOUNT_NOISE:
+        text = np.char.replace(text, noise, "")
+    unsigned = np.char.lstrip(text, "-+")
+    # 只允许一个正负号
+    signs = np.char.str_len(text) - np.char.str_len(unsigned)
+    digits = np.char.replace(unsigned, ".", "", count=1)
+    valid = (
+        (signs <= 1)
+        & (np.char.str_len(digits) > 0)
+        & (np.char.str_len(np.char.translate(digits, ASCII_DIGITS)) == 0)
+    )
+    return np.where(valid, text, "nan").astype(float)
+
+
+def voucher_column(vouchers: Sequence[Voucher], name: str) -> np.ndarray:
+    """凭证级字段（如 voucher_date）的字符串数组"""
+    return as_str_array([None if voucher is None else _field(voucher, name) for voucher in vouchers])
+
+
+@dataclass(slots=True)
+class EntryTable:
+    """
+    一批凭证的分录列式表
+
+    每个数组长度为分录总数，owner 为分录所属凭证的下标，
+    按凭证汇总时用 bincount 一次完成，不逐条访问分录对象。
+    """
+    voucher_count: int
+    owner: np.ndarray
+    amount: np.ndarray  # 无法解析的金额为 NaN
+    direction: np.ndarray
+    subject_code: np.ndarray
+    subject_name: np.ndarray
+
+    @classmethod
+    def from_vouchers(cls, vouchers: Sequence[Voucher]) -> "EntryTable":
+        """从 VoucherData（或客户端提交的原始字典）构建，两者可以混用"""
+        entry_lists = [_entries(voucher) for voucher in vouchers]
+        counts = np.array([len(entries) for entries in entry_lists], dtype=np.int64)
+        entries = [entry for entry_list in entry_lists for entry in entry_list]
+        if all(isinstance(voucher, VoucherData) for voucher in vouchers):
+            # 已校验的凭证金额都是数值，无需再解析字符串
+            amount = np.fromiter((entry.amount for entry in entries), dtype=float, count=len(entries))
+        else:
+            amount = parse_amounts([_field(entry, "amount") for entry in entries])
+        return cls(
+            voucher_count=len(vouchers),
+            owner=np.repeat(np.arange(len(vouchers)), counts),
+            amount=amount,
+            direction=as_str_array([_field(entry, "direction") for entry in entries]),
+            subject_code=as_str_array([_field(entry, "subject_code") for entry in entries]),
+            subject_name=as_str_array([_field(entry, "subject_name") for entry in entries]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.owner)
+
+    def entry_counts(self) -> np.ndarray:
+        """每张凭证的分录数"""
+        return np.bincount(self.owner, minlength=self.voucher_count).astype(np.int64)
+
+    def count_by_voucher(self, mask: np.ndarray) -> np.ndarray:
+        """每张凭证中满足 mask 的分录数"""
+        return np.bincount(self.owner, weights=mask, minlength=self.voucher_count).astype(np.int64)
+
+    def sum_by_voucher(self, values: np.ndarray, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """按凭证汇总 values（只计满足 mask 的分录）"""
+        if mask is not None:
+            values = np.where(mask, values, 0.0)
+        return np.bincount(self.owner, weights=values, minlength=self.voucher_count)
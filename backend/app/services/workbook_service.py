@@ -0,0 +1,508 @@
+"""工作簿服务 - 向已有的凭证Excel追加行（流式改写，不重写已有单元格）"""
+import math
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# 接收起始凭证序号，产出 (凭证序号, 该凭证的行数据列表)
+RowsForSeq = Callable[[int], Iterable[tuple[int, list[dict]]]]
+
+SEQ_HEADER = "凭证序号"
+DEFAULT_SHEET_TITLE = "财务凭证"
+COPY_CHUNK_SIZE = 256 * 1024
+
+CELL_REF_PATTERN = re.compile(r"([A-Z]+)(\d+)")
+SHEET_DATA_OPEN = re.compile(rb"<(\w+:)?sheetData(\s[^>]*)?(/?)>")
+NAMESPACE_DECL_PATTERN = re.compile(rb'xmlns(?::\w+)?="[^"]*"')
+DIMENSION_PATTERN = re.compile(rb'(<(?:\w+:)?dimension\s+ref=")([^"]*)(")')
+WORKBOOK_NAME_PATTERN = re.compile(r"^[\w\-.()（）一-鿿 ]{1,100}$")
+
+# 损坏的xlsx在解压、解析XML时抛出的各类异常，统一转换为 WorkbookError
+CORRUPT_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, KeyError, ET.ParseError, ValueError)
+
+
+class WorkbookError(Exception):
+    """工作簿无法追加"""
+
+
+@dataclass
+class AppendSummary:
+    """一次追加的结果"""
+    rows_added: int
+    voucher_count: int
+    first_seq: Optional[int]  # 新增凭证的起始凭证序号（没有追加凭证时为None）
+    last_seq: Optional[int]
+    last_row: int  # 追加后的最后一行行号
+
+
+@dataclass
+class _SheetScan:
+    """扫描已有工作表得到的信息"""
+    columns: dict[str, str]  # 表头 -> 列字母
+    last_row: int
+    last_seq: int
+    styles: dict[str, str]  # 列字母 -> 最后一行数据的样式ID（新行沿用）
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _resolve_sheet_path(archive: zipfile.ZipFile, sheet_title: str) -> str:
+    """根据 workbook.xml 和关系文件找到工作表XML路径（优先按标题，否则取第一个工作表）"""
+    try:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    except KeyError:
+        raise WorkbookError("不是有效的Excel工作簿（xlsx）")
+
+    sheets = workbook.findall(f"{{{MAIN_NS}}}sheets/{{{MAIN_NS}}}sheet")
+    if not sheets:
+        raise WorkbookError("工作簿中没有工作表")
+    sheet = next((item for item in sheets if item.get("name") == sheet_title), sheets[0])
+    rel_id = sheet.get(f"{{{REL_NS}}}id")
+    for rel in rels.findall(f"{{{PKG_REL_NS}}}Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join("xl", target))
+    raise WorkbookError("找不到工作表数据")
+
+
+def _shared_strings(archive: zipfile.ZipFile, indexes: set[int]) -> dict[int, str]:
+    """只读取需要的共享字符串（流式解析，读到最大下标即停止）"""
+    if not indexes or "xl/sharedStrings.xml" not in archive.namelist():
+        return {}
+    found: dict[int, str] = {}
+    last = max(indexes)
+    index = -1
+    with archive.open("xl/sharedStrings.xml") as stream:
+        for _, elem in ET.iterparse(stream, events=("end",)):
+            if _local(elem.tag) != "si":
+                continue
+            index += 1
+            if index in indexes:
+                found[index] = "".join(node.text or "" for node in elem.iter(f"{{{MAIN_NS}}}t"))
+            elem.clear()
+            if index >= last:
+                break
+    return found
+
+
+def _cell_text(cell: ET.Element) -> Optional[str]:
+    """单元格的原始值（共享字符串返回下标字符串）"""
+    if cell.get("t") == "inlineStr":
+        return "".join(node.text or "" for node in cell.iter(f"{{{MAIN_NS}}}t"))
+    value = cell.find(f"{{{MAIN_NS}}}v")
+    return value.text if value is not None else None
+
+
+def _read_header(archive: zipfile.ZipFile, sheet_path: str) -> tuple[int, dict[str, str]]:
+    """读取第一行非空行作为表头，读到即停止。返回 (表头行号, {表头: 列字母})"""
+    with archive.open(sheet_path) as stream:
+        row_number = 0
+        for _, elem in ET.iterparse(stream, events=("end",)):
+            if _local(elem.tag) != "row":
+                continue
+            row_number = int(elem.get("r") or row_number + 1)
+            cells = _row_cells(elem)
+            if not cells:
+                continue
+            shared = {col: int(_cell_text(cell)) for col, cell in cells.items()
+                      if cell.get("t") == "s" and _cell_text(cell) is not None}
+            strings = _shared_strings(archive, set(shared.values()))
+            columns = {}
+            for col, cell in cells.items():
+                text = strings.get(shared[col]) if col in shared else _cell_text(cell)
+                if text:
+                    columns[text.strip()] = col
+            return row_number, columns
+    raise WorkbookError("工作表为空，缺少表头")
+
+
+def _row_cells(row: ET.Element) -> dict[str, ET.Element]:
+    """行内单元格 {列字母: 单元格}（兼容省略 r 属性的单元格）"""
+    cells: dict[str, ET.Element] = {}
+    col_number = 0
+    for cell in row.findall(f"{{{MAIN_NS}}}c"):
+        match = CELL_REF_PATTERN.fullmatch(cell.get("r") or "")
+        col_number = column_index_from_string(match.group(1)) if match else col_number + 1
+        cells[get_column_letter(col_number)] = cell
+    return cells
+
+
+def _max_seq(pattern: re.Pattern, data: bytes) -> int:
+    """提取凭证序号列中的最大数值（跳过共享字符串单元格）"""
+    result = 0
+    for attrs, value in pattern.findall(data):
+        if b't="s"' in attrs:
+            continue
+        try:
+            result = max(result, int(float(value)))
+        except ValueError:
+            pass
+    return result
+
+
+def _scan_sheet(archive: zipfile.ZipFile, sheet_path: str) -> _SheetScan:
+    """
+    扫描工作表：表头、最后一行行号、最大凭证序号和最后一行的样式
+
+    表头和最后一行用XML解析，中间的行只在原始字节上用正则提取凭证序号列的数值，
+    按块流式处理，内存占用与工作表行数无关。
+    """
+    header_row, columns = _read_header(archive, sheet_path)
+    seq_col = columns.get(SEQ_HEADER)
+    if seq_col is None:
+        raise WorkbookError(f"工作表表头中没有「{SEQ_HEADER}」列，不是本系统导出的凭证表")
+
+    with archive.open(sheet_path) as stream:
+        head = b""
+        while not (match := SHEET_DATA_OPEN.search(head)):
+            chunk = stream.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                raise WorkbookError("工作表缺少 sheetData")
+            head += chunk
+        prefix = re.escape(match.group(1) or b"")
+        namespaces = dict.fromkeys(NAMESPACE_DECL_PATTERN.findall(head[:match.start()]))
+        row_open = re.compile(b"<" + prefix + rb"row[\s>]")
+        seq_value = re.compile(
+            b"<" + prefix + b"c r=\"" + seq_col.encode() + rb'\d+"([^>]*)>\s*<' + prefix + rb"v>([^<]*)<"
+        )
+        closing = b"</" + (match.group(1) or b"") + b"sheetData>"
+
+        last_seq = 0
+        row_count = 0
+        buffer = head[match.end():]
+        while True:
+            end = buffer.find(closing)
+            if end >= 0:
+                buffer = buffer[:end]
+            # 最后一个 <row 之前都是完整的行，直接在字节上提取凭证序号；最后一行留到下一块
+            starts = [found.start() for found in row_open.finditer(buffer)]
+            cut = starts[-1] if starts else 0
+            last_seq = max(last_seq, _max_seq(seq_value, buffer[:cut]))
+            row_count += max(0, len(starts) - 1)
+            buffer = buffer[cut:]
+            if end >= 0:
+                break
+            chunk = stream.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                raise WorkbookError("工作表XML不完整")
+            buffer += chunk
+        last_seq = max(last_seq, _max_seq(seq_value, buffer))
+        row_count += 1
+
+    # 解析最后一行（加上工作表根元素的命名空间声明）
+    last_open = None
+    for last_open in row_open.finditer(buffer):
+        pass
+    if last_open is None:
+        return _SheetScan(columns=columns, last_row=header_row, last_seq=last_seq, styles={})
+    wrapper = b"<root " + b" ".join(namespaces) + b">" + buffer[last_open.start():] + b"</root>"
+    try:
+        last = next(iter(ET.fromstring(wrapper)))
+    except (ET.ParseError, StopIteration):
+        raise WorkbookError("无法解析工作表最后一行")
+    last_row = int(last.get("r") or row_count)
+    if last_row <= header_row:
+        return _SheetScan(columns=columns, last_row=header_row, last_seq=last_seq, styles={})
+    styles = {col: cell.get("s") for col, cell in _row_cells(last).items() if cell.get("s")}
+    return _SheetScan(columns=columns, last_row=last_row, last_seq=last_seq, styles=styles)
+
+
+def _cell_xml(prefix: str, ref: str, value, style: Optional[str]) -> str:
+    """生成单元格XML（字符串使用内联字符串，不修改共享字符串表）"""
+    style_attr = f' s="{style}"' if style else ""
+    if value is None or value == "":
+        return f'<{prefix}c r="{ref}"{style_attr}/>' if style else ""
+    if isinstance(value, bool):
+        return f'<{prefix}c r="{ref}"{style_attr} t="b"><{prefix}v>{int(value)}</{prefix}v></{prefix}c>'
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return f'<{prefix}c r="{ref}"{style_attr}><{prefix}v>{value!r}</{prefix}v></{prefix}c>'
+    text = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return (
+        f'<{prefix}c r="{ref}"{style_attr} t="inlineStr"><{prefix}is>'
+        f'<{prefix}t{space}>{escape(text)}</{prefix}t></{prefix}is></{prefix}c>'
+    )
+
+
+def _rows_xml(prefix: str, rows: list[dict], scan: _SheetScan) -> str:
+    """生成追加行的XML"""
+    columns = sorted(scan.columns.items(), key=lambda item: column_index_from_string(item[1]))
+    parts = []
+    for offset, row_data in enumerate(rows, 1):
+        row_number = scan.last_row + offset
+        cells = "".join(
+            _cell_xml(prefix, f"{col}{row_number}", row_data.get(header), scan.styles.get(col))
+            for header, col in columns
+        )
+        parts.append(f'<{prefix}row r="{row_number}">{cells}</{prefix}row>')
+    return "".join(parts)
+
+
+def _rewrite_sheet(src, dst, rows_xml: bytes, last_row: int):
+    """
+    流式复制工作表XML，更新 dimension 并在 </sheetData> 前插入新行
+
+    只缓冲到 <sheetData> 开始标签为止的文件头，之后按块转发，
+    保留一小段尾部以识别跨块的结束标签。
+    """
+    head = b""
+    while True:
+        match = SHEET_DATA_OPEN.search(head)
+        if match:
+            break
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            raise WorkbookError("工作表缺少 sheetData")
+        head += chunk
+
+    def update_dimension(found: re.Match) -> bytes:
+        start, _, end = found.group(2).partition(b":")
+        end_col = CELL_REF_PATTERN.match(end.decode()) if end else None
+        end_ref = f"{end_col.group(1) if end_col else 'A'}{last_row}".encode()
+        return found.group(1) + start + b":" + end_ref + found.group(3)
+
+    prefix = match.group(1) or b""
+    before = DIMENSION_PATTERN.sub(update_dimension, head[:match.start()], count=1)
+    if match.group(3) == b"/":
+        # 空的 <sheetData/>
+        dst.write(before + b"<" + prefix + b"sheetData" + (match.group(2) or b"") + b">")
+        dst.write(rows_xml + b"</" + prefix + b"sheetData>")
+        dst.write(head[match.end():])
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        return
+
+    dst.write(before + head[match.start():match.end()])
+    closing = b"</" + prefix + b"sheetData>"
+    buffer = head[match.end():]
+    while True:
+        position = buffer.find(closing)
+        if position >= 0:
+            dst.write(buffer[:position] + rows_xml + buffer[position:])
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            return
+        keep = len(closing) - 1
+        dst.write(buffer[:-keep])
+        buffer = buffer[-keep:]
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            raise WorkbookError("工作表XML不完整")
+        buffer += chunk
+
+
+def append_vouchers(
+    src_path: str,
+    dst_path: str,
+    rows_for_seq: RowsForSeq,
+    sheet_title: str = DEFAULT_SHEET_TITLE,
+) -> AppendSummary:
+    """
+    向已有工作簿追加凭证行，写出到新文件
+
+    只改写目标工作表XML（流式插入新行、更新 dimension），其余部件原样复制；
+    已有单元格不会被解析进内存或重写。凭证序号从工作表中已有的最大序号继续。
+
+    Args:
+        src_path: 已有工作簿路径
+        dst_path: 输出路径（不能与 src_path 相同）；没有可追加的行时不会创建
+        rows_for_seq: 接收起始凭证序号，产出 (凭证序号, 行数据列表)
+        sheet_title: 目标工作表名称（不存在时使用第一个工作表）
+
+    Raises:
+        WorkbookError: 工作簿无法追加（格式错误、内容损坏等），此时不会留下 dst_path
+    """
+    try:
+        return _append_vouchers(src_path, dst_path, rows_for_seq, sheet_title)
+    except BaseException as e:
+        if os.path.exists(dst_path):
+            os.unlink(dst_path)
+        if isinstance(e, CORRUPT_ERRORS):
+            raise WorkbookError(f"工作簿内容损坏或格式不正确: {e}") from e
+        raise
+
+
+def validate_workbook(path: str, sheet_title: str = DEFAULT_SHEET_TITLE):
+    """
+    检查文件是可以追加凭证的工作簿：xlsx格式，目标工作表可以解析，表头中有凭证序号列
+
+    Raises:
+        WorkbookError: 不是可以追加的工作簿
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            _scan_sheet(archive, _resolve_sheet_path(archive, sheet_title))
+    except zipfile.BadZipFile:
+        raise WorkbookError("不是有效的Excel工作簿（xlsx）")
+    except CORRUPT_ERRORS as e:
+        raise WorkbookError(f"工作簿内容损坏或格式不正确: {e}") from e
+
+
+def _append_vouchers(src_path: str, dst_path: str, rows_for_seq: RowsForSeq, sheet_title: str) -> AppendSummary:
+    try:
+        source = zipfile.ZipFile(src_path)
+    except zipfile.BadZipFile:
+        raise WorkbookError("不是有效的Excel工作簿（xlsx）")
+
+    with source:
+        sheet_path = _resolve_sheet_path(source, sheet_title)
+        scan = _scan_sheet(source, sheet_path)
+
+        first_seq = None
+        last_seq = None
+        voucher_count = 0
+        rows: list[dict] = []
+        for seq, voucher_rows in rows_for_seq(scan.last_seq + 1):
+            first_seq = seq if first_seq is None else first_seq
+            last_seq = seq
+            voucher_count += 1
+            rows.extend(voucher_rows)
+        if not rows:
+            return AppendSummary(0, 0, None, None, scan.last_row)
+
+        with source.open(sheet_path) as probe:
+            head = probe.read(COPY_CHUNK_SIZE)
+        prefix_match = SHEET_DATA_OPEN.search(head)
+        prefix = (prefix_match.group(1) or b"").decode() if prefix_match else ""
+        new_last_row = scan.last_row + len(rows)
+        rows_xml = _rows_xml(prefix, rows, scan).encode("utf-8")
+
+        with zipfile.ZipFile(dst_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as target:
+            for info in source.infolist():
+                out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                out_info.compress_type = zipfile.ZIP_DEFLATED
+                out_info.external_attr = info.external_attr
+                with source.open(info) as src, target.open(out_info, "w", force_zip64=True) as dst:
+                    if info.filename == sheet_path:
+                        _rewrite_sheet(src, dst, rows_xml, new_last_row)
+                    else:
+                        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    return AppendSummary(
+        rows_added=len(rows),
+        voucher_count=voucher_count,
+        first_seq=first_seq,
+        last_seq=last_seq,
+        last_row=new_last_row,
+    )
+
+
+class WorkbookService:
+    """服务端保存的工作簿（如每月一个的流水账工作簿）"""
+
+    def __init__(self, workbook_dir: str):
+        self.workbook_dir = workbook_dir
+        os.makedirs(workbook_dir, exist_ok=True)
+
+    def path_for(self, name: str) -> str:
+        """工作簿文件路径（名称只允许字母数字、中文和 -_.() 空格）"""
+        name = name[:-5] if name.lower().endswith(".xlsx") else name
+        if not WORKBOOK_NAME_PATTERN.fullmatch(name) or name.strip(". ") != name.strip() or not name.strip(". "):
+            raise WorkbookError(f"无效的工作簿名称: {name}")
+        return os.path.join(self.workbook_dir, f"{name}.xlsx")
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path_for(name))
+
+    def info(self, name: str) -> Optional[dict]:
+        """工作簿信息，不存在时返回None"""
+        try:
+            stat = os.stat(self.path_for(name))
+        except FileNotFoundError:
+            return None
+        return {
+            "name": os.path.basename(self.path_for(name))[:-5],
+            "size": stat.st_size,
+            "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+        }
+
+    def list(self) -> list[dict]:
+        """列出工作簿，最近修改的在前"""
+        workbooks = [
+            self.info(entry.name)
+            for entry in os.scandir(self.workbook_dir)
+            if entry.is_file() and entry.name.endswith(".xlsx")
+        ]
+        workbooks = [item for item in workbooks if item is not None]
+        return sorted(workbooks, key=lambda item: item["modified_at"], reverse=True)
+
+    def save(self, name: str, fileobj) -> str:
+        """
+        保存（覆盖）工作簿
+
+        Raises:
+            WorkbookError: 上传的不是可以追加凭证的工作簿，此时保留原文件
+        """
+        path = self.path_for(name)
+
+        def write(tmp_path: str):
+            with open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(fileobj, dst, COPY_CHUNK_SIZE)
+            validate_workbook(tmp_path)
+
+        self._replace(path, write)
+        return path
+
+    def delete(self, name: str) -> bool:
+        try:
+            os.unlink(self.path_for(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def append(self, name: str, rows_for_seq: RowsForSeq, template: bytes) -> AppendSummary:
+        """
+        向服务端工作簿追加凭证，工作簿不存在时从模板创建
+
+        追加结果先写临时文件，成功后原子替换原文件（同一工作簿的并发追加需由调用方串行化）。
+        """
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            def write_template(tmp_path: str):
+                with open(tmp_path, "wb") as dst:
+                    dst.write(template)
+
+            self._replace(path, write_template)
+
+        summary = None
+
+        def write(tmp_path: str):
+            nonlocal summary
+            summary = append_vouchers(path, tmp_path, rows_for_seq)
+
+        self._replace(path, write)
+        return summary
+
+    def _replace(self, path: str, write: Callable[[str], None]):
+        """写入临时文件后原子替换目标文件；没有写出内容时保留原文件"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.workbook_dir, suffix=".tmp")
+        os.close(fd)
+        os.unlink(tmp_path)
+        try:
+            write(tmp_path)
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,300 @@
+"""准入控制 - 限制识别请求同时处理的文件数和缓冲的上传字节数，超出时短暂排队，排不上则拒绝"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Optional, Sequence
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class AdmissionRejected(Exception):
+    """容量已满且排队等待超时（或队列已满）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """单个请求超过容量上限，永远无法被接纳"""
+
+
+# 统计 multipart 各部分大小时给该部分的头（Content-Disposition 等）留出的余量，
+# 精确的文件大小仍由识别接口在解析后检查
+PART_HEADER_ALLOWANCE = 16 * 1024
+
+
+class PartSizeCounter:
+    """边接收边统计 multipart 请求体中每个部分的字节数（含该部分的头），不解析内容"""
+
+    def __init__(self, boundary: bytes, limit: int):
+        """
+        Args:
+            boundary: Content-Type 中的分隔符
+            limit: 单个部分的字节数上限
+        """
+        self._delimiter = b"--" + boundary
+        self._limit = limit
+        # 上一块末尾可能是跨块分隔符开头的字节，留到下一块再处理
+        self._tail = b""
+        self._size = 0
+
+    def feed(self, chunk: bytes) -> bool:
+        """接收一块请求体，返回是否仍未超限"""
+        data = self._tail + chunk
+        pos = 0
+        while (index := data.find(self._delimiter, pos)) != -1:
+            self._size += index - pos
+            if self._size > self._limit:
+                return False
+            self._size = 0
+            pos = index + len(self._delimiter)
+        keep = min(len(data) - pos, len(self._delimiter) - 1)
+        self._size += len(data) - pos - keep
+        self._tail = data[len(data) - keep:]
+        return self._size <= self._limit
+
+
+def multipart_boundary(content_type: str) -> Optional[bytes]:
+    """取 multipart/form-data 的分隔符，其他类型返回None"""
+    media_type, *params = [part.strip() for part in content_type.split(";")]
+    if media_type.lower() != "multipart/form-data":
+        return None
+    for param in params:
+        if param.lower().startswith("boundary="):
+            return param[len("boundary="):].strip('"').encode("latin-1") or None
+    return None
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    两类容量：处理中的文件数、已接收（缓冲在内存/临时文件中）的请求体字节数。
+    容量不足时请求按到达顺序排队，最多等待 max_wait 秒；队列已满或等待超时返回拒绝，
+    由调用方转换为 429 + Retry-After。
+    """
+
+    def __init__(
+        self,
+        max_files: int,
+        max_bytes: int,
+        max_queue: int = 32,
+        max_wait: float = 10.0,
+    ):
+        """
+        Args:
+            max_files: 同时处理的文件数上限，0表示不限
+            max_bytes: 同时缓冲的请求体字节数上限，0表示不限
+            max_queue: 排队等待的请求数上限
+            max_wait: 排队最长等待秒数
+        """
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.files = 0
+        self.bytes = 0
+        self._waiters: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+        # 识别请求耗时的指数滑动平均，用于估算 Retry-After
+        self._avg_duration: Optional[float] = None
+
+    def _fits(self, files: int, nbytes: int) -> bool:
+        return (
+            (self.max_files <= 0 or self.files + files <= self.max_files)
+            and (self.max_bytes <= 0 or self.bytes + nbytes <= self.max_bytes)
+        )
+
+    def _take(self, files: int, nbytes: int):
+        self.files += files
+        self.bytes += nbytes
+        # 一个识别请求先按字节、再按文件数申请，只在文件数申请通过时计为接纳一次
+        if files:
+            self.admitted += 1
+
+    async def acquire(self, files: int = 0, nbytes: int = 0):
+        """
+        申请容量，不足时排队等待
+
+        Raises:
+            RequestTooLarge: 请求本身超过容量上限
+            AdmissionRejected: 队列已满或等待超时
+        """
+        if (self.max_files > 0 and files > self.max_files) or (self.max_bytes > 0 and nbytes > self.max_bytes):
+            raise RequestTooLarge(f"请求超过处理上限（最多 {self.max_files} 个文件 / {self.max_bytes} bytes）")
+        if not self._waiters and self._fits(files, nbytes):
+            self._take(files, nbytes)
+            return
+        if len(self._waiters) >= self.max_queue or self.max_wait <= 0:
+            self._reject()
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (files, nbytes, future)
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            return
+        except asyncio.TimeoutError:
+            if future.done():
+                return
+        except BaseException:
+            # 请求被取消：已分配到的容量归还
+            if future.done():
+                self.release(files, nbytes)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._wake()
+        self._reject()
+
+    def release(self, files: int = 0, nbytes: int = 0):
+        """归还容量并唤醒排队的请求"""
+        self.files -= files
+        self.bytes -= nbytes
+        self._wake()
+
+    def _wake(self):
+        """按到达顺序唤醒排队的请求（队首放不下时后面的也不插队）"""
+        while self._waiters:
+            files, nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(files, nbytes):
+                break
+            self._waiters.popleft()
+            self._take(files, nbytes)
+            future.set_result(None)
+
+    def _reject(self):
+        self.rejected += 1
+        retry_after = self.retry_after()
+        raise AdmissionRejected(f"服务繁忙，请 {retry_after} 秒后重试", retry_after)
+
+    def record(self, duration: float):
+        """记录一次识别请求的耗时"""
+        if self._avg_duration is None:
+            self._avg_duration = duration
+        else:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def retry_after(self) -> int:
+        """建议的重试等待秒数：大约一个请求的平均耗时（1~300秒）"""
+        return min(300, max(1, math.ceil(self._avg_duration or 1)))
+
+    def snapshot(self) -> dict:
+        decided = self.admitted + self.rejected
+        return {
+            "inflight_files": self.files,
+            "buffered_bytes": self.bytes,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "reject_rate": round(self.rejected / decided, 4) if decided else 0.0,
+            "avg_duration": round(self._avg_duration, 3) if self._avg_duration is not None else None,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    识别请求的请求体准入
+
+    在读取请求体之前按 Content-Length 申请字节容量（没有 Content-Length 时按上限申请），
+    容量不足时排队，排不上返回 429；请求体超过大小上限时直接返回 413，
+    边接收边计数，超限的请求不必等上传完成。
+    配置了单文件上限的路径同时统计 multipart 每个部分的大小，
+    单个文件超限时同样在接收过程中返回 413，不必等整个请求体缓冲完。
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController,
+        limits: Sequence[tuple[str, int, Optional[int]]],
+    ):
+        """
+        Args:
+            controller: 准入控制器
+            limits: (路径前缀, 请求体大小上限, 单个文件大小上限或None) 列表，按顺序匹配，未匹配的请求不受控制
+        """
+        self.app = app
+        self.controller = controller
+        self.limits = list(limits)
+
+    def _limits_for(self, path: str) -> tuple[Optional[int], Optional[int]]:
+        for prefix, limit, part_limit in self.limits:
+            if path.startswith(prefix):
+                return limit, part_limit
+        return None, None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        limit, part_limit = self._limits_for(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_length = headers.get("content-length")
+        length = int(content_length) if content_length and content_length.isdigit() else None
+        if length is not None and length > limit:
+            response = JSONResponse({"detail": f"请求体超过大小上限 {limit} bytes"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        nbytes = length if length is not None else limit
+        try:
+            await self.controller.acquire(nbytes=nbytes)
+        except RequestTooLarge as e:
+            await JSONResponse({"detail": str(e)}, status_code=413)(scope, receive, send)
+            return
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        boundary = multipart_boundary(headers.get("content-type", "")) if part_limit is not None else None
+        parts = PartSizeCounter(boundary, part_limit + PART_HEADER_ALLOWANCE) if boundary else None
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                # 在解析请求体时抛出，由框架转换为 413 响应
+                if received > min(limit, nbytes):
+                    raise HTTPException(status_code=413, detail=f"请求体超过大小上限 {limit} bytes")
+                if parts is not None and not parts.feed(body):
+                    raise HTTPException(status_code=413, detail=f"文件超过大小上限 {part_limit} bytes")
+            return message
+
+        status_code = None
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, limited_receive, send_wrapper)
+        finally:
+            self.controller.release(nbytes=nbytes)
+            # 只用正常完成的请求估算耗时，被拒绝的请求很快返回，会拉低估计
+            if status_code is not None and status_code < 400:
+                self.controller.record(time.monotonic() - start)
+
@@ -0,0 +1,223 @@
+"""熔断器 - 外部服务连续失败时快速失败，冷却后半开试探恢复"""
+import asyncio
+import math
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+from urllib.parse import urlparse
+
+import httpx
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} 暂时不可用（熔断中），请在 {max(1, math.ceil(retry_after))} 秒后重试")
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed: 正常放行，连续失败达到阈值后打开
+    - open: 直接拒绝请求，冷却时间过后进入半开
+    - half_open: 放行有限数量的试探请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        """
+        Args:
+            name: 熔断器名称（用于错误信息和监控）
+            failure_threshold: 连续失败多少次后打开
+            recovery_timeout: 打开后冷却多少秒进入半开
+            half_open_max_calls: 半开状态下允许同时进行的试探请求数
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_calls = 0
+        self.total_rejected = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        """当前状态（冷却时间已过的打开状态视为半开）"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        """距离进入半开状态还需等待的秒数"""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.recovery_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """当前是否放行请求（不占用半开试探名额）"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            return self._half_open_calls < self.half_open_max_calls
+        return False
+
+    def before_call(self):
+        """
+        请求前检查，被拒绝时抛出 CircuitOpenError
+
+        半开状态下会占用一个试探名额，调用方必须随后调用 record_success 或 record_failure。
+        """
+        if not self.allow_request():
+            self.total_rejected += 1
+            raise CircuitOpenError(self.name, self.retry_after())
+        if self._state == self.HALF_OPEN:
+            self._half_open_calls += 1
+
+    def release(self):
+        """归还 before_call 占用的半开试探名额（请求最终没有发出时调用）"""
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        """记录一次成功调用"""
+        self._consecutive_failures = 0
+        self._half_open_calls = 0
+        self._state = self.CLOSED
+        self._opened_at = None
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        """记录一次失败调用"""
+        if error is not None:
+            self.last_error = str(error)[:200]
+        self._consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        """立即打开熔断器"""
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_calls = 0
+
+    def half_open(self):
+        """立即进入半开状态（例如健康探测成功后）"""
+        if self._state == self.OPEN:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        通过熔断器执行一次调用
+
+        只有上游故障（网络错误、超时、5xx、429）计为失败；
+        其他4xx说明端点本身可用，计为成功；被取消的调用不计入。
+        """
+        self.before_call()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # 调用被取消（对冲请求落后的一方、客户端断开）：既不算成功也不算失败，归还半开试探名额
+            self.release()
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        """导出熔断器状态"""
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "retry_after": round(self.retry_after(), 1),
+            "total_rejected": self.total_rejected,
+            "last_error": self.last_error,
+        }
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """判断异常是否属于上游服务故障"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+
+def endpoint_name(kind: str, url: str) -> str:
+    """由端点URL生成熔断器名称，如 ocr:aip.baidubce.com/rest/2.0/ocr/v1/multiple_invoice"""
+    parsed = urlparse(url if "://" in url else f"https://{url}")
+    return f"{kind}:{parsed.netloc}{parsed.path.rstrip('/')}"
+
+
+class BreakerRegistry:
+    """按名称管理熔断器，同一端点在所有服务实例间共享一个熔断器"""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def configure(self, failure_threshold: int, recovery_timeout: float):
+        """更新默认阈值（同时应用到已创建的熔断器）"""
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        for breaker in self._breakers.values():
+            breaker.failure_threshold = failure_threshold
+            breaker.recovery_timeout = recovery_timeout
+
+    def get(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None,
+    ) -> CircuitBreaker:
+        """获取（不存在时创建）熔断器，可单独指定阈值"""
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=failure_threshold or self.failure_threshold,
+                recovery_timeout=recovery_timeout or self.recovery_timeout,
+            )
+            self._breakers[name] = breaker
+        else:
+            if failure_threshold is not None:
+                breaker.failure_threshold = failure_threshold
+            if recovery_timeout is not None:
+                breaker.recovery_timeout = recovery_timeout
+        return breaker
+
+    def snapshot(self) -> list[dict]:
+        """导出所有熔断器状态"""
+        return [breaker.snapshot() for breaker in self._breakers.values()]
+
+
+# 全局熔断器注册表
+breaker_registry = BreakerRegistry()
@@ -0,0 +1,213 @@
+"""响应压缩 - 按 Accept-Encoding 协商 br / zstd / gzip 压缩JSON等文本响应"""
+import zlib
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时不提供br
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时不提供zstd
+    zstandard = None
+
+
+# 可压缩的响应类型（xlsx、图片等本身已压缩，不再压缩）
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "text/",
+    "image/svg+xml",
+)
+
+# 超过该大小的响应体放到线程中压缩，避免阻塞事件循环
+THREAD_THRESHOLD = 256 * 1024
+
+
+class _Gzip:
+    def __init__(self):
+        self._obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        # 质量5：压缩率明显优于gzip，速度与gzip相当
+        self._obj = brotli.Compressor(quality=5)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+def available_encodings() -> list[str]:
+    """本机可用的压缩编码（按服务端偏好排序）"""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+COMPRESSORS = {"br": _Brotli, "zstd": _Zstd, "gzip": _Gzip}
+
+
+def negotiate(accept_encoding: str, encodings: list[str]) -> Optional[str]:
+    """
+    按 Accept-Encoding 选择压缩编码
+
+    取客户端q值最高的编码，q值相同时按服务端偏好顺序；q=0 表示不接受。
+    """
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件
+
+    只压缩文本类响应且响应体不小于 minimum_size；
+    流式响应逐块压缩，不等待完整响应体。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, encodings: Optional[list[str]] = None):
+        """
+        Args:
+            minimum_size: 小于该大小（字节）的响应不压缩
+            encodings: 启用的编码（按偏好排序），默认使用本机可用的全部编码
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [encoding for encoding in (encodings or available_encodings()) if encoding in COMPRESSORS]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressionResponder:
+    """单个请求的压缩处理：收到首个响应体分块后决定是否压缩"""
+
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message):
+        if message["type"] == "http.response.start":
+            # 等收到响应体再决定是否压缩
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if not _compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+
+            self.compressor = COMPRESSORS[self.encoding]()
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body:
+                # 完整响应体：一次压缩后带 Content-Length 发送
+                compressed = await self._compress_all(body)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            # 流式响应：长度未知，逐块压缩
+            del headers["Content-Length"]
+            await self.send(self.start_message)
+
+        chunk = self.compressor.compress(body)
+        chunk += self.compressor.flush() if more_body else self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _compress_all(self, body: bytes) -> bytes:
+        def compress() -> bytes:
+            return self.compressor.compress(body) + self.compressor.finish()
+        if len(body) >= THREAD_THRESHOLD:
+            return await anyio.to_thread.run_sync(compress)
+        return compress()
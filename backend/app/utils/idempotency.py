@@ -0,0 +1,225 @@
+"""幂等请求 - 带 Idempotency-Key 的识别请求只执行一次，重复请求等待执行中的请求或直接返回已保存的结果"""
+import asyncio
+import hashlib
+import tempfile
+from typing import Optional, Sequence
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..services.idempotency_store import CONFLICT, DONE, PENDING, IdempotencyStore, IdempotentResponse
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+
+# 其他进程正在执行时，轮询结果的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# 计算指纹时暂存请求体，超过该大小转存到临时文件
+SPOOL_MAX_SIZE = 1024 * 1024
+# 回放请求体给应用时每次读取的大小
+RECEIVE_CHUNK_SIZE = 64 * 1024
+
+
+class RequestFingerprint:
+    """
+    请求内容指纹：Content-Type 和请求体的 SHA-256
+
+    multipart 分隔符由客户端每次随机生成，计算时去掉，
+    同一份上传重试时指纹不变，内容不同（换了文件或表单字段）时指纹不同。
+    """
+
+    def __init__(self, content_type: str):
+        params = [part.strip() for part in content_type.split(";")]
+        boundary = next((p[len("boundary="):] for p in params if p.lower().startswith("boundary=")), "")
+        self._boundary = boundary.strip('"').encode("latin-1")
+        # 尚未确定是否属于分隔符的末尾字节
+        self._pending = b""
+        self._hash = hashlib.sha256()
+        self._hash.update(";".join(p for p in params if not p.lower().startswith("boundary=")).lower().encode())
+        self._hash.update(b"\0")
+
+    def update(self, chunk: bytes):
+        if not self._boundary:
+            self._hash.update(chunk)
+            return
+        data = self._pending + chunk
+        size = len(self._boundary)
+        # 最后 size-1 个字节可能是跨块分隔符的开头，留到下一块再处理
+        keep_from = max(len(data) - (size - 1), 0)
+        pos = 0
+        while True:
+            index = data.find(self._boundary, pos, len(data))
+            if index == -1 or index >= keep_from:
+                break
+            self._hash.update(data[pos:index])
+            pos = index + size
+        keep_from = max(keep_from, pos)
+        self._hash.update(data[pos:keep_from])
+        self._pending = data[keep_from:]
+
+    def hexdigest(self) -> str:
+        self._hash.update(self._pending)
+        self._pending = b""
+        return self._hash.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    幂等中间件
+
+    - 第一次请求正常执行，成功（2xx）的响应体保存到幂等记录
+    - 执行中收到相同键的请求：等待执行完成后返回同一个响应
+    - 已完成的键：直接返回保存的响应，带 Idempotent-Replayed: true
+    - 相同的键用于其他接口或内容不同的请求（按 RequestFingerprint 判断）返回422，不会拿到别人的结果
+    - 执行失败（非2xx或异常）不保存，相同的键可以重新执行
+    没有 Idempotency-Key 请求头的请求不受影响。
+    请求体在计算指纹时完整读取（大的转存临时文件）后再交给应用，
+    应位于请求准入中间件内层，超限的上传先由准入中间件拒绝；
+    应位于响应压缩中间件内层，保存和回放的都是未压缩的响应体。
+    """
+
+    def __init__(self, app: ASGIApp, store: IdempotencyStore, paths: Sequence[str]):
+        """
+        Args:
+            store: 幂等记录存储
+            paths: 启用幂等的路径前缀
+        """
+        self.app = app
+        self.store = store
+        self.paths = tuple(paths)
+        # 本进程中执行中的键 -> 执行结束时完成的 Future
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            await JSONResponse({"detail": "无效的 Idempotency-Key"}, status_code=400)(scope, receive, send)
+            return
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as body:
+            fingerprint = await _read_body(scope, receive, body)
+            if fingerprint is None:
+                # 上传过程中客户端已断开
+                return
+            body.seek(0)
+            await self._handle(key, fingerprint, scope, _replay_body(body, receive), send)
+
+    async def _handle(self, key: str, fingerprint: str, scope: Scope, receive: Receive, send: Send):
+        path = scope["path"]
+        attached = False
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                # 本进程正在执行：等待结束后重新检查（成功则回放，失败则由本请求重新执行）
+                attached = True
+                await asyncio.shield(inflight)
+                continue
+            state, saved = await asyncio.to_thread(self.store.begin, key, path, fingerprint)
+            if state == DONE:
+                if attached:
+                    self.store.attached += 1
+                else:
+                    self.store.replayed += 1
+                await _replay(saved)(scope, receive, send)
+                return
+            if state == CONFLICT:
+                response = JSONResponse({"detail": "Idempotency-Key 已用于其他接口或内容不同的请求"}, status_code=422)
+                await response(scope, receive, send)
+                return
+            if state == PENDING:
+                # 其他进程正在执行
+                attached = True
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            break
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            await self._execute(key, scope, receive, send)
+        finally:
+            self._inflight.pop(key, None)
+            future.set_result(None)
+
+    async def _execute(self, key: str, scope: Scope, receive: Receive, send: Send):
+        """执行请求并保存成功的响应"""
+        status_code = None
+        content_type = ""
+        chunks: list[bytes] = []
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            # 客户端已断开（如前端或nginx超时）时继续执行，结果保存后供重试的请求使用
+            try:
+                await send(message)
+            except OSError:
+                pass
+
+        completed = False
+        try:
+            await self.app(scope, receive, send_wrapper)
+            if status_code is not None and 200 <= status_code < 300:
+                response = IdempotentResponse(status_code, content_type, b"".join(chunks))
+                await asyncio.to_thread(self.store.complete, key, response)
+                completed = True
+        finally:
+            if not completed:
+                await asyncio.shield(asyncio.to_thread(self.store.abandon, key))
+
+
+async def _read_body(scope: Scope, receive: Receive, body) -> Optional[str]:
+    """读取完整请求体写入 body，返回内容指纹；客户端中途断开时返回None"""
+    fingerprint = RequestFingerprint(Headers(scope=scope).get("content-type", ""))
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        if chunk:
+            fingerprint.update(chunk)
+            if body._rolled:
+                await asyncio.to_thread(body.write, chunk)
+            else:
+                body.write(chunk)
+        if not message.get("more_body", False):
+            return fingerprint.hexdigest()
+
+
+def _replay_body(body, receive: Receive) -> Receive:
+    """把已读取的请求体重新交给应用，读完后继续转发原始 receive（断开通知等）"""
+    finished = False
+
+    async def replay() -> Message:
+        nonlocal finished
+        if finished:
+            return await receive()
+        if body._rolled:
+            chunk = await asyncio.to_thread(body.read, RECEIVE_CHUNK_SIZE)
+        else:
+            chunk = body.read(RECEIVE_CHUNK_SIZE)
+        finished = len(chunk) < RECEIVE_CHUNK_SIZE
+        return {"type": "http.request", "body": chunk, "more_body": not finished}
+
+    return replay
+
+
+def _replay(saved: IdempotentResponse) -> Response:
+    return Response(
+        content=saved.body,
+        status_code=saved.status_code,
+        media_type=saved.content_type or None,
+        headers={"Idempotent-Replayed": "true"},
+    )
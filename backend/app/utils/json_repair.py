@@ -0,0 +1,152 @@
+"""宽容的JSON修复解析 - 处理大模型输出中常见的格式问题"""
+import json
+from typing import Any
+
+
+def extract_json_block(text: str) -> str:
+    """
+    从大模型回复中提取JSON文本
+
+    依次尝试 ```json 代码块、普通代码块，最后取第一个 { 到最后一个 } 之间的内容，
+    以去除JSON前后多余的说明文字。
+    """
+    text = (text or "").strip().lstrip("﻿")
+
+    if "```json" in text:
+        start = text.find("```json") + 7
+        end = text.find("```", start)
+        text = text[start:end if end != -1 else None].strip()
+    elif "```" in text:
+        start = text.find("```") + 3
+        end = text.find("```", start)
+        text = text[start:end if end != -1 else None].strip()
+
+    start = text.find("{")
+    if start == -1:
+        return text
+    end = text.rfind("}")
+    # 没有闭合括号时（输出被截断）保留到末尾，交给 repair_json 补全
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def repair_json(text: str) -> str:
+    """
+    修复常见的JSON格式错误
+
+    - 对象/数组末尾多余的逗号
+    - Python 字面量 None / True / False
+    - 输出被截断导致的未闭合字符串和括号
+    """
+    out = []
+    stack = []
+    in_string = False
+    escape = False
+    string_start = -1  # 最后一个字符串的起始引号在 out 中的位置
+    i = 0
+    n = len(text)
+
+    while i < n:
+        ch = text[i]
+
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                # 字符串内的裸换行不合法，转义处理
+                out[-1] = "\\n"
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_start = len(out)
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+        elif ch.isalpha():
+            # 裸单词：替换 Python 字面量，其余原样保留
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append({"None": "null", "True": "true", "False": "false"}.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 补全被截断的内容
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    if stack:
+        _strip_dangling(out, stack[-1] == "}", string_start)
+        while stack:
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+
+    return "".join(out)
+
+
+def _strip_trailing_comma(out: list) -> None:
+    """去掉结尾处（忽略空白）多余的逗号"""
+    idx = len(out) - 1
+    while idx >= 0 and out[idx].isspace():
+        idx -= 1
+    if idx >= 0 and out[idx] == ",":
+        del out[idx]
+
+
+def _strip_dangling(out: list, in_object: bool, string_start: int) -> None:
+    """
+    去掉截断处不完整的键值对
+
+    - "key": 之后被截断：补 null
+    - 对象中 "key" 之后被截断（还没有冒号）：去掉这个键
+    - 结尾多余的逗号：去掉
+    """
+    text = "".join(out).rstrip()
+    if text.endswith(":"):
+        # "key": 之后被截断，补一个 null
+        out.append(" null")
+        return
+    if in_object and text.endswith('"') and string_start >= 0:
+        # 最后一个字符串前面是 { 或 , 时它是键而不是值
+        before = "".join(out[:string_start]).rstrip()
+        if before.endswith(("{", ",")):
+            del out[string_start:]
+            _strip_trailing_comma(out)
+            return
+    if text.endswith(","):
+        out[:] = list(text[:-1])
+
+
+def loads_tolerant(text: str) -> tuple[Any, bool]:
+    """
+    宽容地解析JSON
+
+    Returns:
+        (解析结果, 是否经过修复)
+
+    Raises:
+        json.JSONDecodeError: 修复后仍无法解析
+    """
+    json_str = extract_json_block(text)
+    try:
+        return json.loads(json_str), False
+    except json.JSONDecodeError:
+        pass
+    return json.loads(repair_json(json_str)), True
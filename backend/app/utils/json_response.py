@@ -0,0 +1,42 @@
+"""JSON响应 - 识别结果预序列化为JSON字节，跳过FastAPI按 response_model 的二次校验和编码"""
+from typing import Iterable, Optional
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+
+def dump_json(model: BaseModel, exclude: Optional[set] = None) -> bytes:
+    """用pydantic-core直接序列化为JSON字节（不经过中间dict）"""
+    return type(model).__pydantic_serializer__.to_json(model, exclude=exclude)
+
+
+def dump_result(result: BaseModel, include_ocr_text: bool = True, fields: Optional[set] = None) -> bytes:
+    """
+    序列化单条识别结果
+
+    Args:
+        include_ocr_text: 为False时不含OCR文本
+        fields: 只输出这些字段，None表示全部
+    """
+    exclude = None if include_ocr_text else {"ocr_text"}
+    return type(result).__pydantic_serializer__.to_json(result, include=fields, exclude=exclude)
+
+
+def join_results(container: BaseModel, results: Iterable[bytes], field: str = "results") -> bytes:
+    """
+    把已序列化的识别结果拼接进外层对象（如批量识别结果）
+
+    外层对象只序列化除 field 以外的字段，每条结果各自只编码一次。
+    """
+    head = dump_json(container, exclude={field})
+    separator = b"," if len(head) > 2 else b""
+    return b"".join([head[:-1], separator, b'"', field.encode(), b'":[', b",".join(results), b"]}"])
+
+
+class RawJSONResponse(Response):
+    """已序列化的JSON字节直接作为响应体"""
+
+    media_type = "application/json"
+
+    def render(self, content: bytes) -> bytes:
+        return content
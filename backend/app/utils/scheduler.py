@@ -0,0 +1,162 @@
+"""优先级调度 - OCR/大模型调用按通道（交互/批量/后台）和租户加权公平排队，交互通道保留最低容量"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BATCH, BACKGROUND)
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 8.0, BATCH: 2.0, BACKGROUND: 1.0}
+
+# 当前请求所属的 (通道, 租户)，由接口设置，识别流程中创建的子任务自动继承
+_current_lane: ContextVar[tuple[str, str]] = ContextVar("scheduler_lane", default=(BATCH, "default"))
+
+
+def set_lane(lane: str, tenant: str):
+    """设置当前请求的调度通道和租户"""
+    if lane not in LANES:
+        raise ValueError(f"不支持的调度通道: {lane}")
+    _current_lane.set((lane, tenant))
+
+
+def current_lane() -> tuple[str, str]:
+    return _current_lane.get()
+
+
+class PriorityScheduler:
+    """
+    加权公平调度器
+
+    每个 (通道, 租户) 是一个流，按开始时间公平排队（SFQ）：每次调用的虚拟完成时间
+    = max(系统虚拟时间, 该流上次完成时间) + 1/通道权重，空闲槽位总是分给虚拟完成时间最小的请求。
+    同一通道内各租户轮流获得槽位；通道之间按权重分配。
+    另为交互通道保留 reserved 个槽位，批量和后台请求最多占用 capacity - reserved 个。
+    """
+
+    def __init__(self, capacity: int, weights: Optional[dict[str, float]] = None, reserved: int = 0):
+        """
+        Args:
+            capacity: 同时进行的调用数，0表示不限（不排队）
+            weights: 各通道权重
+            reserved: 为交互通道保留的槽位数
+        """
+        self.capacity = capacity
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.reserved = min(reserved, capacity - 1) if capacity > 0 else 0
+        self.running = {lane: 0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._finish: dict[tuple[str, str], float] = {}
+        # 交互通道单独一个堆，保留槽位只能分给它
+        self._queues: dict[bool, list] = {True: [], False: []}
+        self._seq = itertools.count()
+        self.dispatched = {lane: 0 for lane in LANES}
+        self._wait_time = {lane: 0.0 for lane in LANES}
+
+    def _eligible(self, interactive: bool) -> bool:
+        if sum(self.running.values()) >= self.capacity:
+            return False
+        if interactive:
+            return True
+        return self.running[BATCH] + self.running[BACKGROUND] < self.capacity - self.reserved
+
+    def _dispatch(self):
+        """把空闲槽位分给可运行的、虚拟完成时间最小的请求"""
+        while True:
+            candidates = []
+            for interactive, queue in self._queues.items():
+                while queue and queue[0][-1].done():
+                    heapq.heappop(queue)
+                if queue and self._eligible(interactive):
+                    candidates.append(queue)
+            if not candidates:
+                return
+            queue = min(candidates, key=lambda q: q[0][0])
+            finish, start, _, lane, enqueued, future = heapq.heappop(queue)
+            self._start(lane, start, enqueued)
+            future.set_result(None)
+
+    def _start(self, lane: str, start: float, enqueued: float):
+        self.running[lane] += 1
+        self.dispatched[lane] += 1
+        self._wait_time[lane] += time.monotonic() - enqueued
+        self._virtual_time = max(self._virtual_time, start)
+
+    async def acquire(self, lane: Optional[str] = None, tenant: Optional[str] = None):
+        """申请一个槽位，默认使用当前请求的通道和租户"""
+        if self.capacity <= 0:
+            return
+        default_lane, default_tenant = current_lane()
+        lane = lane or default_lane
+        tenant = tenant or default_tenant
+
+        key = (lane, tenant)
+        start = max(self._virtual_time, self._finish.get(key, 0.0))
+        finish = start + 1.0 / self.weights.get(lane, 1.0)
+        self._finish[key] = finish
+        if len(self._finish) > 1000:
+            # 已追上系统虚拟时间的流没有积压，不需要再记
+            self._finish = {k: v for k, v in self._finish.items() if v > self._virtual_time}
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queues[lane == INTERACTIVE],
+            (finish, start, next(self._seq), lane, time.monotonic(), future),
+        )
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(lane)
+            else:
+                future.cancel()
+            raise
+
+    def release(self, lane: str):
+        self.running[lane] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None, tenant: Optional[str] = None):
+        """占用一个槽位执行调用"""
+        if self.capacity <= 0:
+            yield
+            return
+        lane = lane or current_lane()[0]
+        await self.acquire(lane, tenant)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "reserved_interactive": self.reserved,
+            "lanes": {
+                lane: {
+                    "running": self.running[lane],
+                    "waiting": sum(
+                        1 for entry in self._queues[lane == INTERACTIVE]
+                        if entry[3] == lane and not entry[-1].done()
+                    ),
+                    "dispatched": self.dispatched[lane],
+                    "avg_wait": round(self._wait_time[lane] / self.dispatched[lane], 3) if self.dispatched[lane] else 0.0,
+                }
+                for lane in LANES
+            },
+        }
+
+
+def reserved_slots(capacity: int, share: float) -> int:
+    """按比例计算为交互通道保留的槽位数（至少1个）"""
+    if capacity <= 0 or share <= 0:
+        return 0
+    return max(1, math.floor(capacity * share))
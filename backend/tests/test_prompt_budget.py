@@ -0,0 +1,13 @@
+"""上下文预算测试"""
+from app.services.prompt_budget import compress_text
+
+
+def test_compress_keeps_repeated_entries():
+    """多分录凭证中摘要、科目、金额都相同的两条分录不能被合并"""
+    text = "摘要:报销差旅费\n借:管理费用\n100.00\n摘要:报销差旅费\n借:管理费用\n100.00"
+    assert compress_text(text) == text
+
+
+def test_compress_whitespace_and_adjacent_repeats():
+    text = "  合计   金额 \n\n合计 金额\n借\n借\n100.00\n100.00\n"
+    assert compress_text(text) == "合计 金额\n借\n借\n100.00\n100.00"
@@ -0,0 +1,26 @@
+"""OCR文本规范化测试"""
+from app.services.text_normalizer import TextNormalizer
+
+
+def test_repeated_entries_are_kept():
+    """多分录凭证中摘要、科目相同的分录不能被合并"""
+    text = "\n".join([
+        "摘要:报销差旅费",
+        "借:管理费用-差旅费",
+        "1200.00",
+        "摘要:报销差旅费",
+        "借:管理费用-差旅费",
+        "800.00",
+    ])
+    assert TextNormalizer().normalize_text(text) == text
+
+
+def test_adjacent_repeats_are_dropped():
+    """OCR重复识别的紧邻同一行只保留一行，金额行保留"""
+    text = "\n".join(["报销单", "报销单", "借", "借", "100.00", "100.00"])
+    assert TextNormalizer().normalize_text(text) == "\n".join(["报销单", "借", "借", "100.00", "100.00"])
+
+
+def test_amounts_dates_and_boilerplate():
+    text = "开票日期：２０２４年１月５日\n国家税务总局监制\n合计  ¥ 1,234.50"
+    assert TextNormalizer().normalize_text(text) == "开票日期:2024-01-05\n合计 ¥1234.50"
@@ -28,7 +28,7 @@ import {
   SaveOutlined,
 } from '@ant-design/icons'
 import type { ColumnsType } from 'antd/es/table'
-import { exportExcel, RecognitionResult, VoucherData } from '../services/api'
+import { exportExcel, exportStoredResults, RecognitionResult, VoucherData } from '../services/api'
 
 const { Title, Text, Paragraph } = Typography
 const { Panel } = Collapse
@@ -56,15 +56,16 @@ const ResultPage: React.FC<ResultPageProps> = ({ results }) => {
   const getImageUrl = (record: RecognitionResult) => {
     // 优先使用API返回的image_url
     if (record.image_url) {
-      // 如果image_url是绝对路径，直接使用；否则加上API前缀
-      return record.image_url.startsWith('http') 
-        ? record.image_url 
-        : `${import.meta.env.VITE_API_URL || '/api'}${record.image_url}`
+      return withApiBase(record.image_url)
     }
     // 降级方案：使用文件名构建URL（兼容旧数据）
     return `${import.meta.env.VITE_API_URL || '/api'}/uploads/${record.filename}`
   }
 
+  // 如果URL是绝对路径，直接使用；否则加上API前缀
+  const withApiBase = (url: string) =>
+    url.startsWith('http') ? url : `${import.meta.env.VITE_API_URL || '/api'}${url}`
+
   // 查看详情
   const handleViewDetail = (record: RecognitionResult) => {
     setSelectedResult(record)
@@ -82,17 +83,18 @@ const ResultPage: React.FC<ResultPageProps> = ({ results }) => {
   // 导出Excel
   const handleExportExcel = async () => {
     try {
-      // 只导出成功识别的凭证
-      const vouchers = editedResults
-        .filter((r) => r.success && r.voucher_data)
-        .map((r) => r.voucher_data as VoucherData)
+      // 只导出成功识别的凭证（跳过重复图片，避免重复记账）
+      const exportable = editedResults.filter((r) => r.success && r.voucher_data && !r.duplicate_of)
 
-      if (vouchers.length === 0) {
+      if (exportable.length === 0) {
         message.warning('没有可导出的凭证数据')
         return
       }
 
-      const blob = await exportExcel(vouchers)
+      // 结果都已保存到结果库时按ID导出，否则回传凭证数据
+      const blob = exportable.every((r) => r.result_id !== undefined && r.result_id !== null)
+        ? await exportStoredResults(exportable.map((r) => r.result_id as number))
+        : await exportExcel(exportable.map((r) => r.voucher_data as VoucherData))
 
       // 下载文件
       const url = window.URL.createObjectURL(blob)
@@ -132,10 +134,11 @@ const ResultPage: React.FC<ResultPageProps> = ({ results }) => {
       key: 'thumbnail',
       width: 120,
       render: (_, record) => {
+        // 列表中使用缩略图，点击预览时加载中等尺寸预览图，没有派生图时使用原图
         const imageUrl = getImageUrl(record)
         return (
           <Image
-            src={imageUrl}
+            src={record.thumbnail_url ? withApiBase(record.thumbnail_url) : imageUrl}
             alt={record.filename}
             width={80}
             height={60}
@@ -145,7 +148,7 @@ const ResultPage: React.FC<ResultPageProps> = ({ results }) => {
               cursor: 'pointer',
             }}
             preview={{
-              src: imageUrl,
+              src: record.preview_url ? withApiBase(record.preview_url) : imageUrl,
             }}
             fallback="data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iODAiIGhlaWdodD0iNjAiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+PHJlY3Qgd2lkdGg9IjgwIiBoZWlnaHQ9IjYwIiBmaWxsPSIjMmQzNjNmIi8+PHRleHQgeD0iNDAiIHk9IjMwIiBmb250LWZhbWlseT0iQXJpYWwiIGZvbnQtc2l6ZT0iMTIiIGZpbGw9IiM5YWEwYTYiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGR5PSIuM2VtIj7lm77niYfliqDovb3lpLHotKU8L3RleHQ+PC9zdmc+"
           />
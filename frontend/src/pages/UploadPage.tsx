@@ -49,12 +49,13 @@ const UploadPage: React.FC<UploadPageProps> = ({
   const uploadProps: UploadProps = {
     name: 'file',
     multiple: true,
-    accept: 'image/*,.jpg,.jpeg,.png,.gif,.bmp,.webp',
+    accept: 'image/*,.jpg,.jpeg,.png,.gif,.bmp,.webp,.pdf,application/pdf',
     fileList,
     beforeUpload: (file) => {
-      // 验证文件类型
+      // 验证文件类型（图片或PDF）
       const isImage = file.type.startsWith('image/')
-      if (!isImage) {
+      const isPdf = file.type === 'application/pdf' || file.name.toLowerCase().endsWith('.pdf')
+      if (!isImage && !isPdf) {
         return Upload.LIST_IGNORE
       }
       // 验证文件大小（10MB）
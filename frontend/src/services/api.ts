@@ -26,6 +26,7 @@ export interface OCRConfig {
   api_key: string
   secret_key?: string
   endpoint?: string
+  cascade?: boolean
 }
 
 export interface LLMConfig {
@@ -33,6 +34,8 @@ export interface LLMConfig {
   api_key: string
   model?: string
   endpoint?: string
+  // 在 model 之前依次尝试的较小模型（级联），不传时使用服务端配置
+  cascade?: string[]
 }
 
 export interface VoucherEntry {
@@ -70,19 +73,36 @@ export interface VoucherData {
   entries: VoucherEntry[]
 }
 
+export interface VoucherValidation {
+  valid: boolean
+  issues: string[]  // 问题说明
+  codes: string[]  // 问题代码，如 unbalanced、bad_date
+  debit_total: number
+  credit_total: number
+}
+
 export interface RecognitionResult {
   success: boolean
   filename: string
-  image_url?: string  // 图片URL，用于显示缩略图
+  image_url?: string  // 原图URL
+  thumbnail_url?: string  // 缩略图URL（约240px），用于列表展示
+  preview_url?: string  // 预览图URL（约1280px），用于查看大图
   ocr_text?: string
   voucher_data?: VoucherData
   error?: string
+  duplicate_of?: string  // 重复图片：结果复用自该文件，导出时跳过
+  possible_duplicate_of?: string  // 疑似重复：图片与该文件相似，仍单独识别和导出，需人工核对
+  result_id?: number  // 结果库中的ID，可按ID导出
+  validation?: VoucherValidation  // 借贷平衡等校验结果
 }
 
 export interface BatchRecognitionResult {
+  batch_id?: string
   total: number
   success_count: number
   failed_count: number
+  duplicate_count?: number
+  invalid_count?: number  // 未通过校验的结果数
   results: RecognitionResult[]
 }
 
@@ -128,12 +148,29 @@ export const getConfig = async (): Promise<ConfigStatus> => {
   return api.get('/config')
 }
 
+// 幂等键：同一组文件（文件名、大小、修改时间均相同）重新提交时使用相同的键，
+// 请求超时后重新上传不会重复识别，服务端等待原请求完成或直接返回已保存的结果
+const idempotencyKey = (kind: string, files: File[]): string => {
+  const text = files.map((file) => `${file.name}:${file.size}:${file.lastModified}`).join('|')
+  // cyrb53 字符串哈希（53位），两组32位结果拼接
+  let h1 = 0xdeadbeef
+  let h2 = 0x41c6ce57
+  for (let i = 0; i < text.length; i++) {
+    const ch = text.charCodeAt(i)
+    h1 = Math.imul(h1 ^ ch, 2654435761)
+    h2 = Math.imul(h2 ^ ch, 1597334677)
+  }
+  h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909)
+  h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909)
+  return `${kind}-${files.length}-${(h2 >>> 0).toString(16)}${(h1 >>> 0).toString(16)}`
+}
+
 // 识别单张凭证
 export const recognizeSingle = async (file: File): Promise<RecognitionResult> => {
   const formData = new FormData()
   formData.append('file', file)
   return api.post('/recognize/single', formData, {
-    headers: { 'Content-Type': 'multipart/form-data' },
+    headers: { 'Content-Type': 'multipart/form-data', 'Idempotency-Key': idempotencyKey('single', [file]) },
   })
 }
 
@@ -144,7 +181,7 @@ export const recognizeBatch = async (files: File[]): Promise<BatchRecognitionRes
     formData.append('files', file)
   })
   return api.post('/recognize/batch', formData, {
-    headers: { 'Content-Type': 'multipart/form-data' },
+    headers: { 'Content-Type': 'multipart/form-data', 'Idempotency-Key': idempotencyKey('batch', files) },
   })
 }
 
@@ -156,6 +193,14 @@ export const exportExcel = async (vouchers: VoucherData[]): Promise<Blob> => {
   return response.data
 }
 
+// 按结果库中的识别结果ID导出Excel（服务端组装，无需回传凭证数据）
+export const exportStoredResults = async (resultIds: number[]): Promise<Blob> => {
+  const response = await axios.post(`${API_BASE_URL}/export/excel/results`, { result_ids: resultIds }, {
+    responseType: 'blob',
+  })
+  return response.data
+}
+
 // 下载模板
 export const downloadTemplate = async (): Promise<Blob> => {
   const response = await axios.get(`${API_BASE_URL}/export/template`, {
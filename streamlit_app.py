@@ -16,7 +16,11 @@ sys.path.insert(0, str(backend_path))
 
 # 导入后端模块
 from app.config import get_settings
-from app.services import OCRService, LLMService, ExcelService
+from app.services import OCRService, LLMService, ExcelService, ResultsStore
+from app.services.dedup_service import DedupIndex, fingerprint
+from app.services.pdf_service import PDFService, is_pdf
+from app.services.llm_service import VoucherParseError
+from app.models import VoucherData
 from app.data import get_subjects_list
 
 # 页面配置
@@ -27,6 +31,14 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource
+def get_results_store() -> Optional[ResultsStore]:
+    """识别结果库（所有会话共用）"""
+    settings = get_settings()
+    if not settings.results_store_enabled:
+        return None
+    return ResultsStore(settings.results_db_path)
+
 # 密码常量
 APP_PASSWORD = "li123456"
 
@@ -126,10 +138,10 @@ def upload_page():
     
     # 文件上传
     uploaded_files = st.file_uploader(
-        "选择凭证图片",
-        type=["jpg", "jpeg", "png", "gif", "bmp", "webp"],
+        "选择凭证图片或PDF",
+        type=["jpg", "jpeg", "png", "gif", "bmp", "webp", "pdf"],
         accept_multiple_files=True,
-        help="支持批量上传，每批最多10张图片"
+        help="支持批量上传，每批最多10个文件；多页PDF会按凭证自动分组"
     )
     
     if uploaded_files:
@@ -139,7 +151,10 @@ def upload_page():
         cols = st.columns(min(5, len(uploaded_files)))
         for idx, file in enumerate(uploaded_files[:5]):
             with cols[idx % 5]:
-                st.image(file, use_container_width=True)
+                if file.name.lower().endswith(".pdf"):
+                    st.markdown("📄 PDF")
+                else:
+                    st.image(file, use_container_width=True)
                 st.caption(file.name)
         
         if len(uploaded_files) > 5:
@@ -150,6 +165,54 @@ def upload_page():
         if uploaded_files:
             recognize_files(uploaded_files)
 
+def recognize_pdf(filename: str, pdf_bytes: bytes) -> List[dict]:
+    """识别多页PDF：逐页并行OCR，按凭证分组后调用大模型"""
+    import tempfile
+    
+    settings = get_settings()
+    pdf_service = PDFService(dpi=settings.pdf_dpi, concurrency=settings.pdf_ocr_concurrency)
+    
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_bytes)
+        tmp_path = tmp.name
+    try:
+        pages = asyncio.run(pdf_service.ocr_pages(tmp_path, st.session_state.ocr_service))
+    finally:
+        os.unlink(tmp_path)
+    
+    groups = pdf_service.group_pages(pages)
+    results = []
+    for group in groups:
+        page_numbers = group.page_numbers
+        name = f"{filename}#第{page_numbers[0]}-{page_numbers[-1]}页" if len(groups) > 1 else filename
+        ocr_text = group.ocr_text
+        if not ocr_text.strip():
+            errors = [page.error for page in group.pages if page.error]
+            results.append({
+                "success": False,
+                "filename": name,
+                "error": "; ".join(errors) or "OCR未识别到任何文字"
+            })
+            continue
+        try:
+            voucher_data = asyncio.run(st.session_state.llm_service.recognize_voucher(ocr_text))
+        except VoucherParseError as e:
+            results.append({
+                "success": False,
+                "filename": name,
+                "ocr_text": ocr_text,
+                "error": str(e)
+            })
+            continue
+        results.append({
+            "success": True,
+            "filename": name,
+            "ocr_text": ocr_text,
+            "voucher_data": voucher_data.model_dump(),
+            "pages": page_numbers
+        })
+    return results
+
 def recognize_files(files: List):
     """识别文件"""
     BATCH_SIZE = 10
@@ -159,6 +222,8 @@ def recognize_files(files: List):
     status_text = st.empty()
     
     all_results = []
+    # 重复图片只识别一次，其余副本复用结果
+    dedup_index = DedupIndex(max_entries=len(files))
     
     for batch_idx, batch in enumerate(batches):
         status_text.text(f"正在处理第 {batch_idx + 1}/{len(batches)} 批，共 {len(batch)} 张图片...")
@@ -169,6 +234,18 @@ def recognize_files(files: List):
                 # 读取文件
                 file_bytes = file.read()
                 
+                if is_pdf(file_bytes[:8]):
+                    with st.spinner(f"PDF识别中: {file.name}..."):
+                        all_results.extend(recognize_pdf(file.name, file_bytes))
+                    continue
+                
+                fp = fingerprint(file_bytes)
+                match = dedup_index.find(fp)
+                if match:
+                    original_filename, original = match
+                    all_results.append({**original, "filename": file.name, "duplicate_of": original_filename})
+                    continue
+                
                 # OCR识别（异步）
                 with st.spinner(f"OCR识别中: {file.name}..."):
                     ocr_text = asyncio.run(st.session_state.ocr_service.recognize(file_bytes))
@@ -179,6 +256,7 @@ def recognize_files(files: List):
                         "filename": file.name,
                         "error": "OCR未识别到任何文字"
                     })
+                    dedup_index.add(fp, file.name, all_results[-1])
                     continue
                 
                 # LLM结构化（异步）
@@ -191,8 +269,9 @@ def recognize_files(files: List):
                     "success": True,
                     "filename": file.name,
                     "ocr_text": ocr_text,
-                    "voucher_data": voucher_data
+                    "voucher_data": voucher_data.model_dump()
                 })
+                dedup_index.add(fp, file.name, all_results[-1])
                 
             except Exception as e:
                 all_results.append({
@@ -208,15 +287,52 @@ def recognize_files(files: List):
     
     # 保存结果
     st.session_state.recognition_results = all_results
+    store = get_results_store()
+    if store is not None and all_results:
+        try:
+            llm = st.session_state.llm_service
+            store.save_batch(
+                "streamlit",
+                all_results,
+                ocr_provider=st.session_state.ocr_service.provider_name,
+                llm_provider=llm.provider,
+                llm_model=llm.model,
+            )
+        except Exception as e:
+            st.warning(f"识别结果保存失败: {str(e)}")
     
     # 切换到结果页面
     st.success(f"识别完成！成功: {sum(1 for r in all_results if r['success'])}, 失败: {sum(1 for r in all_results if not r['success'])}")
     st.info("请切换到「识别结果」页面查看详情")
 
+def load_history_batch():
+    """从结果库加载历史批次，无需重新识别即可查看和导出"""
+    store = get_results_store()
+    if store is None:
+        return
+    _, batches = store.list_batches(limit=50)
+    if not batches:
+        return
+    with st.expander("📂 加载历史识别结果"):
+        labels = {
+            batch["id"]: f"{batch['created_at']}  {batch['filename'] or batch['source']}  "
+                         f"（{batch['total']} 条，成功 {batch['success_count']}）"
+            for batch in batches
+        }
+        batch_id = st.selectbox("选择批次", list(labels), format_func=labels.get)
+        if st.button("加载"):
+            _, rows = store.query_results(batch_id=batch_id, limit=None, include_ocr_text=True)
+            for row in rows:
+                if row["voucher_data"] is not None:
+                    row["voucher_data"] = row["voucher_data"].model_dump()
+            st.session_state.recognition_results = rows
+            st.rerun()
+
 def result_page():
     """识别结果页面"""
     st.title("📊 识别结果")
     
+    load_history_batch()
     results = st.session_state.recognition_results
     
     if not results:
@@ -324,8 +440,9 @@ def export_excel(results: List):
         # 收集所有成功的凭证数据
         vouchers = []
         for result in results:
-            if result.get("success") and result.get("voucher_data"):
-                vouchers.append(result["voucher_data"])
+            # 跳过重复图片，避免重复记账
+            if result.get("success") and result.get("voucher_data") and not result.get("duplicate_of"):
+                vouchers.append(VoucherData.model_validate(result["voucher_data"]))
         
         if not vouchers:
             st.error("没有可导出的凭证数据")